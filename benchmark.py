@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LBK DataAlert 性能基准脚本
+
+用合成数据测量报表流水线各环节的吞吐量。
+使用方法: python benchmark.py tables --dimensions 10000 --days 60
+          python benchmark.py render --images 20
+          python benchmark.py suite --sizes small,medium
+          python benchmark.py history
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shlex
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import daily_report_generator
+from daily_report_generator import DailyReportGenerator, RollupCube
+
+# 基准规模：天数、总监数、每个总监的BD数、每个BD的总代理数
+SIZES = {
+    'small': {'days': 30, 'supervisors': 3, 'bds': 4, 'kols': 5},
+    'medium': {'days': 90, 'supervisors': 10, 'bds': 10, 'kols': 20},
+    'huge': {'days': 180, 'supervisors': 20, 'bds': 15, 'kols': 30},
+}
+
+# 按人数/次数计的原始列（其余数值列为金额）
+COUNT_COLUMN_MARKERS = ('人数', '用户', '次数', 'FTD', 'FTT', 'EFTT')
+
+# 可以为负的金额列
+SIGNED_COLUMNS = ('净充值折U', '合约净划入', '合约赠金净划入', '合约交易平仓盈亏')
+
+
+def synthetic_bd_daily(generator, n_dimensions, n_days, n_supervisors=50, seed=0, end_date='2025-10-14'):
+    """生成与 aggregate_data 输出结构一致的BD级每日数据"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=end_date, periods=n_days, freq='D').strftime('%Y-%m-%d')
+
+    supervisors = np.array([f'sup_{i % n_supervisors}' for i in range(n_dimensions)], dtype=object)
+    bds = np.array([f'bd_{i}' for i in range(n_dimensions)], dtype=object)
+    dimensions = supervisors + ' - ' + bds
+
+    n_rows = n_dimensions * n_days
+    df = pd.DataFrame({
+        'Dimension': np.repeat(dimensions, n_days),
+        'Supervisor': np.repeat(supervisors, n_days),
+        'BD': np.repeat(bds, n_days),
+        'Date': np.tile(dates.to_numpy(dtype=object), n_dimensions),
+    })
+    for col in generator.display_columns[1:]:
+        if col in generator.int_columns:
+            df[col] = rng.poisson(20, n_rows)
+        else:
+            values = rng.exponential(5000, n_rows) * (rng.random(n_rows) < 0.8)
+            df[col] = np.round(values, 2)
+    return df
+
+
+def synthetic_raw_csv(path, days, supervisors, bds, kols, seed=0, end_date='2025-10-14',
+                      density=0.7, resigned=0.05):
+    """生成与真实导出结构一致的 raw_data.csv，返回行数
+    
+    每个 (日期, 总监, BD, 总代理) 组合以 density 的概率出现一行；每个BD下有一个空总代理
+    （BD直属用户），约 resigned 比例的BD名称带'离职'，另有一位离职总监和一组无总监的BD。
+    """
+    rng = np.random.default_rng(seed)
+    generator = DailyReportGenerator()
+    
+    # 层级：总监 → BD → 总代理（含离职总监和无总监的BD）
+    supervisor_names = [f'sup_{i}' for i in range(supervisors)] + ['离职总监', '']
+    hierarchy = []
+    for s, supervisor in enumerate(supervisor_names):
+        for b in range(bds):
+            bd = f'bd_{s}_{b}'
+            if rng.random() < resigned:
+                bd = f'{bd}(离职)'
+            for k in range(kols):
+                hierarchy.append((supervisor, bd, f'kol_{s}_{b}_{k}' if k else ''))
+    hierarchy = np.array(hierarchy, dtype=object)
+    
+    dates = pd.date_range(end=end_date, periods=days, freq='D').strftime('%Y-%m-%d').to_numpy(dtype=object)
+    present = rng.random((days, len(hierarchy))) < density
+    date_index, entity_index = np.nonzero(present)
+    n_rows = len(date_index)
+    
+    df = pd.DataFrame({
+        '统计日期': dates[date_index],
+        '商务总监': hierarchy[entity_index, 0],
+        '商务BD': hierarchy[entity_index, 1],
+        '总代理': hierarchy[entity_index, 2],
+    })
+    for col in generator.numeric_columns:
+        if any(marker in col for marker in COUNT_COLUMN_MARKERS):
+            values = rng.poisson(3, n_rows).astype(float)
+        else:
+            values = np.round(rng.exponential(800, n_rows) * (rng.random(n_rows) < 0.8), 2)
+            if col in SIGNED_COLUMNS:
+                values = np.round(values - 400, 2)
+        df[col] = values
+    # 报表不读取的其他列
+    df['备注'] = ''
+    df.to_csv(path, index=False)
+    return n_rows
+
+
+def _best_time(func, repeat):
+    """运行 repeat 次，返回最短耗时（秒）和最后一次的结果"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def git_commit():
+    """当前提交（短哈希）以及工作区是否有未提交的修改（以本脚本所在的仓库为准）"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(status)
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+
+def bench_size(size, params, args, work_dir):
+    """在一个规模上测量各函数和完整 main() 的耗时"""
+    csv_path = os.path.join(work_dir, 'raw_data.csv')
+    start = time.perf_counter()
+    n_rows = synthetic_raw_csv(csv_path, seed=args.seed, **params)
+    print(f"\n[{size}] {params} -> {n_rows:,} 行（生成 {time.perf_counter() - start:.1f}s）")
+    
+    generator = DailyReportGenerator(renderer=args.renderer)
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['read_raw_csv'], raw = _best_time(lambda: generator.read_raw_csv(csv_path), args.repeat)
+        results['process_raw_data'], processed = _best_time(
+            lambda: generator.process_raw_data(raw.copy(), verbose=False), args.repeat)
+        results['aggregate_data'], aggregated = _best_time(lambda: generator.aggregate_data(processed), args.repeat)
+        results['aggregate_data_by_kol'], _ = _best_time(lambda: generator.aggregate_data_by_kol(processed),
+                                                         args.repeat)
+        
+        # 逐个BD构建表格（不带预先计算的汇总，即单独调用时的路径）
+        partitions = list(generator.partition_by(aggregated, 'Dimension').values())[:args.tables]
+        results['create_table_data'], _ = _best_time(
+            lambda: [generator.create_table_data(partition) for partition in partitions], args.repeat)
+        results['create_table_data_per_table'] = results['create_table_data'] / max(len(partitions), 1)
+        
+        # 团队报表（含渲染和写文件），取前几位总监
+        teams = list(generator.partition_by(aggregated, 'Supervisor').items())[:args.teams]
+        team_dir = os.path.join(work_dir, 'supervisor_reports')
+        results['create_supervisor_report'], _ = _best_time(
+            lambda: [generator.create_supervisor_report(name or 'Other', data, team_dir) for name, data in teams], 1)
+        results['create_supervisor_report_per_report'] = results['create_supervisor_report'] / max(len(teams), 1)
+    
+    # 完整运行（在临时目录中执行 main()，并收集其运行指标）
+    main_stages = {}
+    if not args.skip_main:
+        argv = ['generate', '--csv', csv_path, '--renderer', args.renderer, '--metrics', 'run_metrics.json']
+        argv += shlex.split(args.main_args)
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                daily_report_generator.main(argv)
+                results['main'] = time.perf_counter() - start
+            with open('run_metrics.json', 'r', encoding='utf-8') as f:
+                main_stages = {name: stage['wall_s'] for name, stage in json.load(f)['stages'].items()}
+        finally:
+            os.chdir(cwd)
+    
+    for name, seconds in results.items():
+        print(f"  {name:<38} {seconds * 1000:>12.1f} ms")
+    
+    return {
+        'size': size,
+        'params': params,
+        'rows': n_rows,
+        'tables': len(partitions),
+        'teams': len(teams),
+        'results': results,
+        'main_stages': main_stages,
+    }
+
+
+def bench_suite(args):
+    """各规模下的流水线基准，结果按提交追加到 jsonl 文件"""
+    commit, dirty = git_commit()
+    sizes = args.sizes.split(',')
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        print(f"未知的规模: {', '.join(unknown)}（可选 {', '.join(SIZES)}）")
+        return 1
+    
+    records = []
+    for size in sizes:
+        params = dict(SIZES[size])
+        if args.days:
+            params['days'] = args.days
+        work_dir = tempfile.mkdtemp(prefix=f'lbk_bench_{size}_')
+        try:
+            record = bench_size(size, params, args, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        record.update({
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'renderer': args.renderer,
+            'main_args': args.main_args,
+            'repeat': args.repeat,
+        })
+        records.append(record)
+    
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + '\n')
+        print(f"\n结果已追加到 {args.output}（提交 {commit or '未知'}{'，有未提交修改' if dirty else ''}）")
+    return 0
+
+
+def bench_history(args):
+    """按提交列出各规模的历史结果，并标出相对上一次的变化"""
+    if not os.path.exists(args.output):
+        print(f"没有找到 {args.output}")
+        return 1
+    with open(args.output, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    
+    # 只在同一规模、同一渲染后端的结果之间比较
+    names = args.functions.split(',')
+    for size, renderer in dict.fromkeys((record['size'], record['renderer']) for record in records):
+        print(f"\n[{size} / {renderer}]")
+        print(f"  {'commit':<12}{'timestamp':<21}" + ''.join(f'{name:>26}' for name in names))
+        previous = {}
+        for record in records:
+            if (record['size'], record['renderer']) != (size, renderer):
+                continue
+            commit = (record['commit'] or '?') + ('*' if record['dirty'] else '')
+            cells = []
+            for name in names:
+                seconds = record['results'].get(name)
+                if seconds is None:
+                    cells.append(f"{'-':>26}")
+                    continue
+                change = f" ({(seconds / previous[name] - 1) * 100:+.0f}%)" if previous.get(name) else ''
+                cells.append(f"{seconds * 1000:.1f}ms{change}".rjust(26))
+                previous[name] = seconds
+            print(f"  {commit:<12}{record['timestamp']:<21}" + ''.join(cells))
+    return 0
+
+
+def bench_tables(args):
+    """BD表格构建吞吐量（不含渲染）"""
+    generator = DailyReportGenerator()
+    daily = synthetic_bd_daily(generator, args.dimensions, args.days, seed=args.seed)
+    cube = RollupCube(generator, bd_daily=daily)
+
+    # 分区和周期汇总在整次运行中只算一次，不计入表格构建时间
+    partitions = cube.partitions('bd')
+    cube.partitions('bd', 'month')
+    cube.partitions('bd', 'total')
+    keys = list(partitions)[:args.limit] if args.limit else list(partitions)
+
+    rows = 0
+    start = time.perf_counter()
+    for key in keys:
+        table_data = generator.create_table_data(partitions[key], rollups=cube.entity_rollups('bd', key))[0]
+        rows += len(table_data)
+    elapsed = time.perf_counter() - start
+
+    print(f"BD表格: {len(keys)} 个维度, {rows} 行, {elapsed:.2f}s, "
+          f"{rows / elapsed:,.0f} 行/秒, {len(keys) / elapsed:,.1f} 表/秒")
+
+
+def png_size(path):
+    """PNG图片的 (宽, 高)，从文件头的 IHDR 块读取"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    return struct.unpack('>II', header[16:24])
+
+
+def bench_render(args):
+    """单张表格图片的渲染耗时（matplotlib 对比 Pillow，两者分辨率相同）"""
+    generator = DailyReportGenerator()
+    daily = synthetic_bd_daily(generator, args.images, args.days, seed=args.seed)
+    cube = RollupCube(generator, bd_daily=daily)
+    partitions = cube.partitions('bd')
+    tables = [generator.create_table_data(partitions[key], rollups=cube.entity_rollups('bd', key))
+              for key in partitions]
+    
+    timings = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for renderer in args.renderers.split(','):
+            generator = DailyReportGenerator(renderer=renderer)
+            start = time.perf_counter()
+            for i, (table_data, available_columns, business_name, _) in enumerate(tables):
+                output_path = os.path.join(output_dir, f'{renderer}_{i}.png')
+                generator.render_table_report(table_data, available_columns, business_name, output_path)
+            timings[renderer] = (time.perf_counter() - start) / len(tables)
+            size = png_size(output_path)
+            print(f"{renderer}: {len(tables)} 张, 平均 {timings[renderer] * 1000:.1f} ms/张, {size[0]}x{size[1]} 像素")
+    
+    if 'matplotlib' in timings and 'pillow' in timings:
+        print(f"Pillow 提速: {timings['matplotlib'] / timings['pillow']:.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='LBK DataAlert 性能基准')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    tables = subparsers.add_parser('tables', help='表格构建吞吐量')
+    tables.add_argument('--dimensions', type=int, default=10000, help='合成BD维度数')
+    tables.add_argument('--days', type=int, default=60, help='每个维度的天数')
+    tables.add_argument('--limit', type=int, default=0, help='只测量前N个维度（0表示全部）')
+    tables.add_argument('--seed', type=int, default=0)
+    tables.set_defaults(func=bench_tables)
+    
+    render = subparsers.add_parser('render', help='表格图片渲染耗时')
+    render.add_argument('--images', type=int, default=20, help='渲染的图片数')
+    render.add_argument('--days', type=int, default=60, help='每个维度的天数')
+    render.add_argument('--renderers', default='matplotlib,pillow', help='逗号分隔的渲染后端')
+    render.add_argument('--seed', type=int, default=0)
+    render.set_defaults(func=bench_render)
+    
+    suite = subparsers.add_parser('suite', help='合成 raw_data.csv 上的流水线基准（按提交记录结果）')
+    suite.add_argument('--sizes', default='small,medium', help=f"逗号分隔的规模（{', '.join(SIZES)}）")
+    suite.add_argument('--days', type=int, default=0, help='覆盖各规模的天数（0表示使用预设）')
+    suite.add_argument('--repeat', type=int, default=3, help='各函数重复次数（取最短耗时）')
+    suite.add_argument('--tables', type=int, default=200, help='create_table_data 测量的BD数')
+    suite.add_argument('--teams', type=int, default=3, help='create_supervisor_report 测量的总监数')
+    suite.add_argument('--renderer', choices=['matplotlib', 'pillow'], default='matplotlib')
+    suite.add_argument('--main-args', default='--skip-kol --no-render-cache',
+                       help='完整运行 main() 时附加的命令行参数')
+    suite.add_argument('--skip-main', action='store_true', help='不测量完整的 main()')
+    suite.add_argument('--output', default='benchmark_results.jsonl', help='结果文件（空字符串表示不保存）')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.set_defaults(func=bench_suite)
+    
+    history = subparsers.add_parser('history', help='按提交查看基准结果的变化')
+    history.add_argument('--output', default='benchmark_results.jsonl', help='结果文件')
+    history.add_argument('--functions', default='process_raw_data,aggregate_data,create_table_data,main',
+                         help='逗号分隔的显示项')
+    history.set_defaults(func=bench_history)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,121 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.table import Table
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
+import sys
 import calendar
+import hashlib
+import json
+import glob
+import argparse
+import sqlite3
+import time
+import io
+import threading
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+try:
+    import zstandard  # noqa: F401
+    HAS_ZSTANDARD = True
+except ImportError:
+    HAS_ZSTANDARD = False
+
+# 解析缓存版本号：process_raw_data 的清洗规则变化时需要递增
+PARSE_CACHE_VERSION = 4
+
+# 聚合存储版本号：聚合结果的列结构变化时需要递增
+AGGREGATE_STORE_VERSION = 3
+
+# 渲染版本号：表格样式或版式变化时需要递增，使渲染缓存全部失效
+RENDER_STYLE_VERSION = 3
+
+# 报表图片分辨率（matplotlib 和 Pillow 两个渲染后端相同）
+REPORT_DPI = 200
+
+# 目录输入时识别的数据文件（压缩文件由 pandas 按后缀解压）
+INPUT_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+
+# 多个数据文件合并时的自然键：同一键以排序靠后的文件为准
+NATURAL_KEY_COLUMNS = ['统计日期', '商务总监', '商务BD', '总代理']
+
+# 中文字体候选（按顺序回退）
+FONT_FAMILIES = ['Arial Unicode MS', 'SimHei', 'DejaVu Sans']
+
+# 延迟导入的 matplotlib.pyplot（只在第一次用 matplotlib 渲染时导入）
+_PYPLOT = None
+
+
+def _pyplot():
+    """导入并返回 matplotlib.pyplot：强制使用无界面的 Agg 后端并设置中文字体
+    
+    matplotlib 的导入和字体配置只在真正渲染时发生，只处理数据的命令和
+    Pillow 渲染都不需要付出这部分启动开销。
+    """
+    global _PYPLOT
+    if _PYPLOT is None:
+        import matplotlib
+        matplotlib.use('Agg', force=True)
+        import matplotlib.pyplot as plt
+        plt.rcParams['font.sans-serif'] = FONT_FAMILIES
+        plt.rcParams['axes.unicode_minus'] = False
+        _PYPLOT = plt
+    return _PYPLOT
+
+# 表格各类行的样式（matplotlib 和 Pillow 两种渲染共用）
+# height 为 matplotlib 表格中的相对行高，data 行的底色按斑马纹交替
+TABLE_STYLES = {
+    'header': {'facecolor': '#3d3d3d', 'color': 'white', 'weight': 'bold', 'fontsize': 9,
+               'height': 0.08, 'edgecolor': 'white', 'linewidth': 1.5},
+    'total': {'facecolor': '#3d3d3d', 'color': 'white', 'weight': 'bold', 'fontsize': 10,
+              'height': 0.07, 'edgecolor': 'white', 'linewidth': 1.5},
+    'month': {'facecolor': '#f9a825', 'color': 'white', 'weight': 'bold', 'fontsize': 10,
+              'height': 0.07, 'edgecolor': 'white', 'linewidth': 1.5},
+    'week': {'facecolor': '#b3e5fc', 'color': '#0277bd', 'weight': 'bold', 'fontsize': 10,
+             'height': 0.07, 'edgecolor': 'white', 'linewidth': 1.5},
+    'data': {'facecolor': ('#f8f9fa', 'white'), 'color': 'black', 'weight': 'normal', 'fontsize': 9,
+             'height': 0.06, 'edgecolor': '#e0e0e0', 'linewidth': 0.5},
+}
 
 class DailyReportGenerator:
-    def __init__(self):
-        """初始化日报生成器"""
-        self._setup_font()
-        self._define_columns()
+    def __init__(self, renderer='matplotlib', render_cache=None, metrics=None):
+        """初始化日报生成器
         
-    def _setup_font(self):
-        """设置中文字体"""
-        plt.rcParams['font.sans-serif'] = ['Arial Unicode MS', 'SimHei', 'DejaVu Sans']
-        plt.rcParams['axes.unicode_minus'] = False
+        Args:
+            renderer: 表格图片渲染后端，'matplotlib' 或 'pillow'（未安装Pillow时退回matplotlib）
+            render_cache: RenderCache 实例（可选），内容未变化的图片跳过渲染和写入
+            metrics: RunMetrics 实例（可选），记录各阶段的耗时、内存和行数
+        """
+        if renderer == 'pillow' and not HAS_PILLOW:
+            print("⚠ 未安装Pillow，改用matplotlib渲染")
+            renderer = 'matplotlib'
+        self.renderer = renderer
+        self.render_cache = render_cache
+        self.metrics = metrics
+        self._pillow_renderer = None
+        self._define_columns()
     
     def _define_columns(self):
         """定义列名映射和处理规则"""
@@ -33,8 +132,27 @@ class DailyReportGenerator:
             '次日留存合约新增交易用户数', 'EFTT(充值≥100U)', 'EFTTC'
         ]
         
+        # 报表实际用到的汇总列（聚合时求和）
+        self.sum_columns = [
+            '注册用户', 'FTD', 'FTT', '充值折U', '提现折U', '净充值折U', '交易人数',
+            '现货交易金额', '现货交易手续费', '合约交易金额', '合约交易手续费',
+            '手续费(现货&合约)', '净手续费(现货&合约)', 'effective FTT', 'EFTTC',
+            '赠金真实消耗', '合约赠金净划入', '合约交易平仓盈亏'
+        ]
+        
+        # 层级维度列（读取为分类类型）
+        self.dimension_columns = ['商务总监', '商务BD', '总代理']
+        
+        # 报表层级列（由 process_raw_data 生成的分类列，聚合时随维度一起保留）
+        self.hierarchy_columns = ['dimension', 'supervisor', 'bd']
+        
+        # 读取CSV时只保留的列
+        self.source_columns = ['统计日期'] + self.dimension_columns + self.sum_columns
+        
         self.column_mapping = {
             'dimension': 'Dimension',
+            'supervisor': 'Supervisor',
+            'bd': 'BD',
             '统计日期': 'Date',
             '注册用户': 'Reg',
             'FTD': 'FTD',
@@ -59,6 +177,16 @@ class DailyReportGenerator:
         
         self.int_columns = ['Reg', 'FTD', 'FTT', 'DAU', 'Activate KOL', 'EFTTC']
         
+        # 周期汇总时取最大值（而不是求和）的列
+        self.max_columns = ['DAU', 'Activate KOL']
+        
+        # 总监对比报表的关键指标列
+        self.comparison_metrics = [
+            'Reg', 'FTD', 'FTT', 'Net Deposit ($)', 'DAU', 
+            'Total Vol ($)', 'Total Fee ($)', 'Profit Fee ($)', 
+            'Activate KOL', 'EFTTC', 'Futures PNL'
+        ]
+        
         self.display_columns = [
             'Date', 'Reg', 'FTD', 'FTT', 'Deposit ($)', 'Withdraw ($)', 
             'Net Deposit ($)', 'DAU', 'Spot Vol ($)', 'Spot Fee ($)', 
@@ -80,76 +208,352 @@ class DailyReportGenerator:
         else:
             return f'{value:,.0f}' if abs(value) >= 10 else f'{value:.1f}'
     
-    def is_month_complete(self, month_data, year, month):
-        """判断某月数据是否完整"""
-        days_in_month = calendar.monthrange(year, month)[1]
-        unique_days = month_data['Date_dt'].dt.day.nunique()
-        return unique_days >= days_in_month
+    def format_numbers(self, values):
+        """批量格式化数字，结果与逐个调用 format_number 一致
+        
+        Args:
+            values: 数值块（DataFrame、Series、list 或 ndarray，任意维度）
+        
+        Returns:
+            同形状的字符串ndarray（object类型）
+        """
+        arr = np.asarray(values, dtype=float)
+        out = np.full(arr.shape, '0', dtype=object)
+        
+        finite = np.isfinite(arr) & (arr != 0)
+        magnitude = np.abs(arr)
+        # >=10 或整数：四舍五入到整数并加千分位；其余(<10的小数)：保留一位小数
+        as_integer = finite & ((magnitude >= 10) | (arr == np.trunc(arr))) & (magnitude < 1e18)
+        as_decimal = finite & ~as_integer & (magnitude < 10)
+        
+        # 分类在numpy中一次完成，格式化只对各类值做一次无分支的批量映射
+        if as_integer.any():
+            ints = np.rint(arr[as_integer]).astype(np.int64).tolist()
+            out[as_integer] = list(map('{:,}'.format, ints))
+        if as_decimal.any():
+            out[as_decimal] = list(map('{:.1f}'.format, arr[as_decimal].tolist()))
+        
+        # 无穷大和超大数值很少见，逐个格式化
+        rest = ~np.isnan(arr) & (arr != 0) & ~as_integer & ~as_decimal
+        for index in zip(*np.nonzero(rest)):
+            out[index] = self.format_number(arr[index])
+        return out
+    
+    @contextmanager
+    def _stage(self, name):
+        """记录一个阶段的指标（未启用 metrics 时不记录）；可在返回的字典里填写 rows/reports"""
+        if self.metrics is None:
+            yield {}
+        else:
+            with self.metrics.stage(name) as stage:
+                yield stage
+    
+    def input_files(self, csv_file):
+        """把数据路径解析为文件列表（按文件名排序）
+        
+        可以是单个文件、目录（其中的 .csv/.csv.gz/.csv.zst 文件）或通配符（如 'exports/*.csv.gz'）。
+        单个文件原样返回，不存在时由读取时报 FileNotFoundError。
+        """
+        if os.path.isdir(csv_file):
+            files = [path for path in glob.glob(os.path.join(csv_file, '*')) if path.endswith(INPUT_SUFFIXES)]
+        elif glob.has_magic(csv_file):
+            files = glob.glob(csv_file)
+        else:
+            files = [csv_file]
+        if not files:
+            raise FileNotFoundError(csv_file)
+        if not HAS_ZSTANDARD and any(path.endswith('.zst') for path in files):
+            raise ImportError('读取 .zst 压缩文件需要安装 zstandard')
+        return sorted(files)
+    
+    def input_signature(self, csv_file):
+        """数据文件的 (路径, 大小, 修改时间) 列表，用于低成本地检测输入变化"""
+        signature = []
+        for path in self.input_files(csv_file):
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+    
+    def input_fingerprint(self, files):
+        """多个数据文件的指纹；单个文件时与 file_fingerprint 相同（已有的解析缓存仍然有效）"""
+        if len(files) == 1:
+            return self.file_fingerprint(files[0])
+        return {'files': [dict(self.file_fingerprint(path), path=path) for path in files]}
+    
+    def file_fingerprint(self, csv_file):
+        """计算文件指纹（大小、修改时间、内容哈希）"""
+        stat = os.stat(csv_file)
+        digest = hashlib.sha1()
+        with open(csv_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1': digest.hexdigest(),
+        }
+    
+    def load_processed_data(self, csv_file='raw_data.csv', cache_dir='.cache', use_cache=True, supervisors=None):
+        """读取并处理原始数据，命中缓存时跳过CSV解析和清洗
+        
+        csv_file 可以是单个文件、目录或通配符（见 input_files），多个文件并行读取后合并。
+        缓存为 process_raw_data 输出的列式文件（优先Parquet，否则pickle），
+        以所有数据文件的大小、修改时间和内容哈希作为键。指定 supervisors 时只返回这些总监的行，
+        命中Parquet缓存时只读取对应的行。
+        """
+        files = self.input_files(csv_file)
+        if not use_cache:
+            return self._select_supervisors(self._read_and_process(files), supervisors)
+        
+        fingerprint = self.input_fingerprint(files)
+        fingerprint['version'] = PARSE_CACHE_VERSION
+        key = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        
+        for ext in ('parquet', 'pkl'):
+            cache_path = os.path.join(cache_dir, f'processed_{key}.{ext}')
+            if os.path.exists(cache_path):
+                try:
+                    with self._stage('read_cache') as stage:
+                        if ext == 'parquet' and supervisors is not None:
+                            df = pd.read_parquet(cache_path, filters=[('supervisor', 'in', list(supervisors))])
+                        elif ext == 'parquet':
+                            df = pd.read_parquet(cache_path)
+                        else:
+                            df = self._select_supervisors(pd.read_pickle(cache_path), supervisors)
+                        stage['rows'] = len(df)
+                    print(f"♻️ 命中解析缓存: {cache_path}")
+                    return df
+                except Exception as e:
+                    print(f"⚠ 解析缓存损坏，重新解析: {e}")
+                    os.remove(cache_path)
+        
+        df = self._read_and_process(files)
+        with self._stage('write'):
+            self._write_parse_cache(df, cache_dir, key)
+        return self._select_supervisors(df, supervisors)
+    
+    def _read_and_process(self, files):
+        """读取数据文件并清洗（分别记录两个阶段的指标）"""
+        with self._stage('read_csv') as stage:
+            df = self.read_raw_files(files)
+            stage['rows'] = len(df)
+        with self._stage('process_raw_data') as stage:
+            df = self.process_raw_data(df)
+            stage['rows'] = len(df)
+        return df
+    
+    def _select_supervisors(self, df, supervisors):
+        """只保留指定总监的明细行（supervisors 为 None 时不筛选）"""
+        if supervisors is None:
+            return df
+        return df[df['supervisor'].isin(supervisors)].reset_index(drop=True)
+    
+    def _write_parse_cache(self, df, cache_dir, key):
+        """写入解析缓存，并清理旧的缓存文件"""
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_path in glob.glob(os.path.join(cache_dir, 'processed_*')):
+            os.remove(old_path)
+        
+        if HAS_PYARROW:
+            cache_path = os.path.join(cache_dir, f'processed_{key}.parquet')
+            try:
+                df.to_parquet(cache_path, index=False)
+                return cache_path
+            except Exception:
+                # 混合类型的object列无法写成Parquet，退回pickle
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+        
+        cache_path = os.path.join(cache_dir, f'processed_{key}.pkl')
+        df.to_pickle(cache_path)
+        return cache_path
+    
+    def read_raw_csv(self, csv_file, **kwargs):
+        """按列定义读取原始CSV：只读报表用到的列，数值列直接解析为float
+        
+        分块读取（chunksize）时返回的是惰性读取器，解析错误在迭代时才抛出，
+        无法整体回退，因此分块读取一律推断类型，由 process_raw_data 清洗每个分块。
+        """
+        wanted = set(self.source_columns)
+        dtype = {col: 'category' for col in self.dimension_columns}
+        dtype['统计日期'] = str
+        numeric_dtype = {col: 'float64' for col in self.sum_columns}
+        
+        if kwargs.get('chunksize'):
+            return pd.read_csv(csv_file, usecols=lambda col: col in wanted,
+                               dtype=dtype, thousands=',', **kwargs)
+        
+        try:
+            return pd.read_csv(csv_file, usecols=lambda col: col in wanted,
+                               dtype={**dtype, **numeric_dtype}, thousands=',', **kwargs)
+        except ValueError:
+            # 数值列中有无法解析的值，改为推断类型，由 process_raw_data 统一清洗
+            return pd.read_csv(csv_file, usecols=lambda col: col in wanted,
+                               dtype=dtype, thousands=',', **kwargs)
+    
+    def read_raw_files(self, files, workers=None):
+        """读取多个原始数据文件（多于一个时用进程池并行解析）并合并去重
+        
+        Args:
+            files: 数据文件列表（input_files 的结果，按文件名排序）
+            workers: 解析进程数，默认为文件数和CPU核数中较小的一个
+        """
+        if len(files) == 1:
+            return self.read_raw_csv(files[0])
+        
+        workers = workers or min(len(files), os.cpu_count() or 1)
+        if workers > 1:
+            # 每个进程读取一批文件并在进程内拼接，主进程只拼接少量批次结果
+            batch_size = -(-len(files) // (workers * 4))
+            batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_read_raw_batch, batches))
+        else:
+            results = [self.read_raw_batch(files)]
+        
+        frames = [frame for frame, _ in results]
+        file_rows = [rows for _, batch_rows in results for rows in batch_rows]
+        return self.combine_raw_frames(frames, file_rows)
+    
+    def read_raw_batch(self, files):
+        """读取一批数据文件并拼接，返回 (DataFrame, 各文件的行数)"""
+        frames = [self.read_raw_csv(path) for path in files]
+        return self._concat_raw_frames(frames), [len(frame) for frame in frames]
+    
+    def _concat_raw_frames(self, frames):
+        """拼接原始数据；各文件的类别不同时拼接结果不再是分类类型，重新转为分类（清洗时按类别处理）"""
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        for col in self.dimension_columns:
+            if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        return df
+    
+    def combine_raw_frames(self, frames, file_rows, verbose=True):
+        """按顺序拼接各批次的原始数据；同一自然键出现在多个文件中时只保留最后一个文件的行
+        
+        file_rows 为按顺序排列的各文件行数。同一文件内的重复键保持不变（与单文件读取的结果一致）。
+        """
+        df = self._concat_raw_frames(frames)
+        
+        keys = [col for col in NATURAL_KEY_COLUMNS if col in df.columns]
+        file_index = pd.Series(np.repeat(np.arange(len(file_rows)), file_rows))
+        last_file = file_index.groupby([df[col] for col in keys], observed=True, dropna=False, sort=False).transform('max')
+        keep = (file_index == last_file).to_numpy()
+        if not keep.all():
+            if verbose:
+                print(f"已去除 {int((~keep).sum())} 条被后续文件覆盖的重复记录")
+            df = df[keep].reset_index(drop=True)
+        return df
     
-    def process_raw_data(self, df):
+    def process_raw_data(self, df, verbose=True):
         """处理原始数据"""
-        # 清理数值列
+        # 清理数值列（已按数值类型读取的列只需补0）
         for col in self.numeric_columns:
             if col in df.columns:
+                if pd.api.types.is_numeric_dtype(df[col]):
+                    if df[col].isna().any():
+                        df[col] = df[col].fillna(0)
+                    continue
                 df[col] = df[col].astype(str).str.replace(',', '').replace('nan', '0')
                 df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
         
-        # 填充其他列的NaN值
-        df = df.fillna('')
-        
-        # 创建维度
-        df['商务总监'] = df['商务总监'].astype(str).replace('nan', '').replace('0', '')
-        df['商务BD'] = df['商务BD'].astype(str).replace('nan', '').replace('0', '')
-        df['dimension'] = df['商务总监'] + ' - ' + df['商务BD']
-        df['dimension'] = df['dimension'].str.strip().str.replace(' -  - ', ' - ')
-        df['dimension'] = df['dimension'].str.replace('^ - ', '', regex=True)
-        df['dimension'] = df['dimension'].str.replace(' - $', '', regex=True)
+        # 其他非数值列的NaN填充为空字符串（逐列处理，避免整表复制）
+        for col in df.columns:
+            if col in self.dimension_columns or pd.api.types.is_numeric_dtype(df[col]):
+                continue
+            if df[col].isna().any():
+                df[col] = df[col].fillna('')
+        
+        # 在类别上（而不是逐行）清洗总监和BD名称
+        supervisors, supervisor_codes = self._clean_categories(df['商务总监'])
+        bds, bd_codes = self._clean_categories(df['商务BD'])
+        
+        # 每个 (总监, BD) 组合只拼接一次维度字符串，并在组合上判断是否离职
+        pair_inverse, unique_pairs = pd.factorize(supervisor_codes * len(bds) + bd_codes)
+        # 报表层级：总监和BD都存在时为 (总监, BD)，否则总监为空、BD取维度本身
+        pair_dimensions = np.empty(len(unique_pairs), dtype=object)
+        pair_supervisors = np.empty(len(unique_pairs), dtype=object)
+        pair_bds = np.empty(len(unique_pairs), dtype=object)
+        pair_keep = np.empty(len(unique_pairs), dtype=bool)
+        for i, pair in enumerate(unique_pairs):
+            supervisor = supervisors[pair // len(bds)]
+            bd = bds[pair % len(bds)]
+            if supervisor and bd:
+                pair_dimensions[i] = f'{supervisor} - {bd}'
+                pair_supervisors[i] = supervisor
+                pair_bds[i] = bd
+            else:
+                pair_dimensions[i] = supervisor or bd
+                pair_supervisors[i] = ''
+                pair_bds[i] = supervisor or bd
+            pair_keep[i] = '离职' not in supervisor and '离职' not in bd
         
-        # 过滤离职记录
+        # 过滤离职记录（一个组合掩码，只复制一次）
+        keep = pair_keep[pair_inverse]
         original_count = len(df)
-        df = df[~df['商务总监'].str.contains('离职', na=False)].copy()
-        df = df[~df['商务BD'].str.contains('离职', na=False)].copy()
-        df = df[~df['dimension'].str.contains('离职', na=False)].copy()
+        df = df.take(np.flatnonzero(keep))
         filtered_count = original_count - len(df)
         
-        if filtered_count > 0:
+        df['商务总监'] = self._categorical_from_values(supervisors, supervisor_codes[keep])
+        df['商务BD'] = self._categorical_from_values(bds, bd_codes[keep])
+        df['dimension'] = self._categorical_from_values(pair_dimensions, pair_inverse[keep])
+        df['supervisor'] = self._categorical_from_values(pair_supervisors, pair_inverse[keep])
+        df['bd'] = self._categorical_from_values(pair_bds, pair_inverse[keep])
+        if '总代理' in df.columns:
+            df['总代理'] = self._fill_empty_category(df['总代理'])
+        
+        if verbose and filtered_count > 0:
             print(f"已过滤 {filtered_count} 条包含'离职'的记录")
         
         return df
     
+    def _clean_categories(self, series):
+        """按类别清洗层级列（去除首尾空白，'nan'/'0' 视为空），返回 (取值数组, 行编码)
+        
+        缺失值的行编码指向取值数组末尾追加的空字符串。
+        """
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category')
+        values = pd.Index(series.cat.categories.astype(str)).str.strip()
+        values = np.append(np.where(values.isin(['nan', '0']), '', values).astype(object), '')
+        codes = series.cat.codes.to_numpy().astype(np.int64)
+        codes[codes < 0] = len(values) - 1
+        return values, codes
+    
+    def _categorical_from_values(self, values, codes):
+        """由取值数组和行编码构建分类列（合并清洗后重复的类别）"""
+        value_codes, categories = pd.factorize(values)
+        return pd.Categorical.from_codes(value_codes[codes], categories=categories)
+    
+    def _fill_empty_category(self, series):
+        """缺失值填充为空字符串（分类列需要先加入空字符串类别）"""
+        if isinstance(series.dtype, pd.CategoricalDtype) and '' not in series.cat.categories:
+            series = series.cat.add_categories('')
+        return series.fillna('')
+    
     def _aggregate_data_impl(self, df, groupby_cols, include_kol_count=True):
         """聚合数据的内部实现"""
         # 按指定列分组汇总
-        result = df.groupby(groupby_cols).agg({
-            '注册用户': 'sum',
-            'FTD': 'sum',
-            'FTT': 'sum',
-            '充值折U': 'sum',
-            '提现折U': 'sum',
-            '净充值折U': 'sum',
-            '交易人数': 'sum',
-            '现货交易金额': 'sum',
-            '现货交易手续费': 'sum',
-            '合约交易金额': 'sum',
-            '合约交易手续费': 'sum',
-            '手续费(现货&合约)': 'sum',
-            '净手续费(现货&合约)': 'sum',
-            'effective FTT': 'sum',
-            'EFTTC': 'sum',
-            '赠金真实消耗': 'sum',
-            '合约赠金净划入': 'sum',
-            '合约交易平仓盈亏': 'sum',
-        }).reset_index()
-        
-        # 计算总交易量
-        result['总交易额'] = result['现货交易金额'] + result['合约交易金额']
+        result = df.groupby(groupby_cols, observed=True).agg(
+            {col: 'sum' for col in self.sum_columns}
+        ).reset_index()
         
         # 计算Activate KOL（如果需要）
+        kol_counts = None
         if include_kol_count and 'dimension' in groupby_cols:
             kol_groupby = ['dimension', '统计日期']
-            kol_counts = df.groupby(kol_groupby)['总代理'].nunique().reset_index()
+            kol_counts = df.groupby(kol_groupby, observed=True)['总代理'].nunique().reset_index()
             kol_counts.columns = kol_groupby + ['Activate KOL']
-            result = result.merge(kol_counts, on=kol_groupby, how='left')
+        
+        return self._finalize_aggregate(result, kol_counts)
+    
+    def _finalize_aggregate(self, result, kol_counts=None):
+        """计算派生列、合并Activate KOL，并统一列名和类型"""
+        # 计算总交易量
+        result['总交易额'] = result['现货交易金额'] + result['合约交易金额']
+        
+        if kol_counts is not None:
+            result = result.merge(kol_counts, on=['dimension', '统计日期'], how='left')
             result['Activate KOL'] = result['Activate KOL'].fillna(0)
         
         # 重命名列
@@ -161,7 +565,7 @@ class DailyReportGenerator:
                 result[col] = result[col].astype(int)
         
         # 四舍五入浮点数列
-        exclude_cols = ['Date', 'Dimension'] + self.int_columns
+        exclude_cols = ['Date', 'Dimension', 'Supervisor', 'BD'] + self.int_columns
         if '总代理' in result.columns:
             exclude_cols.append('总代理')
         float_columns = [col for col in result.columns if col not in exclude_cols]
@@ -170,9 +574,87 @@ class DailyReportGenerator:
         
         return result
     
+    def aggregate_data_streaming(self, csv_file='raw_data.csv', chunksize=200000, with_kol=False):
+        """分块流式读取CSV并累加聚合，结果与 aggregate_data 一致
+        
+        峰值内存只与分块大小和聚合结果规模有关。Activate KOL 通过累积
+        去重后的 (dimension, 统计日期, 总代理) 组合精确计算。
+        只支持单个数据文件：多个文件之间的自然键去重（后面的文件覆盖前面的）需要保留全部明细，
+        无法流式完成，结果会与默认模式不一致，因此直接报错。
+        
+        Args:
+            with_kol: 为 True 时同时累加总代理级的和，返回 (BD级结果, 总代理级结果)，
+                后者与 aggregate_data_by_kol 一致
+        
+        Raises:
+            ValueError: csv_file 解析出多个数据文件
+        """
+        keys = self.hierarchy_columns + ['统计日期']
+        kol_keys = ['总代理'] + keys
+        partial_sums = None
+        kol_sums = None
+        kol_pairs = None
+        total_rows = 0
+        filtered_count = 0
+        
+        files = self.input_files(csv_file)
+        if len(files) > 1:
+            raise ValueError(f'分块读取只支持单个数据文件（{csv_file} 包含 {len(files)} 个文件，'
+                             f'跨文件去重需要完整读取，请去掉 --chunksize）')
+        
+        for chunk in self.read_raw_csv(files[0], chunksize=chunksize):
+            total_rows += len(chunk)
+            chunk_rows = len(chunk)
+            chunk = self.process_raw_data(chunk, verbose=False)
+            filtered_count += chunk_rows - len(chunk)
+            if len(chunk) == 0:
+                continue
+            
+            # 各分块的类别不同，转为字符串后才能跨分块对齐
+            for col in self.hierarchy_columns + ['总代理']:
+                chunk[col] = chunk[col].astype(str)
+            
+            sums = chunk.groupby(keys, observed=True)[self.sum_columns].sum()
+            partial_sums = sums if partial_sums is None else partial_sums.add(sums, fill_value=0)
+            
+            if with_kol:
+                kol_chunk = chunk[chunk['总代理'] != '']
+                if len(kol_chunk) > 0:
+                    sums = kol_chunk.groupby(kol_keys, observed=True)[self.sum_columns].sum()
+                    kol_sums = sums if kol_sums is None else kol_sums.add(sums, fill_value=0)
+            
+            pairs = chunk[['dimension', '统计日期', '总代理']].drop_duplicates()
+            if kol_pairs is not None:
+                pairs = pd.concat([kol_pairs, pairs], ignore_index=True).drop_duplicates()
+            kol_pairs = pairs
+        
+        print(f"✅ 流式读取完成，共 {total_rows} 行")
+        if filtered_count > 0:
+            print(f"已过滤 {filtered_count} 条包含'离职'的记录")
+        
+        kol_result = self._finalize_aggregate(kol_sums.reset_index()) if kol_sums is not None else pd.DataFrame()
+        if partial_sums is None:
+            # 没有有效数据（如全部是离职记录）时返回列结构与 aggregate_data 一致的空结果
+            empty = self.empty_aggregate()
+            return (empty, kol_result) if with_kol else empty
+        
+        result = partial_sums.reset_index()
+        count_keys = ['dimension', '统计日期']
+        kol_counts = kol_pairs.groupby(count_keys)['总代理'].nunique().reset_index()
+        kol_counts.columns = count_keys + ['Activate KOL']
+        result = self._finalize_aggregate(result, kol_counts)
+        return (result, kol_result) if with_kol else result
+    
+    def empty_aggregate(self):
+        """没有数据时的BD级聚合结果：0行，列结构与 aggregate_data 一致"""
+        empty = pd.DataFrame({col: pd.Series(dtype='float64') for col in self.sum_columns})
+        for col in ['统计日期'] + self.dimension_columns:
+            empty[col] = pd.Series(dtype=object)
+        return self.aggregate_data(self.process_raw_data(empty, verbose=False))
+    
     def aggregate_data(self, df):
         """按维度和日期聚合数据"""
-        return self._aggregate_data_impl(df, ['dimension', '统计日期'], include_kol_count=True)
+        return self._aggregate_data_impl(df, self.hierarchy_columns + ['统计日期'], include_kol_count=True)
     
     def aggregate_data_by_kol(self, df):
         """按总代理、维度和日期聚合数据"""
@@ -182,117 +664,259 @@ class DailyReportGenerator:
         if len(df_kol) == 0:
             return pd.DataFrame()
         
-        return self._aggregate_data_impl(df_kol, ['总代理', 'dimension', '统计日期'], include_kol_count=False)
+        return self._aggregate_data_impl(df_kol, ['总代理'] + self.hierarchy_columns + ['统计日期'], include_kol_count=False)
+    
+    def daily_rollup(self, daily, keys):
+        """把下级实体的每日数据按 keys + Date 求和，得到上级实体的每日数据"""
+        metrics = [col for col in self.display_columns[1:] if col in daily.columns]
+        result = daily.groupby(list(keys) + ['Date'], observed=True)[metrics].sum().reset_index()
+        return self._round_sums(result, metrics)
+    
+    def _round_sums(self, result, metrics):
+        """两位小数输入的求和结果统一取整到两位小数，使输出与求和顺序无关"""
+        for col in metrics:
+            if pd.api.types.is_float_dtype(result[col]):
+                result[col] = result[col].round(2)
+        return result
+    
+    def period_rollup(self, daily, keys, period):
+        """按周期汇总每日数据（DAU、Activate KOL 取最大值，其余求和）
+        
+        Args:
+            daily: 每日数据（含 Date 列）
+            keys: 实体键列表（为空时整体汇总）
+            period: 'week'（ISO周）、'month' 或 'total'
+        
+        Returns:
+            每个 (实体, 周期) 一行，附带 Start/End 日期和有数据的天数 Days
+        """
+        dates = pd.to_datetime(daily['Date'], errors='coerce')
+        frame = daily.assign(Date_dt=dates)[dates.notna()]
+        if period == 'month':
+            frame = frame.assign(Period=frame['Date_dt'].dt.to_period('M'))
+        elif period == 'week':
+            frame = frame.assign(Period=self.iso_week_keys(frame['Date_dt']))
+        
+        group_cols = list(keys) + (['Period'] if period != 'total' else [])
+        metrics = [col for col in self.display_columns[1:] if col in frame.columns]
+        named_aggs = {col: (col, 'max' if col in self.max_columns else 'sum') for col in metrics}
+        named_aggs.update(
+            Start=('Date_dt', 'min'),
+            End=('Date_dt', 'max'),
+            Days=('Date_dt', 'nunique'),
+        )
+        
+        if group_cols:
+            grouped = frame.groupby(group_cols, observed=True, sort=False)
+            result = grouped.agg(**named_aggs).reset_index()
+        else:
+            grouped = frame.groupby(np.zeros(len(frame), dtype=np.int8), sort=False)
+            result = grouped.agg(**named_aggs).reset_index(drop=True)
+        return self._round_sums(result, metrics)
+    
+    def iso_week_keys(self, dates):
+        """日期序列对应的ISO周键（如 2025-W07），与 period_rollup(..., 'week') 的 Period 一致"""
+        iso = dates.dt.isocalendar()
+        return iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2)
+    
+    def date_fingerprints(self, df):
+        """按统计日期计算明细数据指纹（行哈希之和 + 行数，与行顺序无关）"""
+        columns = [col for col in self.source_columns if col in df.columns]
+        row_hashes = pd.util.hash_pandas_object(df[columns], index=False)
+        grouped = row_hashes.groupby(df['统计日期'].to_numpy())
+        sums = grouped.sum()
+        counts = grouped.size()
+        return {
+            str(date): f'{int(sums[date]):016x}-{int(counts[date])}'
+            for date in sums.index
+        }
+    
+    def row_fingerprints(self, df):
+        """按 (统计日期, 商务总监, 商务BD, 总代理) 计算明细数据指纹（行哈希之和 + 行数）
+        
+        Returns:
+            DataFrame：四个键列、对应的报表层级（supervisor、bd、dimension）以及 hash 和 rows 列
+        """
+        columns = [col for col in self.source_columns if col in df.columns]
+        keys = [col for col in ('统计日期', '商务总监', '商务BD', '总代理') if col in df.columns]
+        keys += ['supervisor', 'bd', 'dimension']
+        row_hashes = pd.util.hash_pandas_object(df[columns], index=False)
+        grouped = row_hashes.groupby([df[col] for col in keys], observed=True, sort=False)
+        result = pd.DataFrame({'hash': grouped.sum(), 'rows': grouped.size()}).reset_index()
+        for col in keys:
+            result[col] = result[col].astype(str)
+        return result
+    
+    def update_aggregate_store(self, processed_df, store):
+        """增量更新聚合存储：只重新聚合新增或有变化的日期分区，并删除数据中已不存在的日期分区
+        
+        Returns:
+            有变化（被替换或删除）的日期列表
+        """
+        fingerprints = self.date_fingerprints(processed_df)
+        stored = store.partition_fingerprints()
+        changed_dates = sorted(date for date, fp in fingerprints.items() if stored.get(date) != fp)
+        removed_dates = sorted(set(stored) - set(fingerprints))
+        
+        if removed_dates:
+            store.delete_partitions(removed_dates)
+        
+        if changed_dates:
+            subset = processed_df[processed_df['统计日期'].isin(changed_dates)]
+            store.replace_partitions(
+                changed_dates,
+                self.aggregate_data(subset),
+                self.aggregate_data_by_kol(subset),
+                {date: fingerprints[date] for date in changed_dates},
+            )
+        
+        return sorted(changed_dates + removed_dates)
     
-    def create_table_data(self, agent_data, kol_name=None):
+    def create_table_data(self, agent_data, kol_name=None, rollups=None):
         """为单个代理创建表格数据
         
         Args:
             agent_data: 代理数据
             kol_name: 总代理名称（如果为总代理数据）
+            rollups: 该代理预先计算的周期汇总 {'week': ..., 'month': ..., 'total': ...}（可选）
+        """
+        inputs = self._table_inputs(agent_data, kol_name, rollups)
+        if inputs is None:
+            return None, None, None, None
+        agent_data, rollups, available_columns, business_name, supervisor = inputs
+        
+        table_data = self._build_table_rows(agent_data, rollups, available_columns)
+        
+        return table_data, available_columns, business_name, supervisor
+    
+    def create_table_frame(self, agent_data, kol_name=None, rollups=None):
+        """与 create_table_data 相同的表格，以未格式化数值的 DataFrame 返回（不渲染）
+        
+        Returns:
+            (DataFrame, 商务名称, 总监)；没有有效日期数据时为 (None, None, None)
         """
+        inputs = self._table_inputs(agent_data, kol_name, rollups)
+        if inputs is None:
+            return None, None, None
+        agent_data, rollups, available_columns, business_name, supervisor = inputs
+        
+        layout = self.table_layout(agent_data, rollups, available_columns)
+        return self.table_frame(layout, available_columns), business_name, supervisor
+    
+    def _table_inputs(self, agent_data, kol_name=None, rollups=None):
+        """按日期倒序的每日数据、周期汇总、列和名称；没有有效日期数据时返回 None"""
         # 转换日期列为datetime
-        agent_data['Date_dt'] = pd.to_datetime(agent_data['Date'], errors='coerce')
-        agent_data = agent_data[agent_data['Date_dt'].notna()].copy()
+        agent_data = agent_data.assign(Date_dt=pd.to_datetime(agent_data['Date'], errors='coerce'))
+        if agent_data['Date_dt'].isna().any():
+            agent_data = agent_data[agent_data['Date_dt'].notna()]
         
         if len(agent_data) == 0:
-            return None, None, None, None
+            return None
         
         # 按日期倒序排列
         agent_data = agent_data.sort_values('Date_dt', ascending=False).reset_index(drop=True)
         
-        # 添加年月信息
-        agent_data['Year'] = agent_data['Date_dt'].dt.year
-        agent_data['Month'] = agent_data['Date_dt'].dt.month
-        agent_data['YearMonth'] = agent_data['Date_dt'].dt.to_period('M')
-        
-        # 获取最新的年月
-        latest_year_month = agent_data['YearMonth'].iloc[0]
-        
-        # 提取商务名称
-        if kol_name:
-            # 总代理数据
-            business_name = kol_name
-            if ' - ' in agent_data['Dimension'].iloc[0]:
-                parts = agent_data['Dimension'].iloc[0].split(' - ')
-                supervisor = parts[0].strip()
-                bd_name = parts[-1].strip()
-            else:
-                supervisor = ''
-                bd_name = agent_data['Dimension'].iloc[0]
-        else:
-            # 普通代理数据
-            if ' - ' in agent_data['Dimension'].iloc[0]:
-                parts = agent_data['Dimension'].iloc[0].split(' - ')
-                supervisor = parts[0].strip()
-                business_name = parts[-1].strip()
-            else:
-                supervisor = ''
-                business_name = agent_data['Dimension'].iloc[0]
-            bd_name = business_name
+        # 提取商务名称（直接取层级列，不再解析维度字符串）
+        supervisor = agent_data['Supervisor'].iloc[0]
+        bd_name = agent_data['BD'].iloc[0]
+        business_name = kol_name if kol_name else bd_name
         
         # 只保留存在的列
         available_columns = [col for col in self.display_columns if col in agent_data.columns]
         
-        # 按月份分组构建表格数据
-        table_data = []
-        month_groups = agent_data.groupby('YearMonth', sort=False)
+        # 周、月度和总计汇总（未预先计算时现场计算）
+        if rollups is None:
+            rollups = {period: self.period_rollup(agent_data, [], period) for period in ('week', 'month', 'total')}
+        
+        return agent_data, rollups, available_columns, business_name, supervisor
+    
+    def _build_table_rows(self, daily, rollups, available_columns):
+        """由按日期倒序的每日数据和周期汇总构建（格式化后的）表格行"""
+        layout = self.table_layout(daily, rollups, available_columns)
+        labels = np.asarray(layout['labels'], dtype=object)
+        return np.column_stack([labels, self.format_numbers(layout['values'])]).tolist()
+    
+    def table_layout(self, daily, rollups, available_columns):
+        """表格的行布局：每行的类型、标签、起止日期和未格式化的数值
+        
+        最新月份显示每日数据、各周汇总（日期范围含跨月部分）和月总和；
+        历史完整月份只显示月总和；最后是TOTAL行。周/月/总计行都直接查汇总结果。
         
-        for idx, (year_month, month_data) in enumerate(month_groups):
-            year = month_data['Year'].iloc[0]
-            month = month_data['Month'].iloc[0]
-            is_latest_month = (year_month == latest_year_month)
-            is_complete = self.is_month_complete(month_data, year, month)
+        Returns:
+            dict: row_types（'daily'/'week'/'month'/'TOTAL'）、labels、starts、ends，
+            以及 (行数, 指标数) 的数值数组 values（列顺序为 available_columns[1:]）
+        """
+        metrics = available_columns[1:]
+        year_months = daily['Date_dt'].dt.to_period('M')
+        latest_year_month = year_months.iloc[0]
+        
+        week, month, total = rollups['week'], rollups['month'], rollups['total']
+        week_rows = {period: i for i, period in enumerate(week['Period'])}
+        month_rows = {period: i for i, period in enumerate(month['Period'])}
+        week_values = week[metrics].to_numpy(dtype=float)
+        month_values = month[metrics].to_numpy(dtype=float)
+        
+        layout = {'row_types': [], 'labels': [], 'starts': [], 'ends': []}
+        blocks = []
+        
+        def add_rollup_row(row_type, label, rollup, values, i):
+            layout['row_types'].append(row_type)
+            layout['labels'].append(label)
+            layout['starts'].append(rollup['Start'].iat[i])
+            layout['ends'].append(rollup['End'].iat[i])
+            blocks.append(values[i:i + 1])
+        
+        for year_month in year_months.unique():
+            year, month_number = year_month.year, year_month.month
             
-            if is_latest_month:
-                # 最新月份：显示每日数据 + 该月总和
-                for _, row in month_data.iterrows():
-                    formatted_row = []
-                    for col in available_columns:
-                        value = row[col]
-                        if col == 'Date':
-                            date_str = row['Date_dt'].strftime('%Y-%m-%d')
-                            formatted_row.append(date_str)
-                        else:
-                            formatted_row.append(self.format_number(value))
-                    table_data.append(formatted_row)
+            if year_month == latest_year_month:
+                # 最新月份：每日数据（已按日期倒序，即开头的连续若干行）
+                month_data = daily.iloc[:int((year_months == latest_year_month).sum())]
+                dates = month_data['Date_dt']
+                layout['row_types'].extend(['daily'] * len(month_data))
+                layout['labels'].extend(dates.dt.strftime('%Y-%m-%d'))
+                layout['starts'].extend(dates)
+                layout['ends'].extend(dates)
+                blocks.append(month_data[metrics].to_numpy(dtype=float))
                 
-                # 添加最新月的总和行
-                self._add_month_total_row(table_data, month_data, available_columns, year, month)
+                # 周统计行，按在每日数据中首次出现的顺序排列
+                for week_key in self.iso_week_keys(dates).unique():
+                    i = week_rows[week_key]
+                    label = f"{week['Start'].iat[i].strftime('%m/%d')}~{week['End'].iat[i].strftime('%m/%d')}"
+                    add_rollup_row('week', label, week, week_values, i)
                 
-            elif is_complete:
+                # 最新月的总和行
+                add_rollup_row('month', f"{year}/{month_number:02d}", month, month_values, month_rows[year_month])
+                
+            elif month['Days'].iat[month_rows[year_month]] >= calendar.monthrange(year, month_number)[1]:
                 # 历史完整月份：只显示该月总和
-                self._add_month_total_row(table_data, month_data, available_columns, year, month)
+                add_rollup_row('month', f"{year}/{month_number:02d}", month, month_values, month_rows[year_month])
         
-        # 添加TOTAL行
-        if len(agent_data) > 0:
-            self._add_total_row(table_data, agent_data, available_columns)
+        # TOTAL行
+        add_rollup_row('TOTAL', 'TOTAL', total, total[metrics].to_numpy(dtype=float), 0)
         
-        return table_data, available_columns, business_name, supervisor
+        layout['values'] = np.vstack(blocks)
+        return layout
     
-    def _add_month_total_row(self, table_data, month_data, available_columns, year, month):
-        """添加月度汇总行"""
-        month_total_label = f"{year}/{month:02d}"
-        month_total_row = [month_total_label]
-        for col in available_columns[1:]:
-            if col in ['DAU', 'Activate KOL']:
-                month_total_row.append(self.format_number(month_data[col].max()))
-            else:
-                month_total_row.append(self.format_number(month_data[col].sum()))
-        table_data.append(month_total_row)
-    
-    def _add_total_row(self, table_data, agent_data, available_columns):
-        """添加总计行"""
-        total_row = ['TOTAL']
-        for col in available_columns[1:]:
-            if col in ['DAU', 'Activate KOL']:
-                total_row.append(self.format_number(agent_data[col].max()))
-            else:
-                total_row.append(self.format_number(agent_data[col].sum()))
-        table_data.append(total_row)
+    def table_frame(self, layout, available_columns):
+        """把 table_layout 的结果转为 DataFrame：Row Type、Label、Start、End 和各指标的原始数值"""
+        frame = pd.DataFrame({
+            'Row Type': layout['row_types'],
+            'Label': layout['labels'],
+            'Start': pd.to_datetime(layout['starts']),
+            'End': pd.to_datetime(layout['ends']),
+        })
+        for i, col in enumerate(available_columns[1:]):
+            values = layout['values'][:, i]
+            # 人数类指标是整数（周期汇总取和或最大值后仍是整数）
+            if col in self.int_columns and np.isfinite(values).all():
+                values = np.rint(values).astype(np.int64)
+            frame[col] = values
+        return frame
     
-    def create_visualization(self, table_data, available_columns, business_name, supervisor):
-        """创建可视化图表"""
+    def create_visualization(self, table_data, available_columns, business_name, supervisor, subtitle=None):
+        """创建可视化图表（subtitle 为标题下方的副标题，可选）"""
+        plt = _pyplot()
         fig_height = max(len(table_data) * 0.4 + 3, 11)
         fig, ax = plt.subplots(figsize=(24, fig_height))
         ax.axis('tight')
@@ -311,14 +935,8 @@ class DailyReportGenerator:
         table.auto_set_font_size(False)
         table.set_fontsize(10)
         
-        # 识别月总和行
-        month_summary_rows = []
-        for i, row_data in enumerate(table_data):
-            if len(row_data[0]) == 7 and '/' in row_data[0] and row_data[0] != 'TOTAL':
-                month_summary_rows.append(i + 1)
-        
-        # 设置单元格样式
-        self._apply_table_styles(table, table_data, available_columns, month_summary_rows)
+        # 设置单元格样式（表头、月总和行、周统计行、TOTAL行）
+        self._apply_table_styles(table, table_data, available_columns)
         
         # 添加标题
         fig.text(0.05, 0.98, business_name, 
@@ -326,109 +944,193 @@ class DailyReportGenerator:
                 verticalalignment='top',
                 color='#2c3e50')
         
+        # 副标题
+        if subtitle:
+            fig.text(0.05, 0.95, subtitle, 
+                     fontsize=10, style='italic',
+                     verticalalignment='top',
+                     color='#7f8c8d')
+        
         plt.tight_layout()
-        plt.subplots_adjust(top=0.96, bottom=0.02)
+        plt.subplots_adjust(top=0.94 if subtitle else 0.96, bottom=0.02)
         
         return fig
     
-    def _apply_table_styles(self, table, table_data, available_columns, month_summary_rows):
+    def render_key(self, table_data, available_columns, title, subtitle=None):
+        """图片内容的哈希：表格内容、列、标题以及渲染后端和样式版本"""
+        payload = {
+            'table': table_data,
+            'columns': list(available_columns),
+            'title': title,
+            'subtitle': subtitle,
+            'renderer': self.renderer,
+            'style_version': RENDER_STYLE_VERSION,
+        }
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+    
+    def render_table_report(self, table_data, available_columns, title, output_path, subtitle=None):
+        """把表格渲染为PNG写入 output_path，按 self.renderer 选择渲染后端
+        
+        output_path 也可以是可写的二进制文件对象（如 io.BytesIO，此时不使用渲染缓存）。
+        启用渲染缓存时，内容哈希与上次运行一致且文件仍在的图片直接跳过。
+        """
+        cache_key = None
+        if self.render_cache is not None and isinstance(output_path, str):
+            cache_key = self.render_key(table_data, available_columns, title, subtitle)
+            if self.render_cache.is_current(output_path, cache_key):
+                self.render_cache.record(output_path, cache_key, rendered=False)
+                return output_path
+        
+        if self.renderer == 'pillow':
+            if self._pillow_renderer is None:
+                self._pillow_renderer = PillowTableRenderer(self)
+            with self._stage('render'):
+                image = self._pillow_renderer.draw(table_data, available_columns, title, subtitle)
+            with self._stage('savefig'):
+                self._pillow_renderer.save(image, output_path)
+        else:
+            with self._stage('render'):
+                fig = self.create_visualization(table_data, available_columns, title, None, subtitle=subtitle)
+            with self._stage('savefig'):
+                fig.savefig(output_path, dpi=REPORT_DPI, bbox_inches='tight', facecolor='white')
+                _pyplot().close(fig)
+        
+        if cache_key is not None:
+            self.render_cache.record(output_path, cache_key, rendered=True)
+        return output_path
+    
+    def table_row_styles(self, table_data):
+        """每个表格行的 (样式名, 底色)：TOTAL、月总和行（YYYY/MM）、周统计行（MM/DD~MM/DD）或每日数据行
+        
+        每日数据行按斑马纹交替底色，遇到月总和行或周统计行重新计数。
+        """
+        row_styles = []
+        row_counter = 0
+        for row_data in table_data:
+            row_label = str(row_data[0])
+            if 'TOTAL' in row_label:
+                style = 'total'
+            elif len(row_label) == 7 and '/' in row_label:
+                style = 'month'
+                row_counter = 0
+            elif '~' in row_label:
+                style = 'week'
+                row_counter = 0
+            else:
+                style = 'data'
+            
+            if style == 'data':
+                row_styles.append((style, TABLE_STYLES['data']['facecolor'][row_counter % 2]))
+                row_counter += 1
+            else:
+                row_styles.append((style, TABLE_STYLES[style]['facecolor']))
+        return row_styles
+    
+    def _apply_table_styles(self, table, table_data, available_columns):
         """应用表格样式"""
         # 表头样式
         for i in range(len(available_columns)):
-            cell = table[(0, i)]
-            cell.set_facecolor('#3d3d3d')
-            cell.set_text_props(weight='bold', color='white', fontsize=9, ha='center')
-            cell.set_height(0.08)
-            cell.set_edgecolor('white')
-            cell.set_linewidth(1.5)
+            self._style_cell(table[(0, i)], 'header')
         
         # 数据行样式
-        row_counter = 0
-        for i in range(1, len(table_data) + 1):
+        for i, (style, facecolor) in enumerate(self.table_row_styles(table_data), start=1):
             for j in range(len(available_columns)):
-                cell = table[(i, j)]
-                
-                is_month_summary = i in month_summary_rows
-                is_total = 'TOTAL' in str(table_data[i-1][0])
-                
-                if is_total:
-                    self._style_total_cell(cell)
-                elif is_month_summary:
-                    self._style_month_summary_cell(cell)
-                    row_counter = 0
-                else:
-                    self._style_data_cell(cell, row_counter % 2 == 0)
-                    
-                if not is_month_summary and not is_total and j == len(available_columns) - 1:
-                    row_counter += 1
-    
-    def _style_total_cell(self, cell):
-        """设置总计行样式"""
-        cell.set_facecolor('#3d3d3d')
-        cell.set_text_props(weight='bold', color='white', fontsize=10, ha='center')
-        cell.set_height(0.07)
-        cell.set_edgecolor('white')
-        cell.set_linewidth(1.5)
-    
-    def _style_month_summary_cell(self, cell):
-        """设置月度汇总行样式"""
-        cell.set_facecolor('#f9a825')
-        cell.set_text_props(weight='bold', color='white', fontsize=10, ha='center')
-        cell.set_height(0.07)
-        cell.set_edgecolor('white')
-        cell.set_linewidth(1.5)
-    
-    def _style_data_cell(self, cell, is_even_row):
-        """设置数据行样式"""
-        cell.set_facecolor('#f8f9fa' if is_even_row else 'white')
-        cell.set_text_props(fontsize=9, ha='center')
-        cell.set_height(0.06)
-        cell.set_edgecolor('#e0e0e0')
-        cell.set_linewidth(0.5)
-    
-    def save_report(self, fig, business_name, supervisor, output_dir='bd_reports'):
-        """保存报告图片"""
+                self._style_cell(table[(i, j)], style, facecolor)
+    
+    def _style_cell(self, cell, style, facecolor=None):
+        """按 TABLE_STYLES 设置单元格样式"""
+        spec = TABLE_STYLES[style]
+        cell.set_facecolor(facecolor or spec['facecolor'])
+        cell.set_text_props(weight=spec['weight'], color=spec['color'], fontsize=spec['fontsize'], ha='center')
+        cell.set_height(spec['height'])
+        cell.set_edgecolor(spec['edgecolor'])
+        cell.set_linewidth(spec['linewidth'])
+    
+    def report_path(self, business_name, supervisor, output_dir='bd_reports'):
+        """BD报表图片路径（按需创建总监文件夹）"""
         os.makedirs(output_dir, exist_ok=True)
         
         if supervisor:
             supervisor_folder = os.path.join(output_dir, supervisor.replace('/', '_').replace('\\', '_'))
             os.makedirs(supervisor_folder, exist_ok=True)
             safe_name = business_name.replace('/', '_').replace('\\', '_').replace(' ', '_')
-            output_path = os.path.join(supervisor_folder, f'{safe_name}_report.png')
-        else:
-            safe_name = business_name.replace('/', '_').replace('\\', '_').replace(' ', '_')
-            output_path = os.path.join(output_dir, f'{safe_name}_report.png')
+            return os.path.join(supervisor_folder, f'{safe_name}_report.png')
         
-        fig.savefig(output_path, dpi=200, bbox_inches='tight', facecolor='white')
-        plt.close(fig)
-        
-        return output_path
+        safe_name = business_name.replace('/', '_').replace('\\', '_').replace(' ', '_')
+        return os.path.join(output_dir, f'{safe_name}_report.png')
     
-    def save_kol_report(self, fig, kol_name, supervisor, bd_name, output_dir='agent_reports'):
-        """保存总代理报告图片到指定路径结构"""
-        # 创建路径结构: agent_reports/总监名文件夹/BD名文件夹/具体总代数据
+    def kol_report_path(self, kol_name, supervisor, bd_name, output_dir='agent_reports'):
+        """总代理报表图片路径: agent_reports/总监名文件夹/BD名文件夹/具体总代数据"""
         safe_supervisor = supervisor.replace('/', '_').replace('\\', '_')
         safe_bd_name = bd_name.replace('/', '_').replace('\\', '_')
         safe_kol_name = kol_name.replace('/', '_').replace('\\', '_').replace(' ', '_')
-
-        # 构建完整路径
+        
         kol_folder = os.path.join(output_dir, safe_supervisor, safe_bd_name)
         os.makedirs(kol_folder, exist_ok=True)
-
-        output_path = os.path.join(kol_folder, f'{safe_kol_name}_report.png')
-
-        fig.savefig(output_path, dpi=200, bbox_inches='tight', facecolor='white')
-        plt.close(fig)
-
-        return output_path
+        
+        return os.path.join(kol_folder, f'{safe_kol_name}_report.png')
     
-    def create_supervisor_report(self, supervisor_name, supervisor_data, output_dir='supervisor_reports'):
-        """为单个总监创建团队报表（包含该总监下所有商务BD）"""
+    def create_supervisor_report(self, supervisor_name, supervisor_data, output_dir='supervisor_reports',
+                                 daily_totals=None, rollups=None):
+        """为单个总监创建团队报表（包含该总监下所有商务BD）
+        
+        Args:
+            supervisor_name: 总监名称
+            supervisor_data: 该总监下各BD的每日聚合数据
+            output_dir: 输出目录
+            daily_totals: 预先汇总的总监级每日数据（可选）
+            rollups: 总监级预先计算的周期汇总 {'week': ..., 'month': ..., 'total': ...}（可选）
+        """
         
         os.makedirs(output_dir, exist_ok=True)
         
+        team = self.team_table(supervisor_name, supervisor_data, daily_totals, rollups)
+        if team is None:
+            return None
+        table_data, available_columns, title, subtitle = team
+        
+        # 渲染并保存
+        safe_name = supervisor_name.replace('/', '_').replace('\\', '_').replace(' ', '_')
+        output_path = os.path.join(output_dir, f'{safe_name}_team_report.png')
+        self.render_table_report(table_data, available_columns, title, output_path, subtitle)
+        
+        return output_path
+    
+    def team_table(self, supervisor_name, supervisor_data, daily_totals=None, rollups=None):
+        """团队报表的 (表格数据, 列, 标题, 副标题)，副标题显示团队成员；没有有效日期数据时返回 None"""
+        inputs = self._team_table_inputs(supervisor_name, supervisor_data, daily_totals, rollups)
+        if inputs is None:
+            return None
+        daily_totals, rollups, available_columns, businesses = inputs
+        
+        # 构建表格数据
+        with self._stage('table_build') as stage:
+            table_data = self._build_table_rows(daily_totals, rollups, available_columns)
+            stage['rows'] = len(table_data)
+        
+        business_list = ', '.join(businesses)
+        subtitle = f"Members: {business_list}" if business_list else None
+        return table_data, available_columns, f"{supervisor_name} Team", subtitle
+    
+    def create_team_table_frame(self, supervisor_name, supervisor_data, daily_totals=None, rollups=None):
+        """与团队报表相同的表格，以未格式化数值的 DataFrame 返回（不渲染）
+        
+        Returns:
+            (DataFrame, 团队成员列表)；没有有效日期数据时为 (None, None)
+        """
+        inputs = self._team_table_inputs(supervisor_name, supervisor_data, daily_totals, rollups)
+        if inputs is None:
+            return None, None
+        daily_totals, rollups, available_columns, businesses = inputs
+        
+        layout = self.table_layout(daily_totals, rollups, available_columns)
+        return self.table_frame(layout, available_columns), businesses
+    
+    def _team_table_inputs(self, supervisor_name, supervisor_data, daily_totals=None, rollups=None):
+        """团队表格的总监级每日数据（按日期倒序）、周期汇总、列和团队成员；没有有效日期数据时返回 None"""
         # 转换日期
-        supervisor_data['Date_dt'] = pd.to_datetime(supervisor_data['Date'], errors='coerce')
+        supervisor_data = supervisor_data.assign(Date_dt=pd.to_datetime(supervisor_data['Date'], errors='coerce'))
         supervisor_data = supervisor_data[supervisor_data['Date_dt'].notna()].copy()
         
         if len(supervisor_data) == 0:
@@ -438,409 +1140,94 @@ class DailyReportGenerator:
         # 按日期倒序
         supervisor_data = supervisor_data.sort_values('Date_dt', ascending=False).reset_index(drop=True)
         
-        # 添加年月信息
-        supervisor_data['Year'] = supervisor_data['Date_dt'].dt.year
-        supervisor_data['Month'] = supervisor_data['Date_dt'].dt.month
-        supervisor_data['YearMonth'] = supervisor_data['Date_dt'].dt.to_period('M')
-        
-        # 按日期汇总所有商务的数据
-        daily_totals = supervisor_data.groupby(['Date', 'Date_dt', 'Year', 'Month', 'YearMonth']).agg({
-            'Reg': 'sum',
-            'FTD': 'sum',
-            'FTT': 'sum',
-            'Deposit ($)': 'sum',
-            'Withdraw ($)': 'sum',
-            'Net Deposit ($)': 'sum',
-            'DAU': 'sum',
-            'Spot Vol ($)': 'sum',
-            'Spot Fee ($)': 'sum',
-            'Futures Vol ($)': 'sum',
-            'Futures Fee ($)': 'sum',
-            'Total Vol ($)': 'sum',
-            'Total Fee ($)': 'sum',
-            'Profit Fee ($)': 'sum',
-            'Activate KOL': 'sum',
-            'EFTTC': 'sum',
-            'Bonus Consumption': 'sum',
-            'Bonus Transfer Into': 'sum',
-            'Futures PNL': 'sum'
-        }).reset_index()
+        # 按日期汇总所有商务的数据（未预先汇总时现场计算）
+        if daily_totals is None:
+            daily_totals = self.daily_rollup(supervisor_data, [])
+        daily_totals = daily_totals.assign(Date_dt=pd.to_datetime(daily_totals['Date'], errors='coerce'))
+        daily_totals = daily_totals[daily_totals['Date_dt'].notna()]
         
         # 按日期倒序排列（最新日期在上）
         daily_totals = daily_totals.sort_values('Date_dt', ascending=False).reset_index(drop=True)
         
-        # 获取最新年月
-        latest_year_month = daily_totals['YearMonth'].iloc[0]
-        
-        # 获取团队成员列表（从Dimension列中提取商务名称）
-        dimensions = supervisor_data['Dimension'].unique()
-        businesses = []
-        for dim in dimensions:
-            if ' - ' in dim:
-                business_name = dim.split(' - ')[-1].strip()
-                if business_name and business_name not in businesses:
-                    businesses.append(business_name)
-        business_list = ', '.join(businesses)
+        # 获取团队成员列表（取BD层级列）
+        businesses = [bd for bd in supervisor_data['BD'].unique() if bd]
         
         # 准备列
-        columns = [
-            'Date', 'Reg', 'FTD', 'FTT', 'Deposit ($)', 'Withdraw ($)', 
-            'Net Deposit ($)', 'DAU', 'Spot Vol ($)', 'Spot Fee ($)', 
-            'Futures Vol ($)', 'Futures Fee ($)', 'Total Vol ($)', 'Total Fee ($)',
-            'Profit Fee ($)', 'Activate KOL', 'EFTTC', 'Bonus Consumption', 
-            'Bonus Transfer Into', 'Futures PNL'
-        ]
-        available_columns = [col for col in columns if col in daily_totals.columns]
-        
-        # 构建表格数据
-        table_data = []
-        month_groups = daily_totals.groupby('YearMonth', sort=False)
-        
-        # 为整个团队数据添加ISO周信息，用于处理跨月周
-        full_team_data = daily_totals.copy()
-        full_team_data['ISO_Year'] = full_team_data['Date_dt'].dt.isocalendar().year
-        full_team_data['ISO_Week'] = full_team_data['Date_dt'].dt.isocalendar().week
-        full_team_data['YearWeek'] = full_team_data['ISO_Year'].astype(str) + '-W' + full_team_data['ISO_Week'].astype(str).str.zfill(2)
-        
-        for year_month, month_data in month_groups:
-            year = month_data['Year'].iloc[0]
-            month = month_data['Month'].iloc[0]
-            is_latest_month = (year_month == latest_year_month)
-            is_complete = self.is_month_complete(month_data, year, month)
-            
-            if is_latest_month:
-                # 最新月：显示每日数据
-                # 为最新月数据添加周信息
-                month_data_with_weeks = month_data.copy()
-                month_data_with_weeks['ISO_Year'] = month_data_with_weeks['Date_dt'].dt.isocalendar().year
-                month_data_with_weeks['ISO_Week'] = month_data_with_weeks['Date_dt'].dt.isocalendar().week
-                month_data_with_weeks['YearWeek'] = month_data_with_weeks['ISO_Year'].astype(str) + '-W' + month_data_with_weeks['ISO_Week'].astype(str).str.zfill(2)
-                
-                # 显示每日数据并记录周信息
-                week_groups = {}
-                for _, row in month_data_with_weeks.iterrows():
-                    formatted_row = []
-                    for col in available_columns:
-                        value = row[col]
-                        if col == 'Date':
-                            formatted_row.append(row['Date_dt'].strftime('%Y-%m-%d'))
-                        else:
-                            formatted_row.append(self.format_number(value))
-                    table_data.append(formatted_row)
-                    
-                    # 记录每周的数据行索引
-                    week_key = row['YearWeek']
-                    if week_key not in week_groups:
-                        week_groups[week_key] = []
-                    week_groups[week_key].append(len(table_data) - 1)
-                
-                # 按周分组计算并添加周度统计
-                for week_key, row_indices in week_groups.items():
-                    # 获取该周的所有数据行（包括跨月的情况）
-                    week_data = full_team_data[full_team_data['YearWeek'] == week_key]
-                    
-                    # 创建周度统计行：使用日期区间格式
-                    start_date = week_data['Date_dt'].min()
-                    end_date = week_data['Date_dt'].max()
-                    week_total_label = f"{start_date.strftime('%m/%d')}~{end_date.strftime('%m/%d')}"
-                    week_total_row = [week_total_label]
-                    
-                    for col in available_columns[1:]:
-                        if col in ['DAU', 'Activate KOL']:
-                            week_total_row.append(self.format_number(week_data[col].max()))
-                        elif col == 'Reg':
-                            week_total_row.append(self.format_number(week_data[col].sum()))
-                        elif col == 'Onboard KOL':
-                            week_total_row.append(self.format_number(week_data[col].sum()))
-                        else:
-                            week_total_row.append(self.format_number(week_data[col].sum()))
-                    
-                    table_data.append(week_total_row)
-                
-                # 最新月总和
-                month_total_label = f"{year}/{month:02d}"
-                month_total_row = [month_total_label]
-                for col in available_columns[1:]:
-                    if col in ['DAU', 'Activate KOL']:
-                        month_total_row.append(self.format_number(month_data[col].max()))
-                    elif col == 'Reg':
-                        month_total_row.append(self.format_number(month_data[col].sum()))
-                    elif col == 'Onboard KOL':
-                        month_total_row.append(self.format_number(month_data[col].sum()))
-                    else:
-                        month_total_row.append(self.format_number(month_data[col].sum()))
-                table_data.append(month_total_row)
-                
-            elif is_complete:
-                # 历史完整月：只显示总和
-                month_total_label = f"{year}/{month:02d}"
-                month_total_row = [month_total_label]
-                for col in available_columns[1:]:
-                    if col in ['DAU', 'Activate KOL']:
-                        month_total_row.append(self.format_number(month_data[col].max()))
-                    elif col == 'Onboard KOL':
-                        month_total_row.append(self.format_number(month_data[col].sum()))
-                    else:
-                        month_total_row.append(self.format_number(month_data[col].sum()))
-                table_data.append(month_total_row)
-        
-        # 添加TOTAL行
-        if len(daily_totals) > 0:
-            total_row = ['TOTAL']
-            for col in available_columns[1:]:
-                if col in ['DAU', 'Activate KOL']:
-                    total_row.append(self.format_number(daily_totals[col].max()))
-                elif col == 'Onboard KOL':
-                    total_row.append(self.format_number(daily_totals[col].sum()))
-                else:
-                    total_row.append(self.format_number(daily_totals[col].sum()))
-            table_data.append(total_row)
+        available_columns = [col for col in self.display_columns if col in daily_totals.columns]
         
-        # 创建图表
-        fig_height = max(len(table_data) * 0.4 + 3, 11)
-        fig, ax = plt.subplots(figsize=(24, fig_height))
-        ax.axis('tight')
-        ax.axis('off')
+        # 周、月度和总计汇总（未预先计算时现场计算）
+        if rollups is None:
+            rollups = {period: self.period_rollup(daily_totals, [], period) for period in ('week', 'month', 'total')}
         
-        # 创建表格
-        table = ax.table(
-            cellText=table_data,
-            colLabels=available_columns,
-            cellLoc='center',
-            loc='center',
-            bbox=[0, 0, 1, 0.92]
-        )
+        return daily_totals, rollups, available_columns, businesses
+    
+    def comparison_cell_colors(self, change, heatmap=False):
+        """由变化率矩阵一次性计算对比表数据单元格的底色和文字颜色
         
-        # 表格样式
-        table.auto_set_font_size(False)
-        table.set_fontsize(10)
+        Args:
+            change: (行, 指标) 变化率矩阵（%），NaN 表示无法对比
+            heatmap: 为 True 时底色深浅按变化幅度缩放（100% 及以上为最深）
         
-        # 表头
-        for i in range(len(available_columns)):
-            cell = table[(0, i)]
-            cell.set_facecolor('#3d3d3d')
-            cell.set_text_props(weight='bold', color='white', fontsize=9, ha='center')
-            cell.set_height(0.08)
-            cell.set_edgecolor('white')
-            cell.set_linewidth(1.5)
-        
-        # 识别月总和行和周统计行
-        month_summary_rows = []
-        week_summary_rows = []
-        for i, row_data in enumerate(table_data):
-            row_label = str(row_data[0])
-            if len(row_label) == 7 and '/' in row_label and row_label != 'TOTAL':
-                month_summary_rows.append(i + 1)
-            elif '~' in row_label:
-                week_summary_rows.append(i + 1)
-        
-        # 设置行样式
-        row_counter = 0
-        for i in range(1, len(table_data) + 1):
-            for j in range(len(available_columns)):
-                cell = table[(i, j)]
-                
-                is_month_summary = i in month_summary_rows
-                is_week_summary = i in week_summary_rows
-                is_total = 'TOTAL' in str(table_data[i-1][0])
-                
-                if is_total:
-                    # TOTAL行
-                    cell.set_facecolor('#3d3d3d')
-                    cell.set_text_props(weight='bold', color='white', fontsize=10, ha='center')
-                    cell.set_height(0.07)
-                    cell.set_edgecolor('white')
-                    cell.set_linewidth(1.5)
-                elif is_month_summary:
-                    # 月总和行
-                    cell.set_facecolor('#f9a825')
-                    cell.set_text_props(weight='bold', color='white', fontsize=10, ha='center')
-                    cell.set_height(0.07)
-                    cell.set_edgecolor('white')
-                    cell.set_linewidth(1.5)
-                    row_counter = 0
-                elif is_week_summary:
-                    # 周统计行 - 浅蓝色背景
-                    cell.set_facecolor('#b3e5fc')
-                    cell.set_text_props(weight='bold', color='#0277bd', fontsize=10, ha='center')
-                    cell.set_height(0.07)
-                    cell.set_edgecolor('white')
-                    cell.set_linewidth(1.5)
-                    row_counter = 0
-                else:
-                    # 每日数据行
-                    if row_counter % 2 == 0:
-                        cell.set_facecolor('#f8f9fa')
-                    else:
-                        cell.set_facecolor('white')
-                    cell.set_text_props(fontsize=9, ha='center')
-                    cell.set_height(0.06)
-                    cell.set_edgecolor('#e0e0e0')
-                    cell.set_linewidth(0.5)
-                    
-                if not is_month_summary and not is_week_summary and not is_total:
-                    if j == len(available_columns) - 1:
-                        row_counter += 1
-        
-        # 添加标题
-        title_y_position = 0.98
-        fig.text(0.05, title_y_position, f"{supervisor_name} Team", 
-                 fontsize=22, fontweight='bold', 
-                 verticalalignment='top',
-                 color='#2c3e50')
-        
-        # 副标题显示团队成员
-        if business_list:
-            fig.text(0.05, 0.95, f"Members: {business_list}", 
-                     fontsize=10, style='italic',
-                     verticalalignment='top',
-                     color='#7f8c8d')
-        
-        plt.tight_layout()
-        plt.subplots_adjust(top=0.94, bottom=0.02)
-        
-        # 保存
-        safe_name = supervisor_name.replace('/', '_').replace('\\', '_').replace(' ', '_')
-        output_path = os.path.join(output_dir, f'{safe_name}_team_report.png')
-        fig.savefig(output_path, dpi=200, bbox_inches='tight', facecolor='white')
-        plt.close(fig)
-        
-        return output_path
-    
-    def format_change_rate(self, current, previous):
-        """计算并格式化变化率"""
-        if pd.isna(previous) or previous == 0:
-            if current > 0:
-                return '+100%'
-            else:
-                return '0%'
-        
-        change_rate = ((current - previous) / abs(previous)) * 100
-        
-        if change_rate > 0:
-            return f'+{change_rate:.1f}%'
-        elif change_rate < 0:
-            return f'{change_rate:.1f}%'
+        Returns:
+            (sign, facecolors, textcolors)：sign 为按显示精度（0.1%）取的符号矩阵，
+            facecolors 为 (行, 指标, 3) 的RGB数组，textcolors 为颜色字符串矩阵
+        """
+        sign = np.sign(np.nan_to_num(np.round(change, 1)))
+        
+        # 无变化或无法对比：斑马纹灰白底色
+        zebra = np.where(np.arange(change.shape[0]) % 2 == 0, 0xf8 / 255, 1.0)
+        facecolors = np.repeat(zebra[:, None, None], 3, axis=2) * np.ones(change.shape + (3,))
+        
+        from matplotlib import colors as mcolors
+        increase = np.array(mcolors.to_rgb('#c8e6c9' if not heatmap else '#66bb6a'))
+        decrease = np.array(mcolors.to_rgb('#ffcdd2' if not heatmap else '#ef5350'))
+        if heatmap:
+            # 按变化幅度在白色和最深色之间插值，最浅保留 15% 以便区分正负
+            strength = np.clip(np.abs(np.nan_to_num(change)) / 100, 0.15, 1)[..., None]
+            white = np.ones(3)
+            facecolors = np.where((sign > 0)[..., None], white + (increase - white) * strength, facecolors)
+            facecolors = np.where((sign < 0)[..., None], white + (decrease - white) * strength, facecolors)
         else:
-            return '0%'
-    
-    def create_supervisors_daily_report(self, data, output_path='supervisor_daily_comparison.png', days=1):
-        """创建所有总监的每日数据对比报表（含日环比变化率）"""
+            facecolors[sign > 0] = increase
+            facecolors[sign < 0] = decrease
         
-        # 转换日期 - 使用正确的列名
-        date_column = None
-        for col in data.columns:
-            if '日期' in col or 'date' in col.lower():
-                date_column = col
-                break
-        
-        if not date_column:
-            print("⚠ 没有找到日期列")
-            return None
-            
-        data['Date_dt'] = pd.to_datetime(data[date_column], errors='coerce')
-        data = data[data['Date_dt'].notna()].copy()
+        textcolors = np.select([sign > 0, sign < 0], ['#2e7d32', '#c62828'], '#424242').astype(object)
+        return sign, facecolors, textcolors
+    
+    def create_supervisors_daily_report(self, data, output_path='supervisor_daily_comparison.png', days=1, period=None,
+                                        sort_by='Total Vol ($)', heatmap=False, as_of=None):
+        """创建所有总监的每日数据对比报表（含变化率）
         
-        if len(data) == 0:
-            print("⚠ 没有有效日期数据")
+        Args:
+            data: 总监级每日数据（含 Supervisor、Date 列）
+            output_path: 输出路径
+            days: 与N天前对比（period 未指定时使用，默认1即日环比）
+            period: 'dod'、'wow'、'mom' 或天数（可选）
+            sort_by: 排序指标（按最新一天的值降序）
+            heatmap: 变化率单元格按幅度显示颜色深浅
+            as_of: 对比日期（默认最新一天；没有该日期时取之前最近的一天）
+        """
+        comparison = self.compare_supervisors(data, days, period, sort_by, as_of)
+        if comparison is None:
             return None
+        sort_by = comparison['sort_by']
+        latest_date = comparison['date']
         
-        # 按日期倒序排列，获取最近N天（用于计算变化率需要N+1天）
-        data = data.sort_values('Date_dt', ascending=False).reset_index(drop=True)
-        latest_date = data['Date_dt'].iloc[0]
-        cutoff_date = latest_date - timedelta(days=days)  # 获取days+1天数据用于计算变化率
-        recent_data = data[data['Date_dt'] >= cutoff_date].copy()
-        
-        # 获取所有总监 - 使用原始数据中的商务总监列
-        supervisor_column = None
-        for col in recent_data.columns:
-            if '商务总监' in col or 'supervisor' in col.lower():
-                supervisor_column = col
-                break
-        
-        if not supervisor_column:
-            print("⚠ 没有找到商务总监列")
-            return None
-            
-        # 获取所有总监
-        supervisors = recent_data[supervisor_column].unique()
+        # 数值整块批量格式化；当天没有数据的总监显示 '-'
+        current = comparison['current']
+        value_texts = np.where(np.isnan(current), '-', self.format_numbers(np.nan_to_num(current)))
+        change_texts = comparison['change_text']
         
-        # 关键指标列
-        key_metrics = [
-            'Reg', 'FTD', 'FTT', 'Net Deposit ($)', 'DAU', 
-            'Total Vol ($)', 'Total Fee ($)', 'Profit Fee ($)', 
-            'Activate KOL', 'EFTTC', 'Futures PNL'
-        ]
+        # 单元格颜色由变化率矩阵决定，不再解析单元格文本
+        change_sign, facecolors, textcolors = self.comparison_cell_colors(comparison['change'], heatmap)
         
-        # 获取所有总监并按最新一天的Total Vol降序排序
-        supervisors_data = []
-        for supervisor in supervisors:
-            supervisor_data = recent_data[recent_data[supervisor_column] == supervisor].copy()
-            supervisor_data = supervisor_data.sort_values('Date_dt', ascending=False).reset_index(drop=True)
-            
-            if len(supervisor_data) == 0:
-                continue
-            
-            # 获取最新一天的Total Vol用于排序
-            latest_total_vol = supervisor_data.iloc[0].get('Total Vol ($)', 0)
-            supervisors_data.append({
-                'supervisor': supervisor,
-                'data': supervisor_data,
-                'total_vol': latest_total_vol
-            })
-        
-        # 按交易量降序排序
-        supervisors_data.sort(key=lambda x: x['total_vol'], reverse=True)
-        
-        # 构建表格数据
+        # 构建表格数据（合并显示：数值 (变化率)）
         table_data = []
-        
-        for item in supervisors_data:
-            supervisor = item['supervisor']
-            supervisor_data = item['data']
-            
-            if len(supervisor_data) == 0:
-                continue
-            
-            # 只取最新的一天数据，但需要前一天数据来计算变化率
-            latest_row = supervisor_data.iloc[0]
-            prev_row = supervisor_data.iloc[1] if len(supervisor_data) > 1 else None
-            
-            date_str = latest_row['Date_dt'].strftime('%Y-%m-%d')
-            data_row = [supervisor]  # 第一列显示总监名称
-            
-            # 为每个指标添加数值和变化率（合并显示）
-            for metric in key_metrics:
-                # 安全获取当前值
-                if metric in latest_row.index:
-                    current_value = latest_row[metric]
-                    if pd.isna(current_value):
-                        current_value = 0
-                else:
-                    current_value = 0
-                
-                # 获取变化率
-                if prev_row is not None:
-                    # 安全获取前一天的值
-                    if metric in prev_row.index:
-                        prev_value = prev_row[metric]
-                        if pd.isna(prev_value):
-                            prev_value = 0
-                    else:
-                        prev_value = 0
-                    
-                    change_rate = self.format_change_rate(current_value, prev_value)
-                else:
-                    change_rate = '-'
-                
-                # 合并显示：数值 (变化率)
-                combined_text = f"{self.format_number(current_value)} ({change_rate})"
-                data_row.append(combined_text)
-            
-            table_data.append(data_row)
+        for supervisor, values, changes in zip(comparison['entities'], value_texts, change_texts):
+            table_data.append([supervisor] + [f"{value} ({change})" for value, change in zip(values, changes)])
         
         # 创建列标题（不再需要单独的Δ%列）
-        col_labels = ['Supervisor'] + key_metrics
+        col_labels = ['Supervisor'] + self.comparison_metrics
         
         # 创建图表
         num_rows = len(table_data)
@@ -849,6 +1236,7 @@ class DailyReportGenerator:
         fig_width = max(26, num_cols * 1.8)  # 增加列宽以容纳数值+变化率
         fig_height = max(num_rows * 0.5 + 3, 10)
         
+        plt = _pyplot()
         fig, ax = plt.subplots(figsize=(fig_width, fig_height))
         ax.axis('tight')
         ax.axis('off')
@@ -879,41 +1267,22 @@ class DailyReportGenerator:
             cell.set_linewidth(1)
         
         # 数据行样式
-        row_counter = 0
-        
         for i in range(1, num_rows + 1):
             for j in range(num_cols):
                 cell = table[(i, j)]
-                cell_text = str(table_data[i-1][j])
                 
                 if j == 0:  # 总监名称列
                     cell.set_facecolor('#1976d2')
                     cell.set_text_props(fontsize=9, ha='left', weight='bold', color='white')
                     cell.set_height(0.045)
-                else:  # 数据列（包含数值和变化率）
-                    # 根据变化率部分设置颜色
-                    if '(+' in cell_text and '(+0%' not in cell_text and '(+0.0%' not in cell_text:
-                        # 正增长 - 绿色
-                        cell.set_facecolor('#c8e6c9')
-                        cell.set_text_props(fontsize=8, ha='center', color='#2e7d32', weight='bold')
-                    elif '(-' in cell_text and '(-)' not in cell_text and '(0%)' not in cell_text:
-                        # 负增长 - 红色
-                        cell.set_facecolor('#ffcdd2')
-                        cell.set_text_props(fontsize=8, ha='center', color='#c62828', weight='bold')
-                    else:
-                        # 无变化或首日 - 灰色
-                        if row_counter % 2 == 0:
-                            cell.set_facecolor('#f8f9fa')
-                        else:
-                            cell.set_facecolor('white')
-                        cell.set_text_props(fontsize=8, ha='center', color='#424242')
-                    
+                else:  # 数据列（包含数值和变化率）：增长绿色、下降红色、无变化或无法对比灰色
+                    cell.set_facecolor(facecolors[i - 1, j - 1])
+                    weight = 'bold' if change_sign[i - 1, j - 1] != 0 else 'normal'
+                    cell.set_text_props(fontsize=8, ha='center', color=textcolors[i - 1, j - 1], weight=weight)
                     cell.set_height(0.04)
                 
                 cell.set_edgecolor('#e0e0e0')
                 cell.set_linewidth(0.5)
-            
-            row_counter += 1
         
         # 添加标题
         latest_date_str = latest_date.strftime('%Y-%m-%d')
@@ -923,12 +1292,15 @@ class DailyReportGenerator:
                  ha='center', va='top',
                  color='#2c3e50')
         
-        fig.text(0.5, 0.96, f'Date: {latest_date_str} | Sorted by Total Vol (Desc) | Format: Value (Change%)', 
+        previous_date_str = comparison['previous_date'].strftime('%Y-%m-%d') if comparison['previous_date'] is not None else '-'
+        fig.text(0.5, 0.96, f'Date: {latest_date_str} | vs {previous_date_str} ({comparison["label"]}) | '
+                 f'Sorted by {sort_by} (Desc) | Format: Value (Change%)', 
                  fontsize=11, style='italic',
                  ha='center', va='top',
                  color='#7f8c8d')
         
         # 添加图例
+        import matplotlib.patches as mpatches
         legend_elements = [
             mpatches.Rectangle((0, 0), 1, 1, fc='#c8e6c9', edgecolor='none', label='Increase'),
             mpatches.Rectangle((0, 0), 1, 1, fc='#ffcdd2', edgecolor='none', label='Decrease'),
@@ -945,12 +1317,66 @@ class DailyReportGenerator:
         plt.subplots_adjust(top=0.94, bottom=0.02)
         
         # 保存
-        fig.savefig(output_path, dpi=200, bbox_inches='tight', facecolor='white')
-        plt.close(fig)
+        with self._stage('savefig'):
+            fig.savefig(output_path, dpi=REPORT_DPI, bbox_inches='tight', facecolor='white')
+            plt.close(fig)
         
         return output_path
     
-    def create_bd_report(self, agent_name, agent_data, output_dir='bd_reports', kol_name=None):
+    def compare_supervisors(self, data, days=1, period=None, sort_by='Total Vol ($)', as_of=None):
+        """计算总监对比报表的数据（不渲染），参数含义同 create_supervisors_daily_report
+        
+        Returns:
+            ComparisonEngine.compare 的结果，各矩阵只保留对比窗口内有数据的总监并按排序指标降序，
+            另附 entities（总监名）、metrics 和实际使用的 sort_by；没有数据时返回 None
+        """
+        if 'Supervisor' not in data.columns or 'Date' not in data.columns:
+            print("⚠ 没有找到总监或日期列")
+            return None
+        
+        metrics = self.comparison_metrics
+        engine = ComparisonEngine(data, metrics)
+        if len(engine.dates) == 0:
+            print("⚠ 没有有效日期数据")
+            return None
+        
+        if sort_by not in metrics:
+            print(f"⚠ 不支持按 {sort_by} 排序，改为按 Total Vol ($) 排序")
+            sort_by = 'Total Vol ($)'
+        
+        comparison = engine.compare(period if period is not None else days, as_of=as_of)
+        
+        # 对比窗口内有数据的总监，按最新一天的排序指标降序（当天没有数据的排在最后）
+        rows = np.flatnonzero(comparison['present'])
+        sort_values = np.nan_to_num(comparison['current'][rows, metrics.index(sort_by)], nan=-np.inf)
+        rows = rows[np.argsort(-sort_values, kind='stable')]
+        
+        for key in ('current', 'previous', 'change', 'change_text'):
+            comparison[key] = comparison[key][rows]
+        
+        # 没有总监的数据显示为 Other；有总监恰好叫 Other 时改用不会重名的标签
+        entities = engine.entities[rows].copy()
+        no_supervisor = entities == ''
+        if no_supervisor.any():
+            entities[no_supervisor] = 'Other' if 'Other' not in set(engine.entities) else 'Other (无总监)'
+        comparison.update(entities=entities, metrics=metrics, sort_by=sort_by)
+        return comparison
+    
+    def comparison_frame(self, comparison):
+        """compare_supervisors 的结果转为 DataFrame：每位总监一行，每个指标有当天值、对比值和变化率(%)"""
+        frame = pd.DataFrame({
+            'Supervisor': comparison['entities'],
+            'Date': comparison['date'],
+            'Previous Date': comparison['previous_date'],
+            'Period': comparison['label'],
+        })
+        for i, metric in enumerate(comparison['metrics']):
+            frame[metric] = comparison['current'][:, i]
+            frame[f'{metric} (Prev)'] = comparison['previous'][:, i]
+            frame[f'{metric} Change (%)'] = comparison['change'][:, i]
+        return frame
+    
+    def create_bd_report(self, agent_name, agent_data, output_dir='bd_reports', kol_name=None, rollups=None):
         """为单个代理创建报表图片
         
         Args:
@@ -958,59 +1384,88 @@ class DailyReportGenerator:
             agent_data: 代理数据
             output_dir: 输出目录
             kol_name: 总代理名称（如果为总代理数据）
+            rollups: 该代理预先计算的周期汇总（可选）
         """
-        result = self.create_table_data(agent_data, kol_name)
-        if result is None:
+        with self._stage('table_build') as stage:
+            table_data, available_columns, business_name, supervisor = self.create_table_data(agent_data, kol_name, rollups)
+            stage['rows'] = len(table_data) if table_data is not None else 0
+        if table_data is None:
             return None
         
-        table_data, available_columns, business_name, supervisor = result
-        fig = self.create_visualization(table_data, available_columns, business_name, supervisor)
-        
         # 如果是总代理报表，使用特殊的保存路径
         if kol_name:
-            output_path = self.save_kol_report(fig, business_name, supervisor, agent_data['Dimension'].iloc[0].split(' - ')[-1], output_dir)
+            output_path = self.kol_report_path(business_name, supervisor, agent_data['BD'].iloc[0], output_dir)
         else:
-            output_path = self.save_report(fig, business_name, supervisor, output_dir)
+            output_path = self.report_path(business_name, supervisor, output_dir)
         
-        return output_path
+        return self.render_table_report(table_data, available_columns, business_name, output_path)
+    
+    def build_hierarchy_index(self, df):
+        """由层级列构建层级索引：每个维度一行，记录其所属的总监和BD（按首次出现的顺序）"""
+        return df[['Supervisor', 'BD', 'Dimension']].drop_duplicates('Dimension').reset_index(drop=True)
+    
+    def partition_by(self, df, keys):
+        """按键一次性排序分区，返回 {键: 切片视图}，取代逐个键的布尔扫描
+        
+        分区内保持原有行顺序；多列键返回元组作为键。
+        """
+        if len(df) == 0:
+            return {}
+        
+        key_cols = [keys] if isinstance(keys, str) else list(keys)
+        group_codes = df.groupby(key_cols, observed=True, sort=False).ngroup().to_numpy()
+        order = np.argsort(group_codes, kind='stable')
+        sorted_df = df.take(order)
+        
+        starts = np.flatnonzero(np.diff(group_codes[order], prepend=-1))
+        ends = np.append(starts[1:], len(sorted_df))
+        key_values = sorted_df[key_cols].iloc[starts].itertuples(index=False, name=None)
+        
+        partitions = {}
+        for key, start, end in zip(key_values, starts, ends):
+            partitions[key[0] if isinstance(keys, str) else key] = sorted_df.iloc[start:end]
+        return partitions
     
     def group_by_supervisor(self, result_df):
         """按总监分组"""
         supervisor_groups = {}
-        dimensions = result_df['Dimension'].unique()
+        index = self.build_hierarchy_index(result_df)
         
-        for dimension in dimensions:
-            if ' - ' in dimension:
-                supervisor = dimension.split(' - ')[0].strip()
-            else:
-                supervisor = 'Other'
-            
+        for supervisor, dimension in zip(index['Supervisor'], index['Dimension']):
+            supervisor = supervisor if supervisor else 'Other'
             if supervisor not in supervisor_groups:
                 supervisor_groups[supervisor] = []
             supervisor_groups[supervisor].append(dimension)
         
         return supervisor_groups
     
-    def generate_reports(self, processed_df=None, csv_file='raw_data.csv', output_dir='bd_reports'):
+    def generate_reports(self, processed_df=None, csv_file='raw_data.csv', output_dir='bd_reports',
+                         aggregated_df=None, cube=None, workers=1, report_filter=None):
         """生成所有商务BD的报表
         
         Args:
             processed_df: 已处理的数据DataFrame（可选）
             csv_file: CSV文件路径（当processed_df为None时使用）
             output_dir: 输出目录
+            aggregated_df: 已聚合的数据DataFrame（可选）
+            cube: 本次运行共享的 RollupCube（可选，优先使用）
+            workers: 渲染进程数（大于1时并行渲染）
+            report_filter: ReportFilter，只生成所选总监、BD和日期范围内的报表（可选）
         """
         print("=" * 80)
         print("开始读取和处理数据...")
         print("=" * 80)
         
-        # 如果传入了处理过的数据，直接使用；否则读取CSV
-        if processed_df is not None:
-            result = self.aggregate_data(processed_df)
-        else:
-            # 读取和处理数据
-            df = pd.read_csv(csv_file)
-            df = self.process_raw_data(df)
-            result = self.aggregate_data(df)
+        # 优先使用共享的汇总立方；否则由聚合结果、处理过的数据或CSV构建
+        if cube is None:
+            if aggregated_df is not None:
+                cube = RollupCube(self, bd_daily=aggregated_df)
+            else:
+                if processed_df is None:
+                    # 读取和处理数据（命中缓存时跳过解析）
+                    processed_df = self.load_processed_data(csv_file)
+                cube = RollupCube(self, processed_df=processed_df)
+        result = cube.daily('bd')
         
         # 按总监分组
         supervisor_groups = self.group_by_supervisor(result)
@@ -1020,17 +1475,35 @@ class DailyReportGenerator:
         
         generated_files = []
         
-        # 按总监分组生成报表
+        # 一次性按维度分区，每个渲染任务只携带该BD的切片和汇总
+        partitions = cube.partitions('bd')
+        jobs = []
+        labels = []
         for supervisor in sorted(supervisor_groups.keys()):
-            print(f"\n📁 总监: {supervisor}")
-            print("-" * 80)
-            
+            if report_filter is not None and not report_filter.wants_supervisor(supervisor):
+                continue
             for dimension in supervisor_groups[supervisor]:
-                agent_data = result[result['Dimension'] == dimension].copy()
-                output_path = self.create_bd_report(dimension, agent_data, output_dir)
-                if output_path:
-                    generated_files.append(output_path)
-                    print(f"  ✓ {dimension} -> {output_path}")
+                bd_data = partitions[dimension]
+                if report_filter is not None and not (report_filter.wants_bd(bd_data['BD'].iat[0], dimension)
+                                                      and report_filter.in_range(bd_data)):
+                    continue
+                rollups = cube.entity_rollups('bd', dimension)
+                jobs.append(('create_bd_report', (dimension, bd_data, output_dir), {'rollups': rollups}))
+                labels.append((supervisor, dimension))
+        
+        # 按总监分组输出渲染结果（结果顺序与任务顺序一致）
+        current_supervisor = None
+        for (supervisor, dimension), (output_path, error) in zip(labels, self.run_render_jobs(jobs, workers, 'bd')):
+            if supervisor != current_supervisor:
+                print(f"\n📁 总监: {supervisor}")
+                print("-" * 80)
+                current_supervisor = supervisor
+            
+            if error:
+                print(f"  ❌ {dimension}: {error}")
+            elif output_path:
+                generated_files.append(output_path)
+                print(f"  ✓ {dimension} -> {output_path}")
         
         print("=" * 80)
         print(f"报表生成完成！共生成 {len(generated_files)} 个文件")
@@ -1038,60 +1511,64 @@ class DailyReportGenerator:
         
         return generated_files
     
-    def generate_kol_reports(self, processed_df=None, csv_file='raw_data.csv', output_dir='agent_reports'):
+    def generate_kol_reports(self, processed_df=None, csv_file='raw_data.csv', output_dir='agent_reports', cube=None,
+                             workers=1, report_filter=None):
         """生成所有总代理的报表
         
         Args:
             processed_df: 已处理的数据DataFrame（可选）
             csv_file: CSV文件路径（当processed_df为None时使用）
             output_dir: 输出目录
+            cube: 本次运行共享的 RollupCube（可选，优先使用）
+            workers: 渲染进程数（大于1时并行渲染）
+            report_filter: ReportFilter，只生成所选总监、BD和日期范围内的报表（可选）
         """
         print("=" * 80)
         print("开始读取和处理总代理数据...")
         print("=" * 80)
         
-        # 如果传入了处理过的数据，直接使用；否则读取CSV
-        if processed_df is not None:
-            result = self.aggregate_data_by_kol(processed_df)
-        else:
-            # 读取和处理数据
-            df = pd.read_csv(csv_file)
-            df = self.process_raw_data(df)
-            result = self.aggregate_data_by_kol(df)
+        # 优先使用共享的汇总立方；否则读取CSV构建
+        if cube is None:
+            if processed_df is None:
+                # 读取和处理数据（命中缓存时跳过解析）
+                processed_df = self.load_processed_data(csv_file)
+            cube = RollupCube(self, processed_df=processed_df)
+        result = cube.daily('kol')
         
         if len(result) == 0:
             print("没有找到总代理数据")
             return []
         
-        # 按总监和BD分组
+        # 按总监、BD和总代理一次性分区
         kol_groups = {}
-        for _, row in result.iterrows():
-            kol_name = row['总代理']
-            dimension = row['Dimension']
-            
-            if ' - ' in dimension:
-                parts = dimension.split(' - ')
-                supervisor = parts[0].strip()
-                bd_name = parts[-1].strip()
-            else:
-                supervisor = 'Other'
-                bd_name = dimension
-            
-            key = (supervisor, bd_name, kol_name)
-            if key not in kol_groups:
-                kol_groups[key] = []
-            kol_groups[key].append(row)
+        for key, kol_df in cube.partitions('kol').items():
+            supervisor, bd_name, kol_name = key
+            if report_filter is not None and not (report_filter.wants_supervisor(supervisor)
+                                                  and report_filter.wants_bd(bd_name)
+                                                  and report_filter.in_range(kol_df)):
+                continue
+            kol_groups[(supervisor if supervisor else 'Other', bd_name, kol_name)] = (key, kol_df)
         
         print(f"开始生成 {len(kol_groups)} 个总代理的报表图片...")
         print("=" * 80)
         
         generated_files = []
         
-        # 按总监分组生成总代理报表
+        # 每个渲染任务只携带该总代理的切片和汇总
+        labels = sorted(kol_groups)
+        jobs = []
+        for label in labels:
+            key, kol_data = kol_groups[label]
+            kol_name = label[2]
+            rollups = cube.entity_rollups('kol', key)
+            jobs.append(('create_bd_report', (kol_name, kol_data, output_dir, kol_name), {'rollups': rollups}))
+        
+        # 按总监分组输出渲染结果
         current_supervisor = None
         current_bd = None
         
-        for (supervisor, bd_name, kol_name), kol_data in sorted(kol_groups.items()):
+        results = self.run_render_jobs(jobs, workers, 'kol')
+        for (supervisor, bd_name, kol_name), (output_path, error) in zip(labels, results):
             if supervisor != current_supervisor:
                 print(f"\n📁 总监: {supervisor}")
                 print("-" * 80)
@@ -1102,10 +1579,9 @@ class DailyReportGenerator:
                 print(f"  📂 BD: {bd_name}")
                 current_bd = bd_name
             
-            # 转换数据为DataFrame
-            kol_df = pd.DataFrame(kol_data)
-            output_path = self.create_bd_report(kol_name, kol_df, output_dir, kol_name)
-            if output_path:
+            if error:
+                print(f"    ❌ {kol_name}: {error}")
+            elif output_path:
                 generated_files.append(output_path)
                 print(f"    ✓ {kol_name} -> {output_path}")
         
@@ -1114,76 +1590,1611 @@ class DailyReportGenerator:
         print("=" * 80)
         
         return generated_files
+    
+    def generate_team_reports(self, cube, output_dir='supervisor_reports', workers=1, report_filter=None):
+        """生成所有总监的团队报表
+        
+        Args:
+            cube: 本次运行共享的 RollupCube
+            output_dir: 输出目录
+            workers: 渲染进程数（大于1时并行渲染）
+            report_filter: ReportFilter，只生成所选总监（或包含所选BD的团队）且日期范围内有数据的报表（可选）
+        """
+        aggregated_df = cube.daily('bd')
+        
+        # 按总监分组数据
+        supervisor_groups = self.group_by_supervisor(aggregated_df)
+        supervisor_partitions = self.partition_by(aggregated_df, 'Supervisor')
+        supervisor_daily = cube.partitions('supervisor')
+        
+        jobs = []
+        selected = []
+        for supervisor_name in supervisor_groups:
+            # 该总监的所有数据（及预先汇总的总监级数据）
+            supervisor_df = supervisor_partitions.get(supervisor_name, aggregated_df.iloc[0:0])
+            if report_filter is not None and not (report_filter.wants_supervisor(supervisor_name)
+                                                  and (report_filter.bds is None
+                                                       or supervisor_df['BD'].isin(report_filter.bds).any())
+                                                  and report_filter.in_range(supervisor_df)):
+                continue
+            selected.append(supervisor_name)
+            kwargs = {'output_dir': output_dir}
+            if supervisor_name in supervisor_daily:
+                kwargs['daily_totals'] = supervisor_daily[supervisor_name]
+                kwargs['rollups'] = cube.entity_rollups('supervisor', supervisor_name)
+            jobs.append(('create_supervisor_report', (supervisor_name, supervisor_df), kwargs))
+        
+        team_reports = []
+        for supervisor_name, (report_path, error) in zip(selected, self.run_render_jobs(jobs, workers, 'team')):
+            if error:
+                print(f"❌ 生成 {supervisor_name} 团队报表时出错: {error}")
+            elif report_path:
+                team_reports.append(report_path)
+                print(f"✅ {supervisor_name} 团队报表已生成: {report_path}")
+        
+        return team_reports
+    
+    def run_render_jobs(self, jobs, workers=1, report_type='report'):
+        """执行渲染任务，按任务顺序逐个产出 (输出路径, 错误信息)
+        
+        Args:
+            jobs: 任务列表，每个任务为 (方法名, 位置参数, 关键字参数)，参数只包含该报表自己的数据切片
+            workers: 进程数；小于等于1时在当前进程内串行执行
+            report_type: 报表类型（启用 metrics 时按类型记录每张报表的耗时）
+        """
+        if workers <= 1 or len(jobs) <= 1:
+            results = (_run_render_job(job, self) for job in jobs)
+            executor = None
+        else:
+            # 小任务按块分发，减少进程间通信次数；子进程读取同一份渲染缓存清单
+            cache_path = self.render_cache.path if self.render_cache is not None else None
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                                           initargs=(self.renderer, cache_path, self.metrics is not None))
+            results = executor.map(_run_render_job, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+        
+        try:
+            for job, (output_path, error, cache_updates, timing) in zip(jobs, results):
+                # 各任务的缓存记录和指标回到主进程合并，由主进程统一写出
+                if self.render_cache is not None:
+                    self.render_cache.merge(cache_updates)
+                if self.metrics is not None and timing is not None:
+                    seconds, stages = timing
+                    self.metrics.merge(stages)
+                    # 没有输出也没有出错的任务（如没有有效数据的 Other 团队）不计为报表
+                    if output_path or error:
+                        self.metrics.record_report(report_type, output_path or str(job[1][0]), seconds, stages, error)
+                yield output_path, error
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    
+    def export_tables(self, cube, output_dir='exports', formats=('csv',), types=('bd', 'kol', 'team', 'comparison'),
+                      report_filter=None, period='dod', sort_by='Total Vol ($)', as_of=None):
+        """只导出报表表格的数据（未格式化的数值和行类型），不渲染图片、不导入 matplotlib
+        
+        每种报表类型一个文件（如 exports/bd_tables.csv），每行带实体列（总监/BD/总代理）、
+        Row Type（daily/week/month/TOTAL）、Label 以及行的起止日期；对比报表每位总监一行。
+        
+        Args:
+            cube: 本次运行共享的 RollupCube
+            output_dir: 输出目录
+            formats: 输出格式，'csv'、'json'、'parquet' 的任意组合
+            types: 导出的报表类型
+            report_filter: ReportFilter，只导出所选总监、BD和日期范围内的报表（可选）
+            period, sort_by, as_of: 对比报表的对比周期、排序指标和对比日期
+        
+        Returns:
+            {报表类型: 输出文件路径列表}
+        """
+        report_filter = report_filter or ReportFilter()
+        frames = {}
+        
+        if 'bd' in types:
+            partitions = cube.partitions('bd')
+            tables = []
+            for supervisor, dimensions in sorted(self.group_by_supervisor(cube.daily('bd')).items()):
+                if not report_filter.wants_supervisor(supervisor):
+                    continue
+                for dimension in dimensions:
+                    bd_data = partitions[dimension]
+                    bd_name = bd_data['BD'].iat[0]
+                    if not (report_filter.wants_bd(bd_name, dimension) and report_filter.in_range(bd_data)):
+                        continue
+                    frame = self.create_table_frame(bd_data, rollups=cube.entity_rollups('bd', dimension))[0]
+                    if frame is not None:
+                        tables.append(frame.assign(Supervisor=supervisor, BD=bd_name, Dimension=dimension))
+            frames['bd'] = (tables, ['Supervisor', 'BD', 'Dimension'])
+        
+        if 'kol' in types and len(cube.daily('kol')) > 0:
+            tables = []
+            for key, kol_data in sorted(cube.partitions('kol').items()):
+                supervisor, bd_name, kol_name = key
+                if not (report_filter.wants_supervisor(supervisor) and report_filter.wants_bd(bd_name)
+                        and report_filter.in_range(kol_data)):
+                    continue
+                frame = self.create_table_frame(kol_data, kol_name, cube.entity_rollups('kol', key))[0]
+                if frame is not None:
+                    tables.append(frame.assign(Supervisor=supervisor or 'Other', BD=bd_name, KOL=kol_name))
+            frames['kol'] = (tables, ['Supervisor', 'BD', 'KOL'])
+        
+        if 'team' in types:
+            aggregated_df = cube.daily('bd')
+            supervisor_partitions = self.partition_by(aggregated_df, 'Supervisor')
+            supervisor_daily = cube.partitions('supervisor')
+            tables = []
+            for supervisor_name in self.group_by_supervisor(aggregated_df):
+                supervisor_df = supervisor_partitions.get(supervisor_name, aggregated_df.iloc[0:0])
+                if not (report_filter.wants_supervisor(supervisor_name)
+                        and (report_filter.bds is None or supervisor_df['BD'].isin(report_filter.bds).any())
+                        and report_filter.in_range(supervisor_df)):
+                    continue
+                if supervisor_name in supervisor_daily:
+                    frame, businesses = self.create_team_table_frame(
+                        supervisor_name, supervisor_df, supervisor_daily[supervisor_name],
+                        cube.entity_rollups('supervisor', supervisor_name))
+                else:
+                    frame, businesses = self.create_team_table_frame(supervisor_name, supervisor_df)
+                if frame is not None:
+                    tables.append(frame.assign(Supervisor=supervisor_name, Members=', '.join(businesses)))
+            frames['team'] = (tables, ['Supervisor', 'Members'])
+        
+        if 'comparison' in types:
+            comparison = self.compare_supervisors(cube.daily('supervisor'), period=period, sort_by=sort_by,
+                                                  as_of=as_of)
+            frames['comparison'] = ([self.comparison_frame(comparison)] if comparison is not None else [], [])
+        
+        os.makedirs(output_dir, exist_ok=True)
+        exported = {}
+        for report_type, (tables, id_columns) in frames.items():
+            if not tables:
+                continue
+            # 实体列放在最前面
+            frame = pd.concat(tables, ignore_index=True)
+            frame = frame[id_columns + [col for col in frame.columns if col not in id_columns]]
+            stem = os.path.join(output_dir, 'comparison' if report_type == 'comparison' else f'{report_type}_tables')
+            exported[report_type] = [self._write_export(frame, stem, fmt) for fmt in formats]
+        return exported
+    
+    def _write_export(self, frame, stem, fmt):
+        """按格式写出一张导出表，返回文件路径（CSV/JSON 中的日期写成 YYYY-MM-DD）"""
+        path = f'{stem}.{fmt}'
+        if fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+            return path
+        
+        date_columns = [col for col in frame.columns if pd.api.types.is_datetime64_any_dtype(frame[col])]
+        frame = frame.assign(**{col: frame[col].dt.strftime('%Y-%m-%d') for col in date_columns})
+        if fmt == 'csv':
+            frame.to_csv(path, index=False, encoding='utf-8')
+        else:
+            frame.to_json(path, orient='records', force_ascii=False, indent=1)
+        return path
+    
+    def write_manifest(self, reports, manifest_path='report_manifest.json', merge=False):
+        """写出本次运行的报表清单（按类型分组、路径排序，与渲染顺序和进程数无关）
+        
+        Args:
+            reports: {报表类型: 输出路径列表}
+            manifest_path: 清单文件路径
+            merge: 并入已有清单（选择性生成时只渲染了部分报表）
+        """
+        manifest = {
+            report_type: {path.replace(os.sep, '/') for path in paths}
+            for report_type, paths in reports.items()
+        }
+        if merge and os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                for report_type, paths in json.load(f).items():
+                    manifest.setdefault(report_type, set()).update(paths)
+        manifest = {report_type: sorted(paths) for report_type, paths in manifest.items()}
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        return manifest_path
 
 
-def main():
-    """主函数：生成所有类型的报表"""
+class ComparisonEngine:
+    """总监级每日指标的多周期对比引擎
     
-    print("🚀 开始生成所有报表...")
+    把每日汇总一次性透视为 (实体 × 日期 × 指标) 数组，日期轴是连续的自然日历，
+    没有数据的日期为 NaN。日环比、周环比、月环比和任意N天对比都只是日期轴上的下标偏移，
+    某天缺数据的实体不会被拿去和更早的一行比较，而是得到 NaN（显示为 '-'）。
+    """
     
-    # 创建报表生成器
-    generator = DailyReportGenerator()
+    PERIOD_DAYS = {'dod': 1, 'wow': 7}
+    PERIOD_LABELS = {'dod': 'DoD', 'wow': 'WoW', 'mom': 'MoM'}
+    
+    def __init__(self, daily, metrics, entity_col='Supervisor', date_col='Date'):
+        dates = pd.to_datetime(daily[date_col], errors='coerce')
+        frame = daily[dates.notna()]
+        dates = dates[dates.notna()]
+        
+        self.metrics = list(metrics)
+        self.entities = np.asarray(pd.unique(frame[entity_col]), dtype=object)
+        if len(frame) == 0:
+            self.dates = pd.DatetimeIndex([])
+            self.values = np.empty((0, 0, len(self.metrics)))
+            return
+        
+        self.dates = pd.date_range(dates.min(), dates.max(), freq='D')
+        entity_codes = pd.Index(self.entities).get_indexer(frame[entity_col])
+        date_codes = (dates - self.dates[0]).dt.days.to_numpy()
+        
+        # 缺少的指标列按0处理（与原先逐行取值时一致）
+        block = np.column_stack([
+            frame[metric].to_numpy(dtype=float) if metric in frame.columns else np.zeros(len(frame))
+            for metric in self.metrics
+        ])
+        self.values = np.full((len(self.entities), len(self.dates), len(self.metrics)), np.nan)
+        self.values[entity_codes, date_codes] = np.nan_to_num(block)
+    
+    @classmethod
+    def normalize_period(cls, period):
+        """校验对比周期：'dod'、'wow'、'mom'（不区分大小写）或不小于1的天数（可为数字字符串）
+        
+        Raises:
+            ValueError: 周期不合法（未知名称、0或负数天数）
+        """
+        if isinstance(period, str):
+            text = period.strip().lower()
+            if text in cls.PERIOD_LABELS:
+                return text
+            if not text.isdigit():
+                raise ValueError(f"对比周期必须是 dod、wow、mom 或不小于1的天数: {period!r}")
+            period = int(text)
+        if isinstance(period, (bool, np.bool_)) or not isinstance(period, (int, np.integer)) or period < 1:
+            raise ValueError(f"对比周期必须是 dod、wow、mom 或不小于1的天数: {period!r}")
+        return int(period)
+    
+    def previous_index(self, period):
+        """每个日期对应的对比日期下标（超出日历范围为 -1）
+        
+        period: 'dod'、'wow'、'mom'（上个月同一天，不存在的日期如3/31→2/31 记为 -1）或天数（≥1）
+        """
+        period = self.normalize_period(period)
+        positions = np.arange(len(self.dates))
+        if period == 'mom':
+            targets = self.dates - pd.DateOffset(months=1)
+            # 月末对齐到上月最后一天的日期（如3/31 → 2/28）不是同一天，不参与对比
+            same_day = targets.day == self.dates.day
+            previous = (targets - self.dates[0]).days.to_numpy()
+            previous = np.where(same_day, previous, -1)
+        else:
+            offset = self.PERIOD_DAYS.get(period, period)
+            previous = positions - int(offset)
+        return np.where((previous >= 0) & (previous < len(self.dates)), previous, -1)
+    
+    def change_rate(self, current, previous):
+        """变化率（%）：对比值为0时，当前值为正记 +100%，否则 0%；任一侧缺数据为 NaN"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = (current - previous) / np.abs(previous) * 100
+        rate = np.where(previous == 0, np.where(current > 0, 100.0, 0.0), rate)
+        rate[np.isnan(current) | np.isnan(previous)] = np.nan
+        return rate
+    
+    def change_text(self, rate, previous):
+        """变化率文本：'+12.3%'、'-4.5%'、'0%'；对比值为0且当前值为正时为 '+100%'，缺数据为 '-'"""
+        text = np.full(rate.shape, '-', dtype=object)
+        positive = rate > 0
+        negative = rate < 0
+        text[positive] = list(map('+{:.1f}%'.format, rate[positive].tolist()))
+        text[negative] = list(map('{:.1f}%'.format, rate[negative].tolist()))
+        text[rate == 0] = '0%'
+        text[(previous == 0) & positive] = '+100%'
+        return text
+    
+    def compare(self, period='dod', as_of=None):
+        """某一天（默认最新一天，as_of 之前最近的一天）各实体与对比日期的指标变化
+        
+        Returns:
+            dict: date/previous_date/label，以及 (实体, 指标) 形状的 current、previous、
+            change（变化率%）、change_text，和 present（当天或对比日有数据的实体）
+        """
+        period = self.normalize_period(period)
+        period = {1: 'dod', 7: 'wow'}.get(period, period)
+        if as_of is None:
+            position = len(self.dates) - 1
+        else:
+            # 日历之外的日期取之前最近的一天（早于日历起点时取第一天）
+            position = max(int(self.dates.searchsorted(pd.Timestamp(as_of), side='right')) - 1, 0)
+        previous_position = self.previous_index(period)[position]
+        
+        current = self.values[:, position, :]
+        if previous_position >= 0:
+            previous = self.values[:, previous_position, :]
+        else:
+            previous = np.full_like(current, np.nan)
+        change = self.change_rate(current, previous)
+        
+        has_current = ~np.isnan(current).all(axis=1)
+        has_previous = ~np.isnan(previous).all(axis=1)
+        return {
+            'date': self.dates[position],
+            'previous_date': self.dates[previous_position] if previous_position >= 0 else None,
+            'label': self.PERIOD_LABELS.get(period, f'{period}D'),
+            'current': current,
+            'previous': previous,
+            'change': change,
+            'change_text': self.change_text(change, previous),
+            'present': has_current | has_previous,
+        }
+
+
+class FontCache:
+    """已解析的字体文件路径缓存，跨运行持久化
+    
+    按 FONT_FAMILIES 的回退顺序查找字体需要导入 matplotlib 并加载字体列表；
+    缓存命中时 Pillow 渲染完全不导入 matplotlib。字体文件不存在时重新解析。
+    """
+    
+    def __init__(self, path=os.path.join('.cache', 'fonts.json')):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+    
+    def resolve(self, weight='normal', style='normal'):
+        """字体文件路径（未缓存或已失效时通过 matplotlib 的字体匹配解析并写回缓存）"""
+        key = f"{','.join(FONT_FAMILIES)}|{weight}|{style}"
+        path = self.entries.get(key)
+        if path is None or not os.path.exists(path):
+            from matplotlib import font_manager
+            prop = font_manager.FontProperties(family=FONT_FAMILIES, weight=weight, style=style)
+            path = font_manager.findfont(prop)
+            self.entries[key] = path
+            self.save()
+        return path
+    
+    def save(self):
+        """写出缓存（临时文件带进程号，多个渲染进程同时写入时互不覆盖半个文件）"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=0, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # 缓存只是加速，写不进去时下次重新解析
+            pass
+
+
+class PillowTableRenderer:
+    """用 Pillow 直接把报表表格画进图片缓冲区，替代 matplotlib 的 ax.table
+    
+    版式与 matplotlib 渲染一致：左上角标题（可选副标题）、深色表头、斑马纹每日行、
+    黄色月总和行、蓝色周统计行和深色TOTAL行，样式取自 TABLE_STYLES。
+    不经过逐单元格的 Artist 对象和两次布局计算。分辨率默认与 matplotlib 相同（REPORT_DPI，
+    宽 4800 像素）。图片只有几种底色和文字色，直接画成调色板图片：RGB 的 PNG 编码要逐行
+    试探过滤方式，是主要开销，调色板 PNG 的编码快得多，文件也更小。
+    """
+    
+    WIDTH = 24          # 图片宽度（英寸），与 matplotlib 图表一致
+    MARGIN = 0.25       # 四周留白（英寸）
+    ROW_SCALE = 6.25    # TABLE_STYLES 相对行高 → 英寸（数据行 0.06 → 0.375 英寸）
+    TEXT_LEVELS = 16    # 文字抗锯齿的灰度级数（每种 底色/文字色 组合在调色板中占一段）
+    MIN_HEADER_SIZE = 6 # 表头列名缩小字号的下限（磅）
+    
+    def __init__(self, generator, dpi=REPORT_DPI, font_cache=None):
+        self.generator = generator
+        self.dpi = dpi
+        self.font_cache = font_cache or FontCache()
+        self._fonts = {}
+    
+    def _px(self, inches):
+        return int(round(inches * self.dpi))
+    
+    def _font(self, size, weight='normal', style='normal'):
+        """按 FONT_FAMILIES 解析字体文件（路径跨运行缓存），字体对象同一进程内缓存"""
+        key = (size, weight, style)
+        if key not in self._fonts:
+            path = self.font_cache.resolve(weight, style)
+            self._fonts[key] = ImageFont.truetype(path, int(round(size * self.dpi / 72)))
+        return self._fonts[key]
+    
+    def _fit_header(self, text, size, weight, max_width, max_height):
+        """表头列名放不下时先在空格处折成两行，仍放不下再逐步缩小字号，不截断文字
+        
+        Returns:
+            (文字（可能含换行）, 字体)
+        """
+        words = text.split(' ')
+        # 各种两行折法，按较长一行的宽度从窄到宽尝试
+        splits = [(' '.join(words[:i]), ' '.join(words[i:])) for i in range(1, len(words))]
+        while True:
+            font = self._font(size, weight)
+            if font.getlength(text) <= max_width:
+                return text, font
+            line_height = font.getbbox('Ag')[3]
+            if splits and 2.4 * line_height <= max_height:
+                first, second = min(splits, key=lambda lines: max(map(font.getlength, lines)))
+                if max(font.getlength(first), font.getlength(second)) <= max_width:
+                    return f'{first}\n{second}', font
+            if size <= self.MIN_HEADER_SIZE:
+                return text, font
+            size -= 0.5
+    
+    def _color_index(self, palette, color):
+        """颜色在调色板中的序号（新颜色追加到末尾）"""
+        rgb = ImageColor.getrgb(color)[:3]
+        if rgb not in palette:
+            palette[rgb] = len(palette)
+        return palette[rgb]
+    
+    def _text_lut(self, palette, background, color):
+        """文字灰度（0-255）→ 调色板序号的查找表：底色到文字色之间取 TEXT_LEVELS 级混合色"""
+        background_index = self._color_index(palette, background)
+        bg = ImageColor.getrgb(background)[:3]
+        fg = ImageColor.getrgb(color)[:3]
+        levels = [background_index]
+        for level in range(1, self.TEXT_LEVELS):
+            alpha = level / (self.TEXT_LEVELS - 1)
+            mixed = '#%02x%02x%02x' % tuple(int(round(b + (f - b) * alpha)) for b, f in zip(bg, fg))
+            levels.append(self._color_index(palette, mixed))
+        return [levels[int(round(value * (self.TEXT_LEVELS - 1) / 255))] for value in range(256)]
+    
+    def _paste_text(self, image, palette, box, background, color, items):
+        """在 box 区域内画一组文字：先画灰度遮罩，再按查找表换成调色板序号整块贴上
+        
+        items 为 [(相对 box 的坐标, 文字, 字体)]，文字以坐标为中心对齐。
+        """
+        left, top, right, bottom = box
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        draw = ImageDraw.Draw(mask)
+        for (x, y), text, font in items:
+            draw.multiline_text((x, y), text, fill=255, font=font, anchor='mm', align='center')
+        image.paste(mask.point(self._text_lut(palette, background, color)), (left, top))
+    
+    def render(self, table_data, available_columns, title, output_path, subtitle=None):
+        """渲染表格并保存为PNG"""
+        self.save(self.draw(table_data, available_columns, title, subtitle), output_path)
+        return output_path
+    
+    def save(self, image, output_path):
+        """编码并写出PNG（低压缩级别，编码耗时远小于默认级别）"""
+        image.save(output_path, format='PNG', compress_level=1)
+    
+    def draw(self, table_data, available_columns, title, subtitle=None):
+        """绘制表格图片，返回调色板模式的 PIL.Image"""
+        margin = self._px(self.MARGIN)
+        width = self._px(self.WIDTH)
+        
+        title_font = self._font(22, 'bold')
+        subtitle_font = self._font(10, style='italic')
+        title_height = title_font.getbbox('Ag')[3]
+        subtitle_height = subtitle_font.getbbox('Ag')[3] if subtitle else 0
+        
+        # 每行的样式和像素高度（表头在前）
+        rows = [('header', TABLE_STYLES['header']['facecolor'], available_columns)]
+        rows += [(style, facecolor, row) for (style, facecolor), row
+                 in zip(self.generator.table_row_styles(table_data), table_data)]
+        heights = [self._px(TABLE_STYLES[style]['height'] * self.ROW_SCALE) for style, _, _ in rows]
+        
+        table_top = margin + title_height + (self._px(0.1) + subtitle_height if subtitle else 0) + self._px(0.25)
+        height = table_top + sum(heights) + margin
+        
+        # 先在灰度图里画调色板序号，最后装上调色板（{RGB: 序号}，白色为0号即底色）
+        palette = {}
+        image = Image.new('L', (width, height), self._color_index(palette, 'white'))
+        draw = ImageDraw.Draw(image)
+        
+        # 标题和副标题（按左上角定位，换算成文字中心）
+        heading = [((title_font.getlength(title) / 2, title_height / 2), title, title_font)]
+        self._paste_text(image, palette, (margin, margin, width - margin, margin + title_height),
+                         'white', '#2c3e50', heading)
+        if subtitle:
+            subtitle_top = margin + title_height + self._px(0.1)
+            line = [((subtitle_font.getlength(subtitle) / 2, subtitle_height / 2), subtitle, subtitle_font)]
+            self._paste_text(image, palette, (margin, subtitle_top, width - margin, subtitle_top + subtitle_height),
+                             'white', '#7f8c8d', line)
+        
+        # 等宽列（文字左右各留少量内边距）
+        line_padding = self._px(0.03)
+        n_cols = len(available_columns)
+        edges = [margin + (width - 2 * margin) * j // n_cols for j in range(n_cols + 1)]
+        centers = [(left + right) // 2 - edges[0] for left, right in zip(edges[:-1], edges[1:])]
+        cell_width = edges[1] - edges[0] - 2 * line_padding
+        
+        top = table_top
+        for (style, facecolor, cells), row_height in zip(rows, heights):
+            spec = TABLE_STYLES[style]
+            bottom = top + row_height
+            line_width = max(1, int(round(spec['linewidth'] * self.dpi / 72)))
+            middle = row_height // 2
+            
+            # 整行底色和文字一次贴上，再画单元格边框
+            if style == 'header':
+                items = [((x, middle),) + self._fit_header(str(text), spec['fontsize'], spec['weight'],
+                                                           cell_width, row_height - 2 * line_padding)
+                         for x, text in zip(centers, cells)]
+            else:
+                font = self._font(spec['fontsize'], spec['weight'])
+                items = [((x, middle), str(text), font) for x, text in zip(centers, cells)]
+            self._paste_text(image, palette, (edges[0], top, edges[-1], bottom), facecolor, spec['color'], items)
+            
+            edge = self._color_index(palette, spec['edgecolor'])
+            draw.line([(edges[0], top), (edges[-1], top)], fill=edge, width=line_width)
+            draw.line([(edges[0], bottom), (edges[-1], bottom)], fill=edge, width=line_width)
+            for x in edges:
+                draw.line([(x, top), (x, bottom)], fill=edge, width=line_width)
+            top = bottom
+        
+        image.putpalette([channel for rgb in palette for channel in rgb])
+        return image
+
+
+class RollupCube:
+    """多层级汇总立方：总代理 → BD → 总监 → 全局 的每日指标，以及按需计算并缓存的周/月/总计汇总
+    
+    由明细数据构建时只做一次细粒度 groupby，上层级都在其结果上汇总（全局层级在第一次使用时才汇总）；
+    也可以直接由已有的BD级（和总代理级）每日聚合结果构建（流式/增量模式）。
+    同一次运行内的所有报表共享一个实例。
+    """
+    
+    # 各层级的实体键（单列键用字符串，与 partition_by 的键形式一致）
+    LEVEL_KEYS = {
+        'kol': ['Supervisor', 'BD', '总代理'],
+        'bd': 'Dimension',
+        'supervisor': 'Supervisor',
+        'global': 'Scope',
+    }
     
-    # 读取数据
+    def __init__(self, generator, processed_df=None, bd_daily=None, kol_daily=None):
+        self.generator = generator
+        self._daily = {}
+        self._rollups = {}
+        self._partitions = {}
+        
+        if processed_df is not None:
+            self._build_from_processed(processed_df)
+        else:
+            self._daily['bd'] = bd_daily
+            self._daily['kol'] = kol_daily if kol_daily is not None else pd.DataFrame()
+        
+        bd = self._daily['bd']
+        # 没有总监的BD在总监层级保持空名字，显示时才标为 Other，不会和名为 Other 的总监合并
+        supervisors = bd['Supervisor'].astype(object).fillna('')
+        self._daily['supervisor'] = generator.daily_rollup(bd.assign(Supervisor=supervisors), ['Supervisor'])
+    
+    def _build_from_processed(self, processed_df):
+        """一次细粒度聚合 (总代理, 维度, 日期)，再汇总出BD级"""
+        g = self.generator
+        fine_keys = ['总代理'] + g.hierarchy_columns + ['统计日期']
+        fine = processed_df.groupby(fine_keys, observed=True)[g.sum_columns].sum().reset_index()
+        
+        # BD级：细粒度结果再求和；Activate KOL 即每组的总代理个数（与 nunique 一致）
+        bd_keys = g.hierarchy_columns + ['统计日期']
+        bd = fine.groupby(bd_keys, observed=True)[g.sum_columns].sum().reset_index()
+        kol_counts = fine.groupby(['dimension', '统计日期'], observed=True).size().reset_index()
+        kol_counts.columns = ['dimension', '统计日期', 'Activate KOL']
+        self._daily['bd'] = g._finalize_aggregate(bd, kol_counts)
+        
+        # 总代理级：去掉总代理为空的记录
+        kol = fine[fine['总代理'] != ''].reset_index(drop=True)
+        self._daily['kol'] = g._finalize_aggregate(kol) if len(kol) > 0 else pd.DataFrame()
+    
+    def daily(self, level):
+        """某层级的每日指标"""
+        if level == 'global' and level not in self._daily:
+            self._daily['global'] = self.generator.daily_rollup(self._daily['bd'], []).assign(Scope='ALL')
+        return self._daily[level]
+    
+    def rollup(self, level, period):
+        """某层级的周期汇总（'week'、'month' 或 'total'），同一次运行内缓存"""
+        cache_key = (level, period)
+        if cache_key not in self._rollups:
+            keys = self.LEVEL_KEYS[level]
+            keys = [keys] if isinstance(keys, str) else keys
+            daily = self.daily(level)
+            if len(daily) == 0:
+                self._rollups[cache_key] = pd.DataFrame()
+            else:
+                self._rollups[cache_key] = self.generator.period_rollup(daily, keys, period)
+        return self._rollups[cache_key]
+    
+    def partitions(self, level, period='daily'):
+        """某层级每日数据（或周期汇总）按实体分区，同一次运行内缓存"""
+        cache_key = (level, period)
+        if cache_key not in self._partitions:
+            frame = self.daily(level) if period == 'daily' else self.rollup(level, period)
+            self._partitions[cache_key] = self.generator.partition_by(frame, self.LEVEL_KEYS[level])
+        return self._partitions[cache_key]
+    
+    def entity_rollups(self, level, key, periods=('week', 'month', 'total')):
+        """某个实体的周期汇总 {周期: 汇总行}"""
+        return {period: self.partitions(level, period)[key] for period in periods}
+
+
+class RenderCache:
+    """内容寻址的渲染缓存：记录每张输出图片上次渲染时的内容哈希
+    
+    哈希一致且文件仍存在时跳过渲染和写入，未变化的图片保持原样，
+    发布目录的 git diff 只包含内容真正变化的图片。
+    """
+    
+    def __init__(self, path='.cache/render_manifest.json'):
+        self.path = path
+        self.entries = {}
+        self.pending = []
+        self.skipped = 0
+        self.rendered = 0
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == RENDER_STYLE_VERSION:
+                    self.entries = manifest.get('entries', {})
+            except (OSError, ValueError):
+                self.entries = {}
+    
+    def _normalize(self, output_path):
+        return os.path.normpath(output_path).replace(os.sep, '/')
+    
+    def is_current(self, output_path, key):
+        """上次渲染的内容哈希与 key 一致且文件仍在"""
+        return self.entries.get(self._normalize(output_path)) == key and os.path.exists(output_path)
+    
+    def record(self, output_path, key, rendered=True):
+        """记录一张图片（重新渲染或命中缓存）"""
+        self.pending.append((self._normalize(output_path), key, rendered))
+    
+    def drain(self):
+        """取出尚未合并的记录（渲染子进程把记录交回主进程）"""
+        pending, self.pending = self.pending, []
+        return pending
+    
+    def merge(self, updates):
+        """合并记录并统计命中/渲染数"""
+        for output_path, key, rendered in updates:
+            self.entries[output_path] = key
+            if rendered:
+                self.rendered += 1
+            else:
+                self.skipped += 1
+    
+    def save(self):
+        """写出清单（先写临时文件再替换，避免中断时留下半个文件）"""
+        self.merge(self.drain())
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': RENDER_STYLE_VERSION, 'entries': self.entries},
+                      f, ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class ReportFilter:
+    """选择性生成：按总监、BD和日期范围选择需要渲染的报表
+    
+    日期范围只决定哪些实体需要渲染（范围内有数据的实体），报表内容仍是完整历史。
+    """
+    
+    def __init__(self, supervisors=None, bds=None, since=None, until=None):
+        # 'Other' 对应没有总监的数据（总监列为空）
+        self.supervisors = sorted({'' if name == 'Other' else name for name in supervisors}) if supervisors else None
+        self.bds = set(bds) if bds else None
+        self.since = pd.Timestamp(since) if since else None
+        self.until = pd.Timestamp(until) if until else None
+    
+    @property
+    def is_selective(self):
+        return any(value is not None for value in (self.supervisors, self.bds, self.since, self.until))
+    
+    def describe(self):
+        """筛选条件的简短说明"""
+        parts = []
+        if self.supervisors is not None:
+            parts.append('总监=' + ','.join(name or 'Other' for name in self.supervisors))
+        if self.bds is not None:
+            parts.append('BD=' + ','.join(sorted(self.bds)))
+        if self.since is not None or self.until is not None:
+            since = self.since.strftime('%Y-%m-%d') if self.since is not None else ''
+            until = self.until.strftime('%Y-%m-%d') if self.until is not None else ''
+            parts.append(f'日期={since}~{until}')
+        return f"（{'; '.join(parts)}）" if parts else ''
+    
+    def filter_supervisors(self, df, column='Supervisor'):
+        """只保留所选总监的行"""
+        if self.supervisors is None or df is None or column not in df.columns:
+            return df
+        return df[df[column].isin(self.supervisors)].reset_index(drop=True)
+    
+    def wants_supervisor(self, supervisor):
+        return self.supervisors is None or ('' if supervisor == 'Other' else supervisor) in self.supervisors
+    
+    def wants_bd(self, *names):
+        """BD名或维度名任一在所选BD中"""
+        return self.bds is None or any(name in self.bds for name in names)
+    
+    def in_range(self, data, column='Date'):
+        """该实体在日期范围内是否有数据"""
+        if self.since is None and self.until is None:
+            return True
+        dates = pd.to_datetime(data[column], errors='coerce')
+        mask = dates.notna()
+        if self.since is not None:
+            mask &= dates >= self.since
+        if self.until is not None:
+            mask &= dates <= self.until
+        return bool(mask.any())
+
+
+class RunMetrics:
+    """运行指标：各阶段的耗时、CPU时间、内存峰值、行数和报表数，以及每张报表的耗时
+    
+    同名阶段多次进入时累加（如每张报表的 table_build/render/savefig），阶段可以嵌套。
+    渲染子进程内各任务的阶段指标随任务结果交回主进程合并。
+    """
+    
+    # 单张报表耗时直方图的分桶上界（秒）
+    HISTOGRAM_BOUNDS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+    
+    # 每种报表保留的最慢报表数
+    SLOWEST = 10
+    
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.reports = []
+        self._stack = []
+        self._started_at = datetime.now()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def _max_rss_mb(self, who=None):
+        """进程（或已结束的子进程中最大的）常驻内存峰值，单位MB"""
+        if not HAS_RESOURCE:
+            return None
+        usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+        # Linux 上 ru_maxrss 单位为KB，macOS 上为字节
+        return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    
+    def _update_traced_peak(self):
+        """把当前的 tracemalloc 峰值计入所有进行中的阶段"""
+        peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        for entry in self._stack:
+            entry['peak'] = max(entry['peak'], peak)
+    
+    @contextmanager
+    def stage(self, name):
+        """计时一个阶段；调用方可在返回的字典里填写 rows（处理的行数）和 reports（生成的报表数）"""
+        info = {'rows': 0, 'reports': 0}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # 重置峰值前先计入外层阶段，嵌套阶段不会丢失外层的峰值
+            self._update_traced_peak()
+            tracemalloc.reset_peak()
+        entry = {'peak': 0.0}
+        self._stack.append(entry)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield info
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            if tracing:
+                self._update_traced_peak()
+            self._stack.pop()
+            self.add(name, wall, cpu, rows=info['rows'], reports=info['reports'],
+                     traced_peak_mb=entry['peak'] if tracing else None, max_rss_mb=self._max_rss_mb())
+    
+    def add(self, name, wall, cpu, calls=1, rows=0, reports=0, traced_peak_mb=None, max_rss_mb=None):
+        """累加一个阶段的指标"""
+        stage = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0, 'reports': 0,
+                                              'traced_peak_mb': None, 'max_rss_mb': None})
+        stage['calls'] += calls
+        stage['wall_s'] += wall
+        stage['cpu_s'] += cpu
+        stage['rows'] += rows
+        stage['reports'] += reports
+        for key, value in (('traced_peak_mb', traced_peak_mb), ('max_rss_mb', max_rss_mb)):
+            if value is not None:
+                stage[key] = value if stage[key] is None else max(stage[key], value)
+    
+    def merge(self, stages):
+        """合并另一组阶段指标（渲染任务交回的指标）"""
+        for name, stage in stages.items():
+            self.add(name, stage['wall_s'], stage['cpu_s'], calls=stage['calls'], rows=stage['rows'],
+                     reports=stage['reports'], traced_peak_mb=stage['traced_peak_mb'],
+                     max_rss_mb=stage['max_rss_mb'])
+    
+    def record_report(self, report_type, label, seconds, stages=None, error=None):
+        """记录一张报表的耗时（及其内部各阶段的耗时）"""
+        self.reports.append({
+            'type': report_type,
+            'label': label,
+            'seconds': seconds,
+            'stages': {name: stage['wall_s'] for name, stage in (stages or {}).items()},
+            'error': error,
+        })
+    
+    def histogram(self, seconds):
+        """按 HISTOGRAM_BOUNDS 分桶计数"""
+        labels = [f'<={bound}s' for bound in self.HISTOGRAM_BOUNDS] + [f'>{self.HISTOGRAM_BOUNDS[-1]}s']
+        counts = np.bincount(np.searchsorted(self.HISTOGRAM_BOUNDS, seconds, side='left'),
+                             minlength=len(labels))
+        return dict(zip(labels, counts.tolist()))
+    
+    def report_summary(self):
+        """按报表类型汇总：生成数量、出错数量、总耗时、分位数、直方图和最慢的报表"""
+        summary = {}
+        for report_type in dict.fromkeys(report['type'] for report in self.reports):
+            reports = [report for report in self.reports if report['type'] == report_type]
+            seconds = np.array([report['seconds'] for report in reports])
+            slowest = sorted(reports, key=lambda report: report['seconds'], reverse=True)[:self.SLOWEST]
+            summary[report_type] = {
+                'count': sum(1 for report in reports if not report['error']),
+                'errors': sum(1 for report in reports if report['error']),
+                'total_s': float(seconds.sum()),
+                'mean_s': float(seconds.mean()),
+                'p50_s': float(np.percentile(seconds, 50)),
+                'p95_s': float(np.percentile(seconds, 95)),
+                'max_s': float(seconds.max()),
+                'histogram': self.histogram(seconds),
+                'slowest': [{key: report[key] for key in ('label', 'seconds', 'stages')} for report in slowest],
+            }
+        return summary
+    
+    def to_dict(self):
+        return {
+            'started_at': self._started_at.isoformat(timespec='seconds'),
+            'wall_s': time.perf_counter() - self._wall_start,
+            'cpu_s': time.process_time() - self._cpu_start,
+            'max_rss_mb': self._max_rss_mb(),
+            'children_max_rss_mb': self._max_rss_mb(resource.RUSAGE_CHILDREN) if HAS_RESOURCE else None,
+            'trace_memory': self.trace_memory,
+            'stages': self.stages,
+            'reports': self.report_summary(),
+        }
+    
+    def save(self, path='run_metrics.json'):
+        """写出 JSON 运行报告"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        return path
+    
+    def print_summary(self):
+        """打印各阶段耗时（按耗时降序）"""
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]['wall_s'], reverse=True):
+            memory = f", 内存峰值 {stage['traced_peak_mb']:.1f}MB" if stage['traced_peak_mb'] is not None else ''
+            print(f"  {name}: {stage['wall_s']:.2f}s（CPU {stage['cpu_s']:.2f}s, {stage['calls']} 次{memory}）")
+
+
+class AggregateStore:
+    """按统计日期分区的聚合结果本地存储（SQLite）
+    
+    bd_daily 保存 aggregate_data 的结果，kol_daily 保存 aggregate_data_by_kol
+    的结果，partitions 记录每个日期分区对应的明细数据指纹。
+    """
+    
+    TABLES = ('bd_daily', 'kol_daily')
+    
+    def __init__(self, path='.cache/aggregates.sqlite'):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self._ensure_schema()
+    
+    def _ensure_schema(self):
+        """创建元数据表，版本不一致时清空存储"""
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(AGGREGATE_STORE_VERSION):
+            for table in self.TABLES + ('partitions',):
+                self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(AGGREGATE_STORE_VERSION),))
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS partitions (date TEXT PRIMARY KEY, fingerprint TEXT)'
+        )
+        self.conn.commit()
+    
+    def _table_exists(self, table):
+        row = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        return row is not None
+    
+    def partition_fingerprints(self):
+        """返回 {统计日期: 指纹}"""
+        return dict(self.conn.execute('SELECT date, fingerprint FROM partitions').fetchall())
+    
+    def replace_partitions(self, dates, bd_df, kol_df, fingerprints):
+        """在一个事务中替换指定日期的分区"""
+        placeholders = ','.join('?' * len(dates))
+        with self.conn:
+            for table, df in zip(self.TABLES, (bd_df, kol_df)):
+                if self._table_exists(table):
+                    self.conn.execute(f'DELETE FROM {table} WHERE Date IN ({placeholders})', list(dates))
+                if len(df) > 0:
+                    df.to_sql(table, self.conn, if_exists='append', index=False)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO partitions VALUES (?, ?)',
+                [(date, fingerprints[date]) for date in dates],
+            )
+    
+    def delete_partitions(self, dates):
+        """在一个事务中删除指定日期的分区（数据中已不存在的日期）"""
+        placeholders = ','.join('?' * len(dates))
+        with self.conn:
+            for table in self.TABLES:
+                if self._table_exists(table):
+                    self.conn.execute(f'DELETE FROM {table} WHERE Date IN ({placeholders})', list(dates))
+            self.conn.execute(f'DELETE FROM partitions WHERE date IN ({placeholders})', list(dates))
+    
+    def load(self, table='bd_daily', supervisors=None, columns=None):
+        """读取聚合表（可只读取部分总监），排序与 groupby 的输出一致
+        
+        表还不存在（如所有记录都被过滤）时返回以 columns 为列的空表。
+        """
+        if not self._table_exists(table):
+            return pd.DataFrame(columns=columns)
+        if supervisors is None:
+            df = pd.read_sql(f'SELECT * FROM {table}', self.conn)
+        else:
+            placeholders = ','.join('?' * len(supervisors))
+            df = pd.read_sql(f'SELECT * FROM {table} WHERE Supervisor IN ({placeholders})',
+                             self.conn, params=list(supervisors))
+        sort_cols = ['总代理', 'Dimension', 'Date'] if '总代理' in df.columns else ['Dimension', 'Date']
+        return df.sort_values(sort_cols, kind='stable').reset_index(drop=True)
+    
+    def close(self):
+        self.conn.close()
+
+
+class ReportServer:
+    """常驻的报表服务：处理后的数据和汇总立方常驻内存，按需渲染报表图片
+    
+    路由：/bd/<总监>/<BD>.png、/team/<总监>.png、/comparison.png（可带 ?period=wow&sort=...），
+    /reports 列出所有可用的报表，/stats 返回缓存命中情况，查询参数不合法时返回 400。渲染结果的PNG字节放在LRU缓存中；
+    每次请求检查CSV的大小和修改时间，变化时重新读取数据并清空缓存。
+    渲染在一把锁内串行执行（pyplot 不是线程安全的），缓存命中时不需要渲染。
+    未缓存图片的渲染耗时：pillow 约 0.1 秒，matplotlib 超过 1 秒（serve 默认使用 pillow）。
+    """
+    
+    def __init__(self, csv_file='raw_data.csv', renderer='matplotlib', cache_size=256):
+        self.csv_file = csv_file
+        self.cache_size = cache_size
+        self.generator = DailyReportGenerator(renderer=renderer)
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.cube = None
+        self.loaded_at = None
+        self._signature = None
+        self._bd_index = {}
+        self._team_index = {}
+    
+    def refresh(self):
+        """CSV有变化（或尚未读取）时重新读取数据、构建汇总立方并清空图片缓存"""
+        signature = self.generator.input_signature(self.csv_file)
+        if signature == self._signature:
+            return False
+        
+        start = time.perf_counter()
+        processed_df = self.generator.load_processed_data(self.csv_file)
+        cube = RollupCube(self.generator, processed_df=processed_df)
+        
+        # URL 中的 (总监, BD) → 维度；无总监的BD使用 Other
+        bd_index = {}
+        for dimension, bd_data in cube.partitions('bd').items():
+            supervisor = bd_data['Supervisor'].iat[0] or 'Other'
+            bd_index[(supervisor, bd_data['BD'].iat[0])] = dimension
+        aggregated_df = cube.daily('bd')
+        supervisor_partitions = self.generator.partition_by(aggregated_df, 'Supervisor')
+        # 只收录有数据的团队（无总监的 Other 分组没有团队表格，不列出也不渲染）
+        team_index = {name: supervisor_partitions[name]
+                      for name in self.generator.group_by_supervisor(aggregated_df) if name in supervisor_partitions}
+        
+        self.cube, self._bd_index, self._team_index = cube, bd_index, team_index
+        self.images.clear()
+        self._signature = signature
+        self.loaded_at = datetime.now()
+        print(f"📊 已加载 {self.csv_file}: {len(processed_df)} 行，{len(bd_index)} 个BD，"
+              f"耗时 {time.perf_counter() - start:.1f}s")
+        return True
+    
+    def warm_up(self):
+        """读取数据并预先导入渲染依赖，第一次请求不再承担这部分开销"""
+        self.refresh()
+        if self.generator.renderer == 'matplotlib':
+            _pyplot()
+    
+    def report_list(self):
+        """所有可用报表的URL"""
+        return {
+            'bd': sorted(f'/bd/{supervisor}/{bd}.png' for supervisor, bd in self._bd_index),
+            'team': sorted(f'/team/{supervisor}.png' for supervisor in self._team_index),
+            'comparison': ['/comparison.png'],
+        }
+    
+    def stats(self):
+        return {
+            'csv': self.csv_file,
+            'loaded_at': self.loaded_at.isoformat(timespec='seconds') if self.loaded_at else None,
+            'renderer': self.generator.renderer,
+            'cached_images': len(self.images),
+            'cache_size': self.cache_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+    
+    def get(self, url):
+        """按URL返回 (状态码, Content-Type, 内容字节)"""
+        parts = urlsplit(url)
+        path = unquote(parts.path).rstrip('/')
+        with self.lock:
+            self.refresh()
+            if path in ('', '/reports'):
+                return 200, 'application/json', self._json(self.report_list())
+            if path == '/stats':
+                return 200, 'application/json', self._json(self.stats())
+            
+            # 查询参数不合法时返回 400；缓存按校验后的参数区分（?period=WoW 与 ?period=wow 是同一张图）
+            try:
+                options = self._render_options(path, parse_qs(parts.query))
+            except ValueError as e:
+                return 400, 'application/json', self._json({'error': str(e)})
+            key = (path, tuple(sorted(options.items())))
+            if key in self.images:
+                self.hits += 1
+                self.images.move_to_end(key)
+                return 200, 'image/png', self.images[key]
+            
+            image = self._render(path, options)
+            if image is None:
+                return 404, 'application/json', self._json({'error': f'没有找到报表: {path}'})
+            self.misses += 1
+            self.images[key] = image
+            if len(self.images) > self.cache_size:
+                self.images.popitem(last=False)
+            return 200, 'image/png', image
+    
+    def _json(self, payload):
+        return json.dumps(payload, ensure_ascii=False, indent=1).encode('utf-8')
+    
+    def _render_options(self, path, query):
+        """校验并解析查询参数（目前只有对比报表有参数）；不合法时抛出 ValueError"""
+        if path != '/comparison.png':
+            return {}
+        period = ComparisonEngine.normalize_period(query.get('period', ['dod'])[0])
+        sort_by = query.get('sort', ['Total Vol ($)'])[0]
+        if sort_by not in self.generator.comparison_metrics:
+            raise ValueError(f"不支持的排序指标: {sort_by!r}（可选 {', '.join(self.generator.comparison_metrics)}）")
+        return {'period': period, 'sort_by': sort_by}
+    
+    def _render(self, path, options):
+        """渲染一张报表图片，返回PNG字节（没有该报表时返回 None）"""
+        generator = self.generator
+        segments = path.strip('/').split('/')
+        if not segments[-1].endswith('.png'):
+            return None
+        segments[-1] = segments[-1][:-len('.png')]
+        buffer = io.BytesIO()
+        
+        if segments[0] == 'bd' and len(segments) == 3:
+            dimension = self._bd_index.get((segments[1], segments[2]))
+            if dimension is None:
+                return None
+            table_data, available_columns, business_name, _ = generator.create_table_data(
+                self.cube.partitions('bd')[dimension], rollups=self.cube.entity_rollups('bd', dimension))
+            if table_data is None:
+                return None
+            generator.render_table_report(table_data, available_columns, business_name, buffer)
+        elif segments[0] == 'team' and len(segments) == 2:
+            name = segments[1]
+            if name not in self._team_index:
+                return None
+            supervisor_daily = self.cube.partitions('supervisor')
+            if name in supervisor_daily:
+                team = generator.team_table(name, self._team_index[name], supervisor_daily[name],
+                                            self.cube.entity_rollups('supervisor', name))
+            else:
+                team = generator.team_table(name, self._team_index[name])
+            if team is None:
+                return None
+            table_data, available_columns, title, subtitle = team
+            generator.render_table_report(table_data, available_columns, title, buffer, subtitle)
+        elif segments == ['comparison']:
+            if generator.create_supervisors_daily_report(self.cube.daily('supervisor'), output_path=buffer,
+                                                         **options) is None:
+                return None
+        else:
+            return None
+        return buffer.getvalue()
+
+
+class _ReportRequestHandler(BaseHTTPRequestHandler):
+    """把 GET 请求交给 server.report_server"""
+    
+    def do_GET(self):
+        try:
+            status, content_type, body = self.server.report_server.get(self.path)
+        except Exception as e:
+            status, content_type = 500, 'application/json'
+            body = json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReportWatcher:
+    """监视原始数据，只重新生成明细行有变化的报表
+    
+    每次数据文件变化时，把处理后的明细数据按 (统计日期, 商务总监, 商务BD, 总代理) 计算行哈希，
+    与上一次保存的快照对比。新增、修改或删除的行所属的总监和BD重新生成BD报表、总代理报表和团队报表；
+    最新日期变化（或最新日期的数据有变化）时同时重新生成总监对比报表。
+    生成沿用 generate 子命令（按 --supervisor/--bd 筛选），内容未变化的图片仍由渲染缓存跳过。
+    """
+    
+    def __init__(self, args):
+        self.args = args
+        self.snapshot_path = args.snapshot
+        self.scope = ReportFilter(args.supervisor, args.bd, args.since, args.until)
+        self.generator = DailyReportGenerator()
+        self._signature = None
+    
+    def source(self):
+        """当前的输入：指定 --drop-dir 时为该目录（其中所有数据文件按自然键去重合并，与 --csv <目录> 相同），
+        否则为 --csv（可以是目录或通配符）；目录中还没有数据文件时返回 None
+        """
+        if not self.args.drop_dir:
+            return self.args.csv
+        try:
+            self.generator.input_files(self.args.drop_dir)
+        except FileNotFoundError:
+            return None
+        return self.args.drop_dir
+    
+    def _signature_of(self, path):
+        return self.generator.input_signature(path)
+    
+    def _settled_signature(self, path, settle=1.0):
+        """文件在 settle 秒内没有继续变化时返回其签名（仍在写入时返回 None，下次再检查）"""
+        signature = self._signature_of(path)
+        time.sleep(settle)
+        return signature if self._signature_of(path) == signature else None
+    
+    def load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            return pd.read_pickle(self.snapshot_path)
+        except Exception as e:
+            print(f"⚠ 快照损坏，重新生成全部报表: {e}")
+            return None
+    
+    def save_snapshot(self, snapshot):
+        """写出快照（先写临时文件再替换，中断时不留下半个文件）"""
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        snapshot.to_pickle(tmp_path)
+        os.replace(tmp_path, self.snapshot_path)
+    
+    def changed_rows(self, previous, current):
+        """两次快照中不一致的键（新增、修改的键取新快照的行，删除的键取旧快照的行）"""
+        changed = pd.concat([previous, current], ignore_index=True).drop_duplicates(keep=False)
+        # 只关心监视范围内的总监和BD
+        if self.scope.supervisors is not None:
+            changed = changed[changed['supervisor'].isin(self.scope.supervisors)]
+        if self.scope.bds is not None:
+            changed = changed[changed['bd'].isin(self.scope.bds) | changed['dimension'].isin(self.scope.bds)]
+        return changed
+    
+    def generate(self, source, supervisors=None, bds=None, types=None):
+        """按 generate 子命令生成报表（supervisors/bds/types 为 None 时沿用命令行参数）"""
+        args = argparse.Namespace(**vars(self.args))
+        args.csv = source
+        if supervisors is not None:
+            args.supervisor = sorted(name or 'Other' for name in supervisors)
+        if bds is not None:
+            args.bd = sorted(bds)
+        if types is not None:
+            args.types = types
+        return run_generate(args)
+    
+    def check(self):
+        """检查一次数据文件，有变化时重新生成受影响的报表；返回是否生成了报表"""
+        source = self.source()
+        try:
+            if source is None or self._signature_of(source) == self._signature:
+                return False
+            signature = self._settled_signature(source)
+        except FileNotFoundError:
+            print(f"⚠ 未找到数据文件: {source}")
+            return False
+        if signature is None:
+            return False
+        
+        print(f"\n🔎 检测到数据文件变化: {source}")
+        try:
+            processed_df = self.generator.load_processed_data(source)
+        except Exception as e:
+            print(f"❌ 读取数据时出错: {e}")
+            return False
+        current = self.generator.row_fingerprints(processed_df)
+        previous = self.load_snapshot()
+        
+        if previous is None:
+            print("📸 没有上一次的数据快照，生成全部报表")
+            status = self.generate(source)
+        else:
+            changed = self.changed_rows(previous, current)
+            if len(changed) == 0:
+                print("✅ 明细数据没有变化，无需重新生成")
+                self._signature = signature
+                self.save_snapshot(current)
+                return False
+            
+            # 最新日期变化或最新日期的数据有变化时，总监对比报表也需要重新生成
+            dates = pd.to_datetime(changed['统计日期'], errors='coerce')
+            previous_latest = pd.to_datetime(previous['统计日期'], errors='coerce').max()
+            latest = pd.to_datetime(current['统计日期'], errors='coerce').max()
+            types = [t for t in self.args.types if t != 'comparison']
+            if 'comparison' in self.args.types and (latest != previous_latest or (dates == latest).any()):
+                types.append('comparison')
+            
+            supervisors = set(changed['supervisor'])
+            bds = set(changed['bd'])
+            key_count = len(changed[['统计日期', '商务总监', '商务BD', '总代理']].drop_duplicates())
+            print(f"🔁 {key_count} 个 (日期, 总监, BD, 总代理) 键有变化，涉及 {len(supervisors)} 个总监、"
+                  f"{len(bds)} 个BD；重新生成: {', '.join(types)}")
+            status = self.generate(source, supervisors, bds, types)
+        
+        # 生成失败时保留旧快照，下次检查时重试
+        if status == 0:
+            self._signature = signature
+            self.save_snapshot(current)
+        return status == 0
+    
+    def run(self, interval=10, once=False):
+        """轮询数据文件（once 为 True 时只检查一次）"""
+        print(f"👀 开始监视 {self.args.drop_dir or self.args.csv}，每 {interval:g}s 检查一次（Ctrl+C 停止）")
+        try:
+            while True:
+                self.check()
+                if once:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("\n👋 已停止监视")
+
+
+# 渲染进程内复用的报表生成器（由进程池初始化函数创建）
+_WORKER_GENERATOR = None
+
+
+def _read_raw_batch(files):
+    """进程池任务：读取并拼接一批原始数据文件"""
+    global _WORKER_GENERATOR
+    if _WORKER_GENERATOR is None:
+        _WORKER_GENERATOR = DailyReportGenerator()
+    return _WORKER_GENERATOR.read_raw_batch(files)
+
+
+def _init_render_worker(renderer='matplotlib', render_cache_path=None, collect_metrics=False):
+    """渲染进程初始化：每个进程只创建一次报表生成器（沿用主进程的渲染后端、渲染缓存和指标开关）"""
+    global _WORKER_GENERATOR
+    render_cache = RenderCache(render_cache_path) if render_cache_path else None
+    metrics = RunMetrics() if collect_metrics else None
+    _WORKER_GENERATOR = DailyReportGenerator(renderer=renderer, render_cache=render_cache, metrics=metrics)
+
+
+def _run_render_job(job, generator=None):
+    """执行单个渲染任务，返回 (输出路径, 错误信息, 渲染缓存记录, 任务指标)
+    
+    启用指标时任务指标为 (耗时秒数, 该任务内各阶段的指标)，否则为 None。
+    """
+    method, args, kwargs = job
+    generator = generator or _WORKER_GENERATOR or DailyReportGenerator()
+    
+    # 每个任务单独收集阶段指标，交回主进程后按报表记录
+    run_metrics = generator.metrics
+    job_metrics = RunMetrics() if run_metrics is not None else None
+    generator.metrics = job_metrics
+    start = time.perf_counter()
+    try:
+        output_path, error = getattr(generator, method)(*args, **kwargs), None
+    except Exception as e:
+        output_path, error = None, str(e)
+    finally:
+        generator.metrics = run_metrics
+    elapsed = time.perf_counter() - start
+    
+    cache_updates = generator.render_cache.drain() if generator.render_cache is not None else []
+    timing = (elapsed, job_metrics.stages) if job_metrics is not None else None
+    return output_path, error, cache_updates, timing
+
+
+# 可选择生成的报表类型
+REPORT_TYPES = ('bd', 'kol', 'team', 'comparison')
+
+# 数据导出格式
+EXPORT_FORMATS = ('csv', 'json', 'parquet')
+
+
+def _compare_period_argument(value):
+    """--compare 的参数类型：dod、wow、mom 或不小于1的天数"""
+    try:
+        return ComparisonEngine.normalize_period(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _date_argument(value):
+    """--since/--until 的参数类型：解析为日期（无法解析时给出用法错误）"""
+    try:
+        date = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        date = pd.NaT
+    if pd.isna(date):
+        raise argparse.ArgumentTypeError(f"无法解析的日期: {value!r}（格式 YYYY-MM-DD）")
+    return date.normalize()
+
+
+def _add_data_arguments(parser):
+    """数据读取相关的参数（generate/export 共用）"""
+    parser.add_argument('--csv', default='raw_data.csv',
+                        help='原始数据文件：CSV文件（可为 .gz/.zst 压缩）、目录或通配符，多个文件并行读取后按自然键去重合并')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--chunksize', type=int, default=0,
+                      help='大于0时按该行数分块流式读取CSV（适用于超大导出文件，只支持单个文件）')
+    mode.add_argument('--incremental', action='store_true',
+                      help='增量模式：只重新聚合新增或变化的日期，报表从聚合存储生成')
+    parser.add_argument('--store', default='.cache/aggregates.sqlite', help='增量模式的聚合存储路径')
+    parser.add_argument('--compare', default='dod', type=_compare_period_argument,
+                        help="总监对比报表的对比周期：dod、wow、mom 或天数（默认 dod）")
+    parser.add_argument('--compare-sort', default='Total Vol ($)', help='总监对比报表的排序指标（默认 Total Vol ($)）')
+
+
+def _add_filter_arguments(parser):
+    """选择性生成的参数（generate/export 共用）"""
+    parser.add_argument('--supervisor', action='append', help='只生成该总监的报表（可重复指定，Other 表示无总监）')
+    parser.add_argument('--bd', action='append', help='只生成该BD的报表（BD名或维度名，可重复指定）')
+    parser.add_argument('--since', type=_date_argument, help='只生成该日期（含）之后有数据的报表，格式 YYYY-MM-DD')
+    parser.add_argument('--until', type=_date_argument, help='只生成该日期（含）之前有数据的报表；对比报表以该日期为准')
+    parser.add_argument('--types', default=','.join(REPORT_TYPES),
+                        type=lambda value: [t.strip() for t in value.split(',') if t.strip()],
+                        help=f"报表类型，逗号分隔（默认 {','.join(REPORT_TYPES)}）")
+
+
+def _add_generate_arguments(parser):
+    """generate 子命令的参数"""
+    _add_data_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='并行渲染的进程数（默认1，串行）')
+    parser.add_argument('--manifest', default='report_manifest.json', help='报表清单输出路径')
+    parser.add_argument('--renderer', choices=['matplotlib', 'pillow'], default='matplotlib',
+                        help='表格图片渲染后端（pillow 直接绘制，分辨率与 matplotlib 相同，速度快数倍）')
+    parser.add_argument('--compare-heatmap', action='store_true', help='总监对比报表按变化幅度显示颜色深浅')
+    parser.add_argument('--skip-kol', action='store_true', help='不生成总代理报表')
+    parser.add_argument('--kol-time-budget', type=float, default=0,
+                        help='总代理报表的耗时预算（秒），超出时给出提示（0表示不检查）')
+    parser.add_argument('--render-cache', default='.cache/render_manifest.json',
+                        help='渲染缓存清单路径：内容未变化的图片跳过渲染和写入')
+    parser.add_argument('--no-render-cache', action='store_true', help='不使用渲染缓存，重新渲染所有图片')
+    parser.add_argument('--metrics', default='run_metrics.json',
+                        help='运行指标（各阶段耗时、内存、行数和每张报表耗时）输出路径，空字符串表示不记录')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='用 tracemalloc 记录各阶段的Python内存峰值（会明显拖慢运行）')
+    _add_filter_arguments(parser)
+
+
+def _add_export_arguments(parser):
+    """export 子命令的参数"""
+    _add_data_arguments(parser)
+    parser.add_argument('--output-dir', default='exports', help='导出目录（默认 exports）')
+    parser.add_argument('--format', default='csv',
+                        type=lambda value: [f.strip() for f in value.split(',') if f.strip()],
+                        help=f"导出格式，逗号分隔（{', '.join(EXPORT_FORMATS)}，默认 csv）")
+    _add_filter_arguments(parser)
+
+
+def build_parser():
+    """命令行：generate（默认）、export、serve 和 watch 子命令"""
+    parser = argparse.ArgumentParser(description='LBK DataAlert 日报生成')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    generate = subparsers.add_parser('generate', help='生成报表（不指定子命令时的默认命令）')
+    _add_generate_arguments(generate)
+    generate.set_defaults(func=run_generate)
+    
+    export = subparsers.add_parser('export', help='只导出报表表格数据（CSV/JSON/Parquet），不渲染图片')
+    _add_export_arguments(export)
+    export.set_defaults(func=run_export)
+    
+    serve = subparsers.add_parser('serve', help='常驻报表服务：数据常驻内存，按需渲染报表图片')
+    serve.add_argument('--csv', default='raw_data.csv', help='原始数据文件、目录或通配符（变化时自动重新读取）')
+    serve.add_argument('--host', default='127.0.0.1', help='监听地址（默认 127.0.0.1）')
+    serve.add_argument('--port', type=int, default=8050, help='监听端口（默认 8050）')
+    serve.add_argument('--renderer', choices=['matplotlib', 'pillow'], default='pillow' if HAS_PILLOW else 'matplotlib',
+                       help='表格图片渲染后端（默认 pillow，未缓存图片约0.1秒；matplotlib 每张超过1秒）')
+    serve.add_argument('--cache-size', type=int, default=256, help='缓存的图片数（LRU，默认 256）')
+    serve.set_defaults(func=run_serve)
+    
+    watch = subparsers.add_parser('watch', help='监视原始数据，只重新生成明细行有变化的报表')
+    _add_generate_arguments(watch)
+    watch.add_argument('--drop-dir', help='监视该目录，读取其中所有数据文件并按自然键去重合并（代替 --csv）')
+    watch.add_argument('--interval', type=float, default=10, help='检查间隔（秒，默认 10）')
+    watch.add_argument('--snapshot', default='.cache/watch_snapshot.pkl', help='明细行哈希快照路径')
+    watch.add_argument('--once', action='store_true', help='只检查一次后退出（适合由定时任务调用）')
+    watch.set_defaults(func=run_watch)
+    return parser
+
+
+def main(argv=None):
+    """主函数：解析命令行并执行子命令（不带子命令时生成所有类型的报表）"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv = ['generate'] + argv
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+def load_report_cube(args, generator, report_filter, load_supervisors=None):
+    """按命令行的读取模式读取数据并构建汇总立方；读取失败时返回 None
+    
+    load_supervisors 为总监列表时只读取这些总监的分区（需要全部总监时传 None）。
+    """
+    # 读取并处理数据（命中解析缓存时跳过CSV解析和清洗；指定总监时只读取这些总监的分区）
     print("📊 读取数据文件...")
+    processed_df = None
+    aggregated_df = None
+    kol_daily = None
     try:
-        df = pd.read_csv('raw_data.csv')
-        print(f"✅ 成功读取数据，共 {len(df)} 行")
+        if args.chunksize > 0:
+            # 流式模式：分块读取并直接累加为聚合结果，不保留明细数据
+            # 需要总代理报表时同时累加总代理级的和
+            with_kol = 'kol' in args.types and not getattr(args, 'skip_kol', False)
+            with generator._stage('aggregate_streaming') as stage:
+                if with_kol:
+                    aggregated_df, kol_daily = generator.aggregate_data_streaming(
+                        args.csv, chunksize=args.chunksize, with_kol=True)
+                else:
+                    aggregated_df = generator.aggregate_data_streaming(args.csv, chunksize=args.chunksize)
+                stage['rows'] = len(aggregated_df)
+        elif args.incremental:
+            # 增量模式：只替换有变化的日期分区，再从存储读取（所需总监的）聚合结果
+            processed_df = generator.load_processed_data(args.csv)
+            print(f"✅ 数据读取与处理完成，共 {len(processed_df)} 行")
+            store = AggregateStore(args.store)
+            with generator._stage('update_store'):
+                changed_dates = generator.update_aggregate_store(processed_df, store)
+            print(f"✅ 增量更新完成，{len(changed_dates)} 个日期分区有变化")
+            with generator._stage('read_store') as stage:
+                aggregated_df = store.load('bd_daily', supervisors=load_supervisors,
+                                           columns=generator.empty_aggregate().columns)
+                kol_daily = store.load('kol_daily', supervisors=load_supervisors)
+                stage['rows'] = len(aggregated_df) + len(kol_daily)
+            store.close()
+        else:
+            processed_df = generator.load_processed_data(args.csv, supervisors=load_supervisors)
+            print(f"✅ 数据读取与处理完成，共 {len(processed_df)} 行")
     except FileNotFoundError:
-        print("❌ 未找到 raw_data.csv 文件")
-        return
+        print(f"❌ 未找到 {args.csv} 文件")
+        return None
     except Exception as e:
         print(f"❌ 读取数据时出错: {e}")
-        return
+        return None
     
-    # 处理原始数据
-    print("🔧 处理原始数据...")
-    processed_df = generator.process_raw_data(df)
-    print(f"✅ 数据处理完成")
+    # 构建本次运行共享的多层级汇总立方
+    with generator._stage('aggregate') as stage:
+        if processed_df is not None and aggregated_df is None:
+            cube = RollupCube(generator, processed_df=processed_df)
+        else:
+            if load_supervisors is not None:
+                aggregated_df = report_filter.filter_supervisors(aggregated_df)
+                if kol_daily is not None and len(kol_daily) > 0:
+                    kol_daily = report_filter.filter_supervisors(kol_daily)
+            cube = RollupCube(generator, bd_daily=aggregated_df, kol_daily=kol_daily)
+        stage['rows'] = len(cube.daily('bd'))
+    return cube
+
+
+def run_generate(args):
+    """generate 子命令：生成报表，可按总监、BD、日期范围和报表类型选择"""
+    unknown_types = set(args.types) - set(REPORT_TYPES)
+    if unknown_types:
+        print(f"❌ 未知的报表类型: {', '.join(sorted(unknown_types))}（可选 {', '.join(REPORT_TYPES)}）")
+        return 1
     
-    # 1. 生成商务BD报表（按总监→商务BD分组）
-    print("\n📈 1. 生成商务BD报表...")
-    bd_reports = generator.generate_reports(processed_df)
-    print(f"✅ 商务BD报表生成完成，共 {len(bd_reports)} 个报表")
+    report_filter = ReportFilter(args.supervisor, args.bd, args.since, args.until)
+    types = set(args.types)
+    if args.skip_kol:
+        types.discard('kol')
+    # 对比报表需要所有总监的数据；否则只读取所选总监的分区
+    load_supervisors = report_filter.supervisors if 'comparison' not in types else None
     
-    # # 2. 生成总代理报表（按总监→商务BD→总代理分组）
-    # print("\n📈 2. 生成总代理报表...")
-    # kol_reports = generator.generate_kol_reports(processed_df)
-    # print(f"✅ 总代理报表生成完成，共 {len(kol_reports)} 个报表")
-    kol_reports = []  # 初始化空列表，避免后续报错
+    if report_filter.is_selective or types != set(REPORT_TYPES):
+        print(f"🚀 开始生成报表: {', '.join(t for t in REPORT_TYPES if t in types)} {report_filter.describe()}")
+    else:
+        print("🚀 开始生成所有报表...")
     
-    # 3. 生成团队报表（按总监生成团队报表）
-    print("\n📈 3. 生成团队报表...")
+    # 创建报表生成器
+    render_cache = None if args.no_render_cache else RenderCache(args.render_cache)
+    metrics = RunMetrics(trace_memory=args.trace_memory) if args.metrics else None
+    generator = DailyReportGenerator(renderer=args.renderer, render_cache=render_cache, metrics=metrics)
     
-    # 首先聚合数据
-    aggregated_df = generator.aggregate_data(processed_df)
+    cube = load_report_cube(args, generator, report_filter, load_supervisors)
+    if cube is None:
+        return 1
     
-    # 按总监分组数据
-    supervisor_groups = generator.group_by_supervisor(aggregated_df)
+    bd_reports = []
+    kol_reports = []
     team_reports = []
+    comparison_report = None
     
-    for supervisor_name, supervisor_data in supervisor_groups.items():
-        print(f"📝 生成 {supervisor_name} 的团队报表...")
-        try:
-            # 获取该总监的所有数据
-            supervisor_df = aggregated_df[aggregated_df['Dimension'].str.startswith(supervisor_name + ' - ')]
-            report_path = generator.create_supervisor_report(supervisor_name, supervisor_df)
-            if report_path:
-                team_reports.append(report_path)
-                print(f"✅ {supervisor_name} 团队报表已生成: {report_path}")
-        except Exception as e:
-            print(f"❌ 生成 {supervisor_name} 团队报表时出错: {e}")
+    # 1. 生成商务BD报表（按总监→商务BD分组）
+    if 'bd' in types:
+        print("\n📈 1. 生成商务BD报表...")
+        with generator._stage('bd_reports') as stage:
+            bd_reports = generator.generate_reports(cube=cube, workers=args.workers, report_filter=report_filter)
+            stage['reports'] = len(bd_reports)
+        print(f"✅ 商务BD报表生成完成，共 {len(bd_reports)} 个报表")
     
-    print(f"✅ 团队报表生成完成，共 {len(team_reports)} 个报表")
+    # 2. 生成总代理报表（按总监→商务BD→总代理分组）
+    # 总代理数据已在汇总立方中一次分区，表格在渲染任务内构建，未变化的图片由渲染缓存跳过
+    if 'kol' in types:
+        print("\n📈 2. 生成总代理报表...")
+        kol_start = time.perf_counter()
+        with generator._stage('kol_reports') as stage:
+            kol_reports = generator.generate_kol_reports(cube=cube, workers=args.workers, report_filter=report_filter)
+            stage['reports'] = len(kol_reports)
+        kol_elapsed = time.perf_counter() - kol_start
+        per_report = kol_elapsed / len(kol_reports) if kol_reports else 0
+        print(f"✅ 总代理报表生成完成，共 {len(kol_reports)} 个报表，"
+              f"耗时 {kol_elapsed:.1f}s（平均 {per_report * 1000:.0f} ms/个）")
+        if args.kol_time_budget > 0:
+            if kol_elapsed > args.kol_time_budget:
+                print(f"⚠ 总代理报表耗时超出预算 {args.kol_time_budget:.0f}s，"
+                      f"可使用 --renderer pillow 或增加 --workers")
+            else:
+                print(f"⏱ 总代理报表耗时在预算内（{kol_elapsed:.1f}s / {args.kol_time_budget:.0f}s）")
+    elif args.skip_kol:
+        print("\n⏭ 已跳过总代理报表（--skip-kol）")
     
-    # 4. 生成总监对比报表（所有总监每日数据对比，含日环比变化率）
-    print("\n📈 4. 生成总监对比报表...")
-    try:
-        comparison_report = generator.create_supervisors_daily_report(processed_df, output_path='supervisor_daily_comparison.png', days=1)
-        if comparison_report:
-            print(f"✅ 总监对比报表已生成: {comparison_report}")
-    except Exception as e:
-        print(f"❌ 生成总监对比报表时出错: {e}")
+    # 3. 生成团队报表（按总监生成团队报表）
+    if 'team' in types:
+        print("\n📈 3. 生成团队报表...")
+        with generator._stage('team_reports') as stage:
+            team_reports = generator.generate_team_reports(cube, workers=args.workers, report_filter=report_filter)
+            stage['reports'] = len(team_reports)
+        print(f"✅ 团队报表生成完成，共 {len(team_reports)} 个报表")
+    
+    # 4. 生成总监对比报表（所有总监每日数据对比，含日环比/周环比/月环比变化率）
+    if 'comparison' in types:
+        print("\n📈 4. 生成总监对比报表...")
+        try:
+            # 使用汇总立方中的总监级每日数据；指定 --until 时以该日期为对比日
+            start = time.perf_counter()
+            with generator._stage('comparison_report') as stage:
+                comparison_report = generator.create_supervisors_daily_report(
+                    cube.daily('supervisor'), output_path='supervisor_daily_comparison.png', period=args.compare,
+                    sort_by=args.compare_sort, heatmap=args.compare_heatmap, as_of=args.until)
+                stage['reports'] = 1 if comparison_report else 0
+            if metrics is not None and comparison_report:
+                metrics.record_report('comparison', comparison_report, time.perf_counter() - start)
+            if comparison_report:
+                print(f"✅ 总监对比报表已生成: {comparison_report}")
+        except Exception as e:
+            print(f"❌ 生成总监对比报表时出错: {e}")
     
     # 总结
     print("\n" + "="*50)
@@ -1191,9 +3202,30 @@ def main():
     print(f"商务BD报表: {len(bd_reports)} 个")
     print(f"总代理报表: {len(kol_reports)} 个") 
     print(f"团队报表: {len(team_reports)} 个")
-    print(f"总监对比报表: 1 个")
+    print(f"总监对比报表: {1 if comparison_report else 0} 个")
+    if render_cache is not None:
+        with generator._stage('write'):
+            render_cache.save()
+        print(f"♻️ 渲染缓存: {render_cache.skipped} 张未变化已跳过，{render_cache.rendered} 张重新渲染")
     print("="*50)
     
+    # 报表清单（排序后写出，同样的输入得到同样的清单）；选择性生成时并入已有清单
+    with generator._stage('write'):
+        generator.write_manifest({
+            'bd': bd_reports,
+            'kol': kol_reports,
+            'team': team_reports,
+            'comparison': [comparison_report] if comparison_report else [],
+        }, args.manifest, merge=report_filter.is_selective or types != set(REPORT_TYPES))
+    print(f"📝 报表清单已写入: {args.manifest}")
+    
+    # 运行指标（各阶段耗时、内存峰值和每张报表的耗时分布）
+    if metrics is not None:
+        print("\n⏱ 各阶段耗时:")
+        metrics.print_summary()
+        metrics.save(args.metrics)
+        print(f"📝 运行指标已写入: {args.metrics}")
+    
     # 显示生成的文件结构
     print("\n📁 生成的文件结构:")
     
@@ -1211,7 +3243,77 @@ def main():
     
     if os.path.exists('supervisor_daily_comparison.png'):
         print("supervisor_daily_comparison.png - 总监对比报表")
+    
+    return 0
+
+
+def run_export(args):
+    """export 子命令：只计算并导出报表表格数据，不导入 matplotlib"""
+    unknown_types = set(args.types) - set(REPORT_TYPES)
+    unknown_formats = set(args.format) - set(EXPORT_FORMATS)
+    if unknown_types or unknown_formats:
+        print(f"❌ 未知的报表类型或导出格式: {', '.join(sorted(unknown_types | unknown_formats))}")
+        return 1
+    formats = list(args.format)
+    if 'parquet' in formats and not HAS_PYARROW:
+        print("⚠ 未安装pyarrow，跳过Parquet格式")
+        formats.remove('parquet')
+    if not formats:
+        return 1
+    
+    report_filter = ReportFilter(args.supervisor, args.bd, args.since, args.until)
+    types = [t for t in REPORT_TYPES if t in args.types]
+    load_supervisors = report_filter.supervisors if 'comparison' not in types else None
+    print(f"🚀 开始导出表格数据: {', '.join(types)} -> {args.output_dir} ({', '.join(formats)}) "
+          f"{report_filter.describe()}")
+    
+    start = time.perf_counter()
+    generator = DailyReportGenerator()
+    cube = load_report_cube(args, generator, report_filter, load_supervisors)
+    if cube is None:
+        return 1
+    
+    exported = generator.export_tables(cube, args.output_dir, formats, types, report_filter,
+                                       period=args.compare, sort_by=args.compare_sort, as_of=args.until)
+    for report_type, paths in exported.items():
+        print(f"✅ {report_type}: {', '.join(paths)}")
+    print(f"📦 导出完成，耗时 {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def run_serve(args):
+    """serve 子命令：启动常驻报表服务"""
+    report_server = ReportServer(args.csv, renderer=args.renderer, cache_size=args.cache_size)
+    try:
+        report_server.warm_up()
+    except FileNotFoundError:
+        print(f"❌ 未找到 {args.csv} 文件")
+        return 1
+    
+    httpd = ThreadingHTTPServer((args.host, args.port), _ReportRequestHandler)
+    httpd.report_server = report_server
+    print(f"🌐 报表服务已启动: http://{args.host}:{args.port}/reports（Ctrl+C 停止）")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 报表服务已停止")
+    finally:
+        httpd.server_close()
+    return 0
+
+
+def run_watch(args):
+    """watch 子命令：监视数据文件，增量重新生成受影响的报表"""
+    unknown_types = set(args.types) - set(REPORT_TYPES)
+    if unknown_types:
+        print(f"❌ 未知的报表类型: {', '.join(sorted(unknown_types))}（可选 {', '.join(REPORT_TYPES)}）")
+        return 1
+    if args.drop_dir and not os.path.isdir(args.drop_dir):
+        print(f"❌ 未找到目录 {args.drop_dir}")
+        return 1
+    ReportWatcher(args).run(interval=args.interval, once=args.once)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
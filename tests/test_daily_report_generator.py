@@ -0,0 +1,423 @@
+"""daily_report_generator 的回归测试（python -m unittest discover tests）"""
+import os
+import sys
+import contextlib
+import io
+import json
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daily_report_generator import (  # noqa: E402
+    HAS_PILLOW, AggregateStore, ComparisonEngine, DailyReportGenerator, RenderCache, RollupCube, RunMetrics,
+    ReportServer, ReportWatcher, build_parser,
+)
+
+
+def make_raw_frame(days=6, seed=0):
+    """构造一份小的原始数据：两个总监、无总监的BD、离职BD和空总代理都有覆盖"""
+    rng = np.random.default_rng(seed)
+    generator = DailyReportGenerator()
+    hierarchy = [
+        ('Sup1', 'alice', 'kol_a'), ('Sup1', 'alice', ''), ('Sup1', 'bob', 'kol_b'),
+        ('Sup2', 'carol', 'kol_c'), ('Sup2', 'dave(离职)', 'kol_d'), ('', 'solo', 'kol_s'),
+    ]
+    rows = []
+    for day in pd.date_range('2025-10-10', periods=days):
+        for supervisor, bd, kol in hierarchy:
+            rows.append({'统计日期': day.strftime('%Y-%m-%d'), '商务总监': supervisor, '商务BD': bd, '总代理': kol})
+    df = pd.DataFrame(rows)
+    for col in generator.numeric_columns:
+        df[col] = np.round(rng.exponential(500, len(df)), 2)
+    return df
+
+
+class GeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.generator = DailyReportGenerator()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_csv(self, df, name='raw_data.csv'):
+        path = os.path.join(self.tmp.name, name)
+        df.to_csv(path, index=False)
+        return path
+
+    def assertSameAggregate(self, left, right):
+        """比较两份聚合结果（与行顺序、列顺序和分类类型无关）"""
+        columns = sorted(left.columns)
+        self.assertEqual(columns, sorted(right.columns))
+        keys = [col for col in ('Date', 'Dimension', 'Supervisor', 'BD', '总代理') if col in columns]
+
+        def normalize(df):
+            df = df[columns].copy()
+            for col in keys:
+                df[col] = df[col].astype(str)
+            return df.sort_values(keys).reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(normalize(left), normalize(right), check_dtype=False)
+
+
+class ParseCacheTest(GeneratorTestCase):
+    def load(self, path):
+        """读取一次，返回 (处理后的数据, 本次是否命中缓存)"""
+        metrics = RunMetrics()
+        generator = DailyReportGenerator(metrics=metrics)
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = generator.load_processed_data(path, cache_dir=os.path.join(self.tmp.name, 'cache'))
+        return df, 'read_cache' in metrics.stages and 'read_csv' not in metrics.stages
+
+    def test_unchanged_csv_hits_cache(self):
+        path = self.write_csv(make_raw_frame())
+        first, first_hit = self.load(path)
+        second, second_hit = self.load(path)
+        self.assertFalse(first_hit)
+        self.assertTrue(second_hit)
+        pd.testing.assert_frame_equal(first.reset_index(drop=True).astype(str), second.astype(str))
+
+    def test_changed_csv_misses_cache(self):
+        """内容变化（即使大小不变）时不使用旧的缓存"""
+        raw = make_raw_frame()
+        path = self.write_csv(raw)
+        self.load(path)
+
+        raw.loc[0, '现货交易金额'] = 12345.67
+        raw.loc[1, '现货交易金额'] = 76543.21
+        self.write_csv(raw)
+        df, hit = self.load(path)
+        self.assertFalse(hit)
+        self.assertEqual(df['现货交易金额'].iloc[0], 12345.67)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp.name, 'cache'))), 1)
+
+
+class StreamingAggregationTest(GeneratorTestCase):
+    def test_junk_numeric_value_in_chunk(self):
+        """分块读取时数值列中的无法解析的值与整体读取一样按0处理"""
+        raw = make_raw_frame()
+        raw[['现货交易金额', '净充值折U']] = raw[['现货交易金额', '净充值折U']].astype(object)
+        raw.loc[9, '现货交易金额'] = '--'
+        raw.loc[20, '净充值折U'] = '1,234.50'
+        path = self.write_csv(raw)
+
+        streamed = self.generator.aggregate_data_streaming(path, chunksize=7)
+        full = self.generator.aggregate_data(self.generator.process_raw_data(self.generator.read_raw_csv(path)))
+        self.assertSameAggregate(streamed, full)
+
+    def test_kol_level_matches_full_read(self):
+        """流式模式同时累加的总代理级结果与 aggregate_data_by_kol 一致，汇总立方的 kol 层级不为空"""
+        path = self.write_csv(make_raw_frame())
+        bd_daily, kol_daily = self.generator.aggregate_data_streaming(path, chunksize=5, with_kol=True)
+        processed = self.generator.process_raw_data(self.generator.read_raw_csv(path))
+        self.assertSameAggregate(kol_daily, self.generator.aggregate_data_by_kol(processed))
+
+        cube = RollupCube(self.generator, bd_daily=bd_daily, kol_daily=kol_daily)
+        self.assertEqual(len(cube.partitions('kol')), 4)
+
+    def test_no_rows_left_after_cleaning(self):
+        """全部是离职记录时返回带列结构的空结果，与整体读取一样可以构建汇总立方"""
+        raw = make_raw_frame()
+        raw['商务BD'] = raw['商务BD'] + '(离职)'
+        path = self.write_csv(raw)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bd_daily, kol_daily = self.generator.aggregate_data_streaming(path, chunksize=5, with_kol=True)
+            full = self.generator.aggregate_data(self.generator.process_raw_data(self.generator.read_raw_csv(path)))
+        self.assertEqual(len(bd_daily), 0)
+        self.assertEqual(sorted(bd_daily.columns), sorted(full.columns))
+        cube = RollupCube(self.generator, bd_daily=bd_daily, kol_daily=kol_daily)
+        self.assertEqual(len(cube.daily('supervisor')), 0)
+
+    def test_multiple_files_are_rejected(self):
+        """多个文件无法流式地做跨文件去重，分块读取直接报错而不是给出与默认模式不同的结果"""
+        raw = make_raw_frame()
+        os.makedirs(os.path.join(self.tmp.name, 'daily'))
+        self.write_csv(raw.iloc[:18], os.path.join('daily', 'a.csv'))
+        self.write_csv(raw.iloc[18:], os.path.join('daily', 'b.csv'))
+        with self.assertRaises(ValueError):
+            self.generator.aggregate_data_streaming(os.path.join(self.tmp.name, 'daily'), chunksize=5)
+
+
+class MultiFileInputTest(GeneratorTestCase):
+    def test_later_file_overrides_earlier_rows(self):
+        """更正文件中的行覆盖之前文件中相同自然键的行；同一文件内的重复键保持不变"""
+        raw = make_raw_frame(days=2)
+        raw = pd.concat([raw, raw.iloc[[0]]], ignore_index=True)
+        correction = raw.iloc[[2]].copy()
+        correction['现货交易金额'] = 99999.0
+        os.makedirs(os.path.join(self.tmp.name, 'daily'))
+        self.write_csv(raw, os.path.join('daily', '2025-10-11.csv'))
+        self.write_csv(correction, os.path.join('daily', '2025-10-11_fix.csv'))
+
+        files = self.generator.input_files(os.path.join(self.tmp.name, 'daily'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            combined = self.generator.read_raw_files(files, workers=1)
+        self.assertEqual(len(combined), len(raw))
+        keys = ['统计日期', '商务总监', '商务BD', '总代理']
+        corrected = combined.astype({col: str for col in keys}).merge(correction[keys].astype(str), on=keys)
+        self.assertEqual(list(corrected['现货交易金额']), [99999.0])
+        first = combined.astype({col: str for col in keys}).merge(raw.iloc[[0]][keys].astype(str), on=keys)
+        self.assertEqual(len(first), 2)
+
+
+class IncrementalStoreTest(GeneratorTestCase):
+    def update_and_load(self, raw, store):
+        processed = self.generator.process_raw_data(raw.copy())
+        changed = self.generator.update_aggregate_store(processed, store)
+        return changed, store.load('bd_daily'), store.load('kol_daily'), processed
+
+    def test_removed_date_matches_full_rebuild(self):
+        """输入中删除一个日期后，增量存储的结果与全量重建一致"""
+        store = AggregateStore(os.path.join(self.tmp.name, 'aggregates.sqlite'))
+        self.addCleanup(store.close)
+        raw = make_raw_frame()
+        self.update_and_load(raw, store)
+
+        removed = raw[raw['统计日期'] != '2025-10-13'].reset_index(drop=True)
+        changed, bd_daily, kol_daily, processed = self.update_and_load(removed, store)
+
+        self.assertEqual(changed, ['2025-10-13'])
+        self.assertNotIn('2025-10-13', set(bd_daily['Date']))
+        self.assertNotIn('2025-10-13', store.partition_fingerprints())
+        self.assertSameAggregate(bd_daily, self.generator.aggregate_data(processed))
+        self.assertSameAggregate(kol_daily, self.generator.aggregate_data_by_kol(processed))
+
+    def test_store_without_rows_loads_empty_schema(self):
+        """所有记录都被过滤、聚合表从未创建时，读取结果仍带有聚合列，可以构建汇总立方"""
+        store = AggregateStore(os.path.join(self.tmp.name, 'aggregates.sqlite'))
+        self.addCleanup(store.close)
+        raw = make_raw_frame()
+        raw['商务BD'] = raw['商务BD'] + '(离职)'
+        self.update_and_load(raw, store)
+
+        columns = self.generator.empty_aggregate().columns
+        bd_daily = store.load('bd_daily', columns=columns)
+        self.assertEqual(list(bd_daily.columns), list(columns))
+        cube = RollupCube(self.generator, bd_daily=bd_daily, kol_daily=store.load('kol_daily'))
+        self.assertEqual(len(cube.daily('supervisor')), 0)
+
+
+class SupervisorComparisonTest(GeneratorTestCase):
+    def test_rows_without_supervisor_are_labelled_other(self):
+        """没有总监的数据在对比报表中记为 Other，而不是空名字"""
+        processed = self.generator.process_raw_data(make_raw_frame())
+        cube = RollupCube(self.generator, processed_df=processed)
+        comparison = self.generator.compare_supervisors(cube.daily('supervisor'))
+        self.assertEqual(sorted(comparison['entities']), ['Other', 'Sup1', 'Sup2'])
+
+    def test_supervisor_named_other_is_kept_apart(self):
+        """名为 Other 的总监不会和没有总监的数据合并"""
+        raw = make_raw_frame()
+        raw['商务总监'] = raw['商务总监'].replace('Sup2', 'Other')
+        processed = self.generator.process_raw_data(raw)
+        cube = RollupCube(self.generator, processed_df=processed)
+        self.assertEqual(sorted(cube.partitions('supervisor')), ['', 'Other', 'Sup1'])
+
+        comparison = self.generator.compare_supervisors(cube.daily('supervisor'))
+        self.assertEqual(sorted(comparison['entities']), ['Other', 'Other (无总监)', 'Sup1'])
+        other = list(comparison['entities']).index('Other')
+        bd_daily = cube.daily('bd')
+        latest = bd_daily[(bd_daily['Date'] == bd_daily['Date'].max()) & (bd_daily['Supervisor'] == 'Other')]
+        self.assertAlmostEqual(comparison['current'][other, 0], latest[comparison['metrics'][0]].sum())
+
+
+class ComparePeriodTest(GeneratorTestCase):
+    def test_valid_periods(self):
+        for value, expected in [('dod', 'dod'), ('WoW', 'wow'), ('mom', 'mom'), ('3', 3), (7, 7)]:
+            self.assertEqual(ComparisonEngine.normalize_period(value), expected)
+
+    def test_invalid_periods_raise(self):
+        """未知名称、0和负数天数都不合法（0会拿每天和自己比较，负数会和之后的日期比较）"""
+        processed = self.generator.process_raw_data(make_raw_frame())
+        engine = ComparisonEngine(RollupCube(self.generator, processed_df=processed).daily('supervisor'),
+                                  self.generator.comparison_metrics)
+        for value in ('abc', '0', '-2', 0, -1, 1.5, True):
+            with self.assertRaises(ValueError):
+                engine.previous_index(value)
+
+    def test_cli_rejects_invalid_period(self):
+        parser = build_parser()
+        self.assertEqual(parser.parse_args(['export', '--compare', '14']).compare, 14)
+        for value in ('abc', '0', '-1'):
+            with self.assertRaises(SystemExit) as raised, contextlib.redirect_stderr(io.StringIO()):
+                parser.parse_args(['export', '--compare', value])
+            self.assertEqual(raised.exception.code, 2)
+
+
+class ExportTablesTest(GeneratorTestCase):
+    def test_bd_rows_match_table_layout(self):
+        """导出的每个BD的行类型、标签和数值与渲染用的 table_layout 一致（跨月数据含周、月和TOTAL行）"""
+        processed = self.generator.process_raw_data(make_raw_frame(days=40))
+        cube = RollupCube(self.generator, processed_df=processed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            exported = self.generator.export_tables(cube, output_dir=self.tmp.name, types=('bd',))
+        frame = pd.read_csv(exported['bd'][0])
+
+        partitions = cube.partitions('bd')
+        self.assertEqual(sorted(set(frame['Dimension'])), sorted(partitions))
+        for dimension, rows in frame.groupby('Dimension'):
+            daily, rollups, columns, _, _ = self.generator._table_inputs(
+                partitions[dimension], rollups=cube.entity_rollups('bd', dimension))
+            layout = self.generator.table_layout(daily, rollups, columns)
+            self.assertEqual(list(rows['Row Type']), layout['row_types'])
+            self.assertEqual(list(rows['Label']), list(layout['labels']))
+            self.assertEqual({'daily', 'week', 'month', 'TOTAL'}, set(layout['row_types']))
+            np.testing.assert_allclose(rows[columns[1:]].to_numpy(dtype=float), layout['values'], rtol=1e-9)
+
+
+class FilterArgumentsTest(unittest.TestCase):
+    def test_dates_are_parsed_by_argparse(self):
+        args = build_parser().parse_args(['generate', '--since', '2025-10-11', '--until', '2025-10-13'])
+        self.assertEqual((args.since, args.until), (pd.Timestamp('2025-10-11'), pd.Timestamp('2025-10-13')))
+
+    def test_invalid_date_is_a_usage_error(self):
+        for option, value in (('--since', '2025-13-40'), ('--until', 'yesterday'), ('--since', '')):
+            with self.assertRaises(SystemExit) as raised, contextlib.redirect_stderr(io.StringIO()):
+                build_parser().parse_args(['export', option, value])
+            self.assertEqual(raised.exception.code, 2)
+
+
+class FormatNumbersTest(GeneratorTestCase):
+    EDGE_VALUES = [
+        np.nan, 0.0, -0.0, 1.0, -1.0, 0.04, 0.05, 0.06, -0.05, 0.95, 2.5, 3.5, 9.94, 9.95, 9.96, -9.95,
+        9.999, 10.0, 10.5, 11.5, -10.5, 999.5, 1000.0, -1234.56, 999999.5, 1e6, -1e6, 1234567.89,
+        -9876543.21, 2 ** 53, 1e17, 1e18, 1e20, -1e20, np.inf, -np.inf,
+    ]
+
+    def assertMatchesScalar(self, values):
+        values = np.asarray(values, dtype=float)
+        expected = [self.generator.format_number(value) for value in values.tolist()]
+        actual = self.generator.format_numbers(values).tolist()
+        mismatches = [(value, e, a) for value, e, a in zip(values.tolist(), expected, actual) if e != a]
+        self.assertEqual(mismatches, [])
+
+    def test_edge_values(self):
+        """NaN、0、负数、小于10的小数、百万以上和无穷大与 format_number 逐个一致"""
+        self.assertMatchesScalar(self.EDGE_VALUES)
+
+    def test_random_values(self):
+        """各数量级的随机值（含两位小数和整数）与 format_number 逐个一致"""
+        rng = np.random.default_rng(0)
+        magnitudes = 10.0 ** rng.integers(-3, 10, 20000)
+        values = rng.uniform(-1, 1, 20000) * magnitudes
+        self.assertMatchesScalar(np.concatenate([values, np.round(values, 2), np.round(values)]))
+
+    def test_keeps_shape(self):
+        frame = pd.DataFrame({'a': [1.0, np.nan], 'b': [12345.6, -0.5]})
+        self.assertEqual(self.generator.format_numbers(frame).tolist(), [['1', '12,346'], ['0', '-0.5']])
+
+
+@unittest.skipUnless(HAS_PILLOW, '需要 Pillow')
+class RunMetricsTest(GeneratorTestCase):
+    def test_team_reports_count_only_written_images(self):
+        """没有输出的 Other 团队任务不计入团队报表数量"""
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        metrics = RunMetrics()
+        generator = DailyReportGenerator(renderer='pillow', metrics=metrics)
+        cube = RollupCube(generator, processed_df=generator.process_raw_data(make_raw_frame(days=3)))
+
+        reports = generator.generate_team_reports(cube, output_dir=os.path.join(self.tmp.name, 'teams'))
+        self.assertEqual(len(reports), 2)
+        self.assertEqual(metrics.report_summary()['team']['count'], len(reports))
+
+
+@unittest.skipUnless(HAS_PILLOW, '需要 Pillow')
+class RenderCacheTest(GeneratorTestCase):
+    def generate(self, raw):
+        """用新的 RenderCache 生成一次BD报表，返回 (缓存, {BD名: 图片路径})"""
+        cache = RenderCache(os.path.join(self.tmp.name, 'render_manifest.json'))
+        generator = DailyReportGenerator(renderer='pillow', render_cache=cache)
+        with contextlib.redirect_stdout(io.StringIO()):
+            files = generator.generate_reports(processed_df=generator.process_raw_data(raw.copy()),
+                                               output_dir=os.path.join(self.tmp.name, 'bd_reports'))
+        cache.save()
+        return cache, {os.path.basename(path).split('_')[0]: path for path in files}
+
+    def test_only_changed_tables_are_rendered(self):
+        """未变化的重跑不渲染也不改写文件；改一个单元格只重新渲染受影响的图片"""
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        raw = make_raw_frame(days=3)
+        cache, files = self.generate(raw)
+        self.assertEqual((cache.rendered, cache.skipped), (len(files), 0))
+        for path in files.values():
+            os.utime(path, (1, 1))
+
+        cache, _ = self.generate(raw)
+        self.assertEqual((cache.rendered, cache.skipped), (0, len(files)))
+        self.assertTrue(all(os.stat(path).st_mtime == 1 for path in files.values()))
+
+        raw.loc[(raw['商务BD'] == 'bob') & (raw['统计日期'] == '2025-10-12'), '现货交易金额'] += 1000
+        cache, _ = self.generate(raw)
+        self.assertEqual((cache.rendered, cache.skipped), (1, len(files) - 1))
+        self.assertEqual([name for name, path in files.items() if os.stat(path).st_mtime != 1], ['bob'])
+
+
+@unittest.skipUnless(HAS_PILLOW, '需要 Pillow')
+class ReportServerTest(GeneratorTestCase):
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        self.server = ReportServer(self.write_csv(make_raw_frame(days=3)), renderer='pillow')
+
+    def test_invalid_query_parameters_are_bad_requests(self):
+        for query in ('period=abc', 'period=0', 'period=-1', 'sort=nope'):
+            status, content_type, _ = self.server.get(f'/comparison.png?{query}')
+            self.assertEqual((status, content_type), (400, 'application/json'), query)
+
+    def test_valid_query_renders_and_is_cached(self):
+        status, content_type, body = self.server.get('/comparison.png?period=WoW')
+        self.assertEqual((status, content_type), (200, 'image/png'))
+        self.assertEqual(self.server.get('/comparison.png?period=wow')[2], body)
+        self.assertEqual(self.server.hits, 1)
+        self.assertEqual(self.server.get('/nope.png')[0], 404)
+
+    def test_listed_reports_all_render(self):
+        """/reports 只列出能生成的报表（没有总监的 Other 分组没有团队表格，不列出）"""
+        status, _, body = self.server.get('/reports')
+        listing = json.loads(body)
+        self.assertEqual(listing['team'], ['/team/Sup1.png', '/team/Sup2.png'])
+        for url in listing['bd'] + listing['team']:
+            self.assertEqual(self.server.get(url)[:2], (200, 'image/png'), url)
+
+    def test_serve_defaults_to_pillow(self):
+        self.assertEqual(build_parser().parse_args(['serve']).renderer, 'pillow')
+
+
+
+@unittest.skipUnless(HAS_PILLOW, '需要 Pillow')
+class ReportWatcherTest(GeneratorTestCase):
+    def test_drop_dir_keeps_earlier_files(self):
+        """--drop-dir 读取目录中的所有文件：新文件到达后之前各天的数据仍在快照中"""
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        drop_dir = os.path.join(self.tmp.name, 'drop')
+        os.makedirs(drop_dir)
+        raw = make_raw_frame(days=4)
+        dates = sorted(raw['统计日期'].unique())
+        for date in dates[:3]:
+            raw[raw['统计日期'] == date].to_csv(os.path.join(drop_dir, f'{date}.csv'), index=False)
+
+        args = build_parser().parse_args(['watch', '--drop-dir', drop_dir, '--once', '--renderer', 'pillow',
+                                          '--types', 'comparison', '--snapshot', 'snapshot.pkl'])
+        watcher = ReportWatcher(args)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(watcher.check())
+        self.assertEqual(sorted(pd.read_pickle('snapshot.pkl')['统计日期'].unique()), dates[:3])
+
+        raw[raw['统计日期'] == dates[3]].to_csv(os.path.join(drop_dir, f'{dates[3]}.csv'), index=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(watcher.check())
+        self.assertEqual(sorted(pd.read_pickle('snapshot.pkl')['统计日期'].unique()), dates)
+
+
+if __name__ == '__main__':
+    unittest.main()